@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# ArchiveMetadata.py
+# Reads the artist out of the ComicInfo.xml file inside a .cbz/.zip archive, for
+# doujins whose filename doesn't say who drew them.
+#
+# The archive is memory-mapped and handed to zipfile, which only reads the end
+# of central directory record and the central directory. Only ComicInfo.xml is
+# then decompressed (and at most MAX_COMIC_INFO_SIZE bytes of it), so the cost
+# doesn't depend on the size of the archive. Results are cached by
+# (path, size, mtime), so asking again about an unchanged file is free.
+#
+# Usage: ./ArchiveMetadata.py some_file.cbz [another_file.zip ...]
+# -------------------------------------------------------------------------------
+
+from functools import lru_cache
+from xml.etree import ElementTree
+import argparse
+import logging
+import mmap
+import os
+import zipfile
+
+METADATA_FORMATS = ['.zip', '.cbz']
+COMIC_INFO_NAME = "comicinfo.xml"
+
+# ComicInfo.xml fields that can hold the artist, in the order they're tried.
+ARTIST_FIELD_LIST = ["Writer", "Penciller", "Inker", "CoverArtist"]
+
+# ComicInfo.xml is a few KiB at most, so anything larger than this isn't read past this point.
+MAX_COMIC_INFO_SIZE = 1 << 20
+
+# Number of archives whose result is remembered.
+METADATA_CACHE_SIZE = 1 << 14
+
+
+class MappedFile:
+    """File object over an mmap for zipfile. mmap already has read(), seek() and tell(), but seekable() only
+    arrived in Python 3.13."""
+
+    def __init__(self, mapped_file: mmap.mmap):
+        self.mapped_file = mapped_file
+
+    def __getattr__(self, attribute):
+        return getattr(self.mapped_file, attribute)
+
+    def seekable(self):
+        return True
+
+
+def find_comic_info_member(archive: zipfile.ZipFile):
+    """Return the ZipInfo of the archive's ComicInfo.xml, preferring the one closest to the root, or None."""
+    candidate_list = [info for info in archive.infolist()
+                      if os.path.basename(info.filename).lower() == COMIC_INFO_NAME and not info.is_dir()]
+    if not candidate_list:
+        return None
+    return min(candidate_list, key=lambda info: info.filename.count("/"))
+
+
+def parse_comic_info_artist(comic_info: bytes):
+    """Return the first artist named in a ComicInfo.xml document, or None."""
+    try:
+        root = ElementTree.fromstring(comic_info)
+    except ElementTree.ParseError as error:
+        logging.debug(f"parse_comic_info_artist(): Invalid ComicInfo.xml: {error}")
+        return None
+
+    for field in ARTIST_FIELD_LIST:
+        value = root.findtext(field)
+        if not value:
+            continue
+        # Several people are listed as "First Artist, Second Artist".
+        artist = value.split(",")[0].strip()
+        if artist:
+            return artist
+
+    return None
+
+
+def read_comic_info_artist(path):
+    """Read the artist from the ComicInfo.xml inside the archive at path. Returns None if there isn't one."""
+    with open(path, "rb") as archive_file:
+        # mmap() refuses empty files, and those can't be archives anyway.
+        if os.fstat(archive_file.fileno()).st_size == 0:
+            return None
+
+        with mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            with zipfile.ZipFile(MappedFile(mapped_file)) as archive:
+                info = find_comic_info_member(archive)
+                if info is None:
+                    return None
+
+                with archive.open(info) as member:
+                    comic_info = member.read(MAX_COMIC_INFO_SIZE)
+
+    return parse_comic_info_artist(comic_info)
+
+
+@lru_cache(maxsize=METADATA_CACHE_SIZE)
+def read_cached_comic_info_artist(path, size, mtime_ns):
+    """read_comic_info_artist() cached by (path, size, mtime_ns), so a file that changed is read again."""
+    try:
+        return read_comic_info_artist(path)
+    except (OSError, ValueError, zipfile.BadZipFile, NotImplementedError, RuntimeError) as error:
+        # Broken, encrypted or not really a zip file.
+        logging.debug(f"read_cached_comic_info_artist(): Could not read {path}: {error}")
+        return None
+
+
+def get_archive_artist(path):
+    """Return the artist stored in an archive's metadata, or None if it has none (or isn't a .zip/.cbz)."""
+    path = os.fspath(path)
+    if os.path.splitext(path)[1].lower() not in METADATA_FORMATS:
+        return None
+
+    try:
+        stat_result = os.stat(path)
+    except OSError as error:
+        logging.debug(f"get_archive_artist(): Could not stat {path}: {error}")
+        return None
+
+    return read_cached_comic_info_artist(os.path.abspath(path), stat_result.st_size, stat_result.st_mtime_ns)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archive_list", help="Archives to read the artist from.", nargs="+", type=str)
+
+    arguments = parser.parse_args()
+
+    for archive_path in arguments.archive_list:
+        print(f"{archive_path}: {get_archive_artist(archive_path) or 'No artist in the metadata'}")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# ArtistNameIndex.py
+# Finds artist directories in the library that are really the same artist
+# spelled differently ("Artist Name", "ArtistName", "artist_name", ...).
+#
+# Names are first normalized (Unicode NFKC, case folded, separators and
+# punctuation dropped), which already groups most variants. For the rest, every
+# normalized name is split into character trigrams and an inverted index maps
+# each trigram to the names containing it. When grouping the whole library,
+# only the rarest few trigrams of each name are indexed (prefix filtering): two
+# names can only be similar enough if those prefixes overlap, so the tens of
+# thousands of directories are never compared pair by pair.
+#
+# Usage: ./ArtistNameIndex.py "../Doujins by Author" [--min-similarity 0.8]
+# -------------------------------------------------------------------------------
+
+from collections import Counter
+from math import ceil
+from pathlib import Path
+import argparse
+import logging
+import os
+import re
+import unicodedata
+
+NGRAM_SIZE = 3
+DEFAULT_MIN_SIMILARITY = 0.8
+
+# Normalized names shorter than this are only matched exactly; a typo in a short name makes it a different name.
+MIN_FUZZY_LENGTH = 5
+
+# Everything that isn't a letter or digit, including "_" which \W keeps.
+SEPARATOR_PATTERN = re.compile(r"[\W_]+")
+
+
+def normalize_artist_name(name: str):
+    """Return the key used to compare artist names: "Artist Name", "ArtistName" and "artist_name" all give
+    "artistname"."""
+    return SEPARATOR_PATTERN.sub("", unicodedata.normalize("NFKC", name).casefold())
+
+
+def generate_ngram_set(key: str, ngram_size=NGRAM_SIZE):
+    """Return the character n-grams of a normalized name, with its start and end marked."""
+    padded_key = f"^{key}$"
+    return {padded_key[index:index + ngram_size] for index in range(max(1, len(padded_key) - ngram_size + 1))}
+
+
+def calculate_name_similarity(name, other_name):
+    """Return how alike two artist names are, from 0 to 1, the same way find_similar() measures it.
+
+    Names that normalize to the same key are 1.0. Otherwise it's the Jaccard similarity of their trigrams, which is
+    0.0 if either name is too short to be matched fuzzily.
+    """
+    key, other_key = normalize_artist_name(name), normalize_artist_name(other_name)
+    if key == other_key:
+        return 1.0
+    if len(key) < MIN_FUZZY_LENGTH or len(other_key) < MIN_FUZZY_LENGTH:
+        return 0.0
+
+    ngram_set, other_ngram_set = generate_ngram_set(key), generate_ngram_set(other_key)
+    shared_count = len(ngram_set & other_ngram_set)
+    return shared_count / (len(ngram_set) + len(other_ngram_set) - shared_count)
+
+
+class ArtistNameIndex:
+    """Index of artist directories by normalized name, with n-gram blocking for fuzzy matches."""
+
+    def __init__(self):
+        # {normalized name: [directory, ...]}
+        self.directory_dict = {}
+        # Per normalized name, in the order they were first added.
+        self.key_list = []
+        self.ngram_set_list = []
+        # {n-gram: [key id, ...]}
+        self.posting_dict = {}
+
+    @classmethod
+    def from_library(cls, library_directory):
+        """Index every artist directory in library_directory, which holds {bucket}/{Artist}/ directories."""
+        artist_index = cls()
+        try:
+            with os.scandir(library_directory) as bucket_iterator:
+                bucket_list = [entry.path for entry in bucket_iterator if entry.is_dir()]
+        except FileNotFoundError:
+            return artist_index
+
+        for bucket in bucket_list:
+            with os.scandir(bucket) as artist_iterator:
+                for entry in artist_iterator:
+                    if entry.is_dir():
+                        artist_index.add(entry.path)
+
+        logging.debug(f"ArtistNameIndex: Indexed {len(artist_index)} artist directories "
+                      f"({len(artist_index.key_list)} distinct names) in {library_directory}.")
+        return artist_index
+
+    def __len__(self):
+        return sum(len(directory_list) for directory_list in self.directory_dict.values())
+
+    def add(self, directory):
+        """Add an artist directory. Its name is the last component of the path."""
+        directory = str(directory)
+        key = normalize_artist_name(os.path.basename(directory))
+        if not key:
+            return
+
+        directory_list = self.directory_dict.get(key)
+        if directory_list is not None:
+            if directory not in directory_list:
+                directory_list.append(directory)
+            return
+
+        self.directory_dict.update({key: [directory]})
+        key_id = len(self.key_list)
+        self.key_list.append(key)
+        ngram_set = generate_ngram_set(key) if len(key) >= MIN_FUZZY_LENGTH else set()
+        self.ngram_set_list.append(ngram_set)
+        for ngram in ngram_set:
+            self.posting_dict.setdefault(ngram, []).append(key_id)
+
+    def find_existing(self, name):
+        """Return the indexed directory whose name normalizes to the same key as name, or None.
+
+        A directory named exactly name wins; otherwise the first of them in sorted order is used, so the choice
+        doesn't depend on the order the directories were listed in.
+        """
+        directory_list = self.directory_dict.get(normalize_artist_name(name))
+        if not directory_list:
+            return None
+        for directory in directory_list:
+            if os.path.basename(directory) == name:
+                return directory
+        return min(directory_list)
+
+    def find_similar(self, name, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """Return [(similarity, directory), ...] for the indexed directories whose name looks like name, best first.
+
+        Only names sharing at least one n-gram with name are looked at.
+        """
+        key = normalize_artist_name(name)
+        result_list = [(1.0, directory) for directory in self.directory_dict.get(key, [])]
+        if len(key) < MIN_FUZZY_LENGTH:
+            return result_list
+
+        ngram_set = generate_ngram_set(key)
+        shared_count = Counter()
+        for ngram in ngram_set:
+            shared_count.update(self.posting_dict.get(ngram, []))
+
+        for key_id, count in shared_count.items():
+            similarity = count / (len(ngram_set) + len(self.ngram_set_list[key_id]) - count)
+            if similarity >= min_similarity and self.key_list[key_id] != key:
+                result_list.extend((similarity, directory) for directory in self.directory_dict[self.key_list[key_id]])
+
+        return sorted(result_list, key=lambda result: -result[0])
+
+    def find_merge_groups(self, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """Return a list of directory lists, each holding directories that look like the same artist.
+
+        Directories with the same normalized name are always grouped. Names that are merely similar are linked if
+        their similarity reaches min_similarity, and links are followed (a union-find), so a group can hold names
+        that are each only similar to some other member. Use calculate_name_similarity() to check members against
+        the one they would be merged into. Directories without a look-alike aren't returned.
+        """
+        parent_list = list(range(len(self.key_list)))
+
+        def find_root(key_id):
+            while parent_list[key_id] != key_id:
+                parent_list[key_id] = parent_list[parent_list[key_id]]
+                key_id = parent_list[key_id]
+            return key_id
+
+        if min_similarity <= 1.0:
+            # Prefix filtering: with every name's n-grams sorted rarest first, two names with a Jaccard similarity of
+            # at least min_similarity must share one of the first len - ceil(min_similarity * len) + 1 n-grams of
+            # each. Only those prefixes are indexed, and since they're the rare n-grams their posting lists are short.
+            prefix_posting_dict = {}
+            for key_id, ngram_set in enumerate(self.ngram_set_list):
+                if not ngram_set:
+                    continue
+
+                ordered_ngram_list = sorted(ngram_set, key=lambda ngram: (len(self.posting_dict[ngram]), ngram))
+                # The small epsilon keeps e.g. 0.8 * 10 = 8.000000000000002 from rounding up to 9.
+                prefix_length = len(ordered_ngram_list) - ceil(min_similarity * len(ordered_ngram_list) - 1e-9) + 1
+                candidate_set = set()
+                for ngram in ordered_ngram_list[:prefix_length]:
+                    prefix_posting_list = prefix_posting_dict.setdefault(ngram, [])
+                    candidate_set.update(prefix_posting_list)
+                    prefix_posting_list.append(key_id)
+
+                for other_key_id in candidate_set:
+                    other_ngram_set = self.ngram_set_list[other_key_id]
+                    shared_count = len(ngram_set & other_ngram_set)
+                    if shared_count / (len(ngram_set) + len(other_ngram_set) - shared_count) < min_similarity:
+                        continue
+                    root, other_root = find_root(key_id), find_root(other_key_id)
+                    if root != other_root:
+                        parent_list[max(root, other_root)] = min(root, other_root)
+
+        group_dict = {}
+        for key_id, key in enumerate(self.key_list):
+            group_dict.setdefault(find_root(key_id), []).extend(self.directory_dict[key])
+
+        return [sorted(directory_list) for directory_list in group_dict.values() if len(directory_list) > 1]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("library_directory", help="The \"Doujins by Author\" directory to look through.", type=str)
+    parser.add_argument("--min-similarity", help="Trigram similarity (0 to 1) above which two names are grouped. "
+                        "Values above 1 only group identical normalized names.", default=DEFAULT_MIN_SIMILARITY,
+                        type=float)
+
+    arguments = parser.parse_args()
+
+    library_artist_index = ArtistNameIndex.from_library(arguments.library_directory)
+    merge_group_list = library_artist_index.find_merge_groups(arguments.min_similarity)
+    for merge_group in merge_group_list:
+        print(" | ".join(Path(directory).name for directory in merge_group))
+    print(f"Found {len(merge_group_list)} group(s) among {len(library_artist_index)} artist directories.")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# AsyncDatabaseTest.py
+# asyncio version of DatabaseTest.py.
+#
+# Neither mysql.connector nor sqlite3 have an asyncio API, so every blocking
+# call from DatabaseTest.py runs in a worker thread via asyncio.to_thread(). A
+# semaphore sized to the connection pool makes tasks wait on the event loop for
+# a free connection instead of tying up a thread, which lets many inserts and
+# selects overlap on a small pool. The same code runs against MySQL or, with
+# --sqlite-database, against a SQLite file with no MySQL server present.
+#
+# Usage: ./AsyncDatabaseTest.py --sqlite-database /tmp/dummy.db --rows 100000 --tasks 8
+# -------------------------------------------------------------------------------
+
+from contextlib import asynccontextmanager
+from itertools import islice
+from time import perf_counter
+import argparse
+import asyncio
+import logging
+
+import DatabaseTest
+from ConnectionPool import ConnectionPool, DEFAULT_POOL_SIZE
+from DatabaseTest import DEFAULT_CHUNK_SIZE, DEFAULT_PAGE_SIZE
+
+DEFAULT_TASK_COUNT = 8
+DEFAULT_ROW_COUNT = 10000
+
+
+class AsyncConnectionPool:
+    """asyncio front-end for a ConnectionPool."""
+
+    def __init__(self, connection_pool: ConnectionPool):
+        self.connection_pool = connection_pool
+        self.semaphore = asyncio.Semaphore(connection_pool.pool_size)
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check a connection out for the duration of an async with block."""
+        async with self.semaphore:
+            pooled_connection = await asyncio.to_thread(self.connection_pool.checkout)
+            try:
+                yield pooled_connection
+            except BaseException:
+                await asyncio.to_thread(pooled_connection.rollback)
+                raise
+            finally:
+                self.connection_pool.checkin(pooled_connection)
+
+    async def run(self, function, *args):
+        """Run function(connection, *args) in a worker thread with a connection from the pool."""
+        async with self.connection() as connection:
+            return await asyncio.to_thread(function, connection, *args)
+
+    def close(self):
+        self.connection_pool.close()
+
+    def statistics(self):
+        return self.connection_pool.statistics()
+
+
+async def create_connection(backend="mysql", pool_size=DEFAULT_POOL_SIZE, sqlite_database=None, **options):
+    """Create an AsyncConnectionPool for the chosen backend and make sure its first connection works.
+
+    For MySQL, options holds the hostname, username, password and database passed to DatabaseTest.create_connection.
+    """
+    if backend == "sqlite":
+        connection_pool = DatabaseTest.create_sqlite_connection_pool(sqlite_database, pool_size)
+    else:
+        connection_pool = DatabaseTest.create_connection_pool(options["hostname"], options["username"],
+                                                              options["password"], options["database"], pool_size)
+
+    async_connection_pool = AsyncConnectionPool(connection_pool)
+    # Open the first connection now so bad credentials are reported before any work is started.
+    async with async_connection_pool.connection():
+        pass
+
+    return async_connection_pool
+
+
+async def create_dummy_table(connection_pool: AsyncConnectionPool):
+    """Create the dummy table."""
+    await connection_pool.run(DatabaseTest.create_dummy_table)
+
+
+async def insert_into_dummy_table(connection_pool: AsyncConnectionPool, row_list, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Insert row_list into the dummy table using one pooled connection. Returns the number of rows sent."""
+    return await connection_pool.run(DatabaseTest.insert_into_dummy_table, row_list, chunk_size)
+
+
+async def select_from_dummy_table(connection_pool: AsyncConnectionPool, last_id=0, page_size=DEFAULT_PAGE_SIZE):
+    """Yield rows from the dummy table with keyset pagination.
+
+    A connection is only held while a page is read, so other tasks can use it while the caller handles the rows.
+    """
+    page_size = max(1, page_size)
+
+    while True:
+        # Taking exactly page_size rows means DatabaseTest's generator only runs its first query.
+        page_list = await connection_pool.run(lambda connection: list(
+            islice(DatabaseTest.select_from_dummy_table(connection, last_id, page_size), page_size)))
+
+        for row in page_list:
+            yield row
+
+        if len(page_list) < page_size:
+            return
+        last_id = page_list[-1][0]
+
+
+async def count_dummy_rows(connection_pool: AsyncConnectionPool, last_id=0, page_size=DEFAULT_PAGE_SIZE):
+    """Read the dummy table from last_id onwards and return the number of rows."""
+    row_count = 0
+    async for _ in select_from_dummy_table(connection_pool, last_id, page_size):
+        row_count += 1
+    return row_count
+
+
+def generate_dummy_rows(start_index, row_count):
+    """Generate row_count unique rows for the benchmark."""
+    return [{"firstname": f"First{index}", "lastname": f"Last{index}"}
+            for index in range(start_index, start_index + row_count)]
+
+
+async def main(arguments):
+    options = {
+        "hostname": "localhost",
+        "username": "dummyuser",
+        "password": "ExamplePassword.",
+        "database": "test"
+    }
+
+    backend = "sqlite" if arguments.sqlite_database else "mysql"
+    connection_pool = await create_connection(backend, arguments.pool_size, arguments.sqlite_database, **options)
+    await create_dummy_table(connection_pool)
+
+    # Split the rows between the tasks so the inserts overlap.
+    rows_per_task = -(-arguments.rows // max(1, arguments.tasks))
+    start_time = perf_counter()
+    inserted_count_list = await asyncio.gather(*[
+        insert_into_dummy_table(connection_pool,
+                                generate_dummy_rows(start_index, min(rows_per_task, arguments.rows - start_index)),
+                                arguments.chunk_size)
+        for start_index in range(0, arguments.rows, rows_per_task)])
+    insert_time = perf_counter() - start_time
+
+    start_time = perf_counter()
+    selected_count_list = await asyncio.gather(*[count_dummy_rows(connection_pool, 0, arguments.page_size)
+                                                 for _ in range(max(1, arguments.tasks))])
+    select_time = perf_counter() - start_time
+
+    logging.info(f"main: {backend} backend, {arguments.tasks} tasks on "
+                 f"{connection_pool.connection_pool.pool_size} connections.")
+    logging.info(f"main: Inserted {sum(inserted_count_list)} rows in {insert_time:.2f}s "
+                 f"({sum(inserted_count_list) / max(insert_time, 1e-9):,.0f} rows/s).")
+    logging.info(f"main: Read {sum(selected_count_list)} rows in {select_time:.2f}s "
+                 f"({sum(selected_count_list) / max(select_time, 1e-9):,.0f} rows/s).")
+    logging.info(f"main: Connection pool statistics: {connection_pool.statistics()}")
+    connection_pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sqlite-database", help="Use this SQLite database instead of the MySQL server.",
+                        default=None, type=str)
+    parser.add_argument("--pool-size", help="Number of database connections.", default=DEFAULT_POOL_SIZE, type=int)
+    parser.add_argument("--tasks", help="Number of insert/select tasks that run at the same time.",
+                        default=DEFAULT_TASK_COUNT, type=int)
+    parser.add_argument("--rows", help="Number of rows to insert.", default=DEFAULT_ROW_COUNT, type=int)
+    parser.add_argument("--chunk-size", help="Number of rows sent per INSERT.", default=DEFAULT_CHUNK_SIZE, type=int)
+    parser.add_argument("--page-size", help="Number of rows read per page.", default=DEFAULT_PAGE_SIZE, type=int)
+
+    asyncio.run(main(parser.parse_args()))
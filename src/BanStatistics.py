@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# BanStatistics.py
+# Pre-aggregated ban statistics for IPGeolocator.py.
+#
+# Every time IPGeolocator.py writes banned IPs into sshd_banned_ip_database, the
+# daily and monthly ban counts per country, city and subnet (/24 for IPv4, /64
+# for IPv6) are updated in sshd_ban_rollup. Each IP only counts once per day and
+# once per month, so running the script every few minutes doesn't inflate the
+# numbers. The report below only reads the rollup table, so it stays fast no
+# matter how many years of bans have been recorded.
+#
+# Usage: ./BanStatistics.py --period month --dimension country --since 2024-01-01
+# -------------------------------------------------------------------------------
+
+from collections import Counter
+from datetime import date, timedelta
+import ipaddress
+import argparse
+import logging
+import sqlite3
+
+import mysql.connector
+
+from ConnectionPool import unwrap_connection
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+
+PERIOD_LIST = ["day", "month"]
+DIMENSION_LIST = ["country", "city", "subnet"]
+DEFAULT_REPORT_LIMIT = 20
+
+# Maximum number of IPs per IN (...) clause.
+QUERY_CHUNK_SIZE = 500
+
+# Schema shared by MySQL and SQLite (SQLite ignores the varchar lengths).
+ROLLUP_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sshd_ban_rollup(
+period_type varchar(8) NOT NULL,
+period_start date NOT NULL,
+dimension varchar(16) NOT NULL,
+dimension_value varchar(255) NOT NULL,
+ban_count bigint NOT NULL DEFAULT 0,
+PRIMARY KEY (period_type, period_start, dimension, dimension_value))
+"""
+
+# Which IPs have already been counted for the current day/month. Older periods are pruned.
+ROLLUP_SEEN_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sshd_ban_rollup_seen(
+period_type varchar(8) NOT NULL,
+period_start date NOT NULL,
+ip_address varchar(45) NOT NULL,
+PRIMARY KEY (period_type, period_start, ip_address))
+"""
+
+
+def is_sqlite(connection):
+    """Return True if connection is a SQLite stand-in instead of a mysql.connector connection."""
+    return isinstance(unwrap_connection(connection), sqlite3.Connection)
+
+
+def create_rollup_tables(connection):
+    """Create the rollup tables if they don't exist yet."""
+    cursor = connection.cursor()
+    cursor.execute(ROLLUP_TABLE_SCHEMA)
+    cursor.execute(ROLLUP_SEEN_TABLE_SCHEMA)
+    connection.commit()
+
+
+def calculate_subnet(ip_address: str):
+    """Return the /24 (IPv4) or /64 (IPv6) network containing ip_address, or "Unknown Subnet"."""
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return "Unknown Subnet"
+
+    prefix_length = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix_length}", strict=False))
+
+
+def calculate_period_start(period_type, ban_date: date):
+    """Return the first day of the day/month period that ban_date falls into."""
+    return ban_date if period_type == "day" else ban_date.replace(day=1)
+
+
+def generate_dimension_values(ip_address, json_object: dict):
+    """Return a {dimension: value} dict for a single banned IP."""
+    country_name = json_object.get("country_name") or "Unknown Country"
+    city = json_object.get("city") or "Unknown City"
+    return {
+        "country": country_name,
+        # Cities aren't unique across countries, so keep the country with them.
+        "city": f"{city}, {country_name}",
+        "subnet": calculate_subnet(ip_address)
+    }
+
+
+def find_unseen_ip_addresses(cursor, placeholder, period_type, period_start, ip_address_list: list):
+    """Return the IPs in ip_address_list that haven't been counted for this period yet."""
+    seen_ip_address_set = set()
+    for index in range(0, len(ip_address_list), QUERY_CHUNK_SIZE):
+        chunk = ip_address_list[index:index + QUERY_CHUNK_SIZE]
+        query = f"""
+        SELECT ip_address FROM sshd_ban_rollup_seen
+        WHERE period_type = {placeholder} AND period_start = {placeholder}
+        AND ip_address IN ({", ".join([placeholder] * len(chunk))})
+        """
+        cursor.execute(query, (period_type, period_start, *chunk))
+        seen_ip_address_set.update(row[0] for row in cursor.fetchall())
+
+    return [ip_address for ip_address in ip_address_list if ip_address not in seen_ip_address_set]
+
+
+def update_ban_rollups(connection, ip_address_dict: dict, ban_date: date = None):
+    """Add the IPs in ip_address_dict to the daily and monthly rollups for ban_date (today by default).
+
+    Everything is written in a single transaction. Returns the number of rollup rows that were touched.
+    """
+    if not ip_address_dict:
+        return 0
+
+    ban_date = date.today() if ban_date is None else ban_date
+    use_sqlite = is_sqlite(connection)
+    placeholder = "?" if use_sqlite else "%s"
+    if use_sqlite:
+        increment_clause = ("ON CONFLICT(period_type, period_start, dimension, dimension_value) "
+                            "DO UPDATE SET ban_count = ban_count + excluded.ban_count")
+    else:
+        increment_clause = "ON DUPLICATE KEY UPDATE ban_count = ban_count + VALUES(ban_count)"
+
+    create_rollup_tables(connection)
+    cursor = connection.cursor()
+    ip_address_list = list(ip_address_dict)
+    rollup_counter = Counter()
+
+    try:
+        for period_type in PERIOD_LIST:
+            period_start = calculate_period_start(period_type, ban_date).isoformat()
+
+            # The seen rows of older periods are never looked at again.
+            cursor.execute(f"""
+            DELETE FROM sshd_ban_rollup_seen WHERE period_type = {placeholder} AND period_start < {placeholder}
+            """, (period_type, period_start))
+
+            unseen_ip_address_list = find_unseen_ip_addresses(cursor, placeholder, period_type, period_start,
+                                                              ip_address_list)
+            if not unseen_ip_address_list:
+                continue
+
+            cursor.executemany(f"""
+            INSERT INTO sshd_ban_rollup_seen (period_type, period_start, ip_address)
+            VALUES ({placeholder}, {placeholder}, {placeholder})
+            """, [(period_type, period_start, ip_address) for ip_address in unseen_ip_address_list])
+
+            for ip_address in unseen_ip_address_list:
+                dimension_dict = generate_dimension_values(ip_address, ip_address_dict[ip_address])
+                for dimension, dimension_value in dimension_dict.items():
+                    rollup_counter[(period_type, period_start, dimension, dimension_value)] += 1
+
+        if rollup_counter:
+            cursor.executemany(f"""
+            INSERT INTO sshd_ban_rollup (period_type, period_start, dimension, dimension_value, ban_count)
+            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
+            {increment_clause}
+            """, [(*key, count) for key, count in rollup_counter.items()])
+
+        connection.commit()
+
+    except (sqlite3.Error, mysql.connector.Error) as error:
+        connection.rollback()
+        print(f"Error: Could not update the ban rollups. Here's the error: {error}")
+        exit(EXIT_FAILURE)
+
+    logging.debug(f"update_ban_rollups(): Updated {len(rollup_counter)} rollup rows.")
+    return len(rollup_counter)
+
+
+def generate_ban_report(connection, period_type="month", dimension="country", since: date = None,
+                        until: date = None, limit=DEFAULT_REPORT_LIMIT):
+    """Return the top `limit` (dimension_value, ban_count) pairs between since and until, read from the rollups."""
+    until = date.today() if until is None else until
+    since = until - timedelta(days=365) if since is None else since
+    placeholder = "?" if is_sqlite(connection) else "%s"
+
+    query = f"""
+    SELECT dimension_value, SUM(ban_count) AS total_ban_count FROM sshd_ban_rollup
+    WHERE period_type = {placeholder} AND dimension = {placeholder}
+    AND period_start >= {placeholder} AND period_start <= {placeholder}
+    GROUP BY dimension_value
+    ORDER BY total_ban_count DESC, dimension_value
+    LIMIT {int(limit)}
+    """
+    parameter_list = (period_type, dimension, calculate_period_start(period_type, since).isoformat(),
+                      until.isoformat())
+
+    create_rollup_tables(connection)
+    cursor = connection.cursor()
+    cursor.execute(query, parameter_list)
+    return [(row[0], int(row[1])) for row in cursor.fetchall()]
+
+
+def generate_ban_timeline(connection, period_type="month", since: date = None, until: date = None):
+    """Return a list of (period_start, ban_count) pairs, one per day/month, read from the rollups."""
+    until = date.today() if until is None else until
+    since = until - timedelta(days=365) if since is None else since
+    placeholder = "?" if is_sqlite(connection) else "%s"
+
+    # Every banned IP is counted exactly once per period under the "country" dimension.
+    query = f"""
+    SELECT period_start, SUM(ban_count) FROM sshd_ban_rollup
+    WHERE period_type = {placeholder} AND dimension = 'country'
+    AND period_start >= {placeholder} AND period_start <= {placeholder}
+    GROUP BY period_start
+    ORDER BY period_start
+    """
+    parameter_list = (period_type, calculate_period_start(period_type, since).isoformat(), until.isoformat())
+
+    create_rollup_tables(connection)
+    cursor = connection.cursor()
+    cursor.execute(query, parameter_list)
+    return [(str(row[0]), int(row[1])) for row in cursor.fetchall()]
+
+
+def print_ban_report(report_list: list, title: str):
+    """Print a report generated by generate_ban_report or generate_ban_timeline."""
+    print(title)
+    print("-" * 80)
+    if not report_list:
+        print("No bans were recorded for this period.")
+        return
+
+    width = max(len(str(value)) for value, _ in report_list)
+    for value, ban_count in report_list:
+        print(f"{str(value):<{width}}  {ban_count:>10}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--period", help="Report on daily or monthly rollups.", choices=PERIOD_LIST,
+                        default="month", type=str)
+    parser.add_argument("--dimension", help="Group the bans by country, city or subnet.", choices=DIMENSION_LIST,
+                        default="country", type=str)
+    parser.add_argument("--timeline", help="Show the number of bans per day/month instead of the top values.",
+                        action="store_true")
+    parser.add_argument("--since", help="First day (YYYY-MM-DD) of the report. Defaults to a year ago.",
+                        default=None, type=date.fromisoformat)
+    parser.add_argument("--until", help="Last day (YYYY-MM-DD) of the report. Defaults to today.",
+                        default=None, type=date.fromisoformat)
+    parser.add_argument("--limit", help="Number of rows to show.", default=DEFAULT_REPORT_LIMIT, type=int)
+    parser.add_argument("--sqlite-database", help="Read the rollups from this SQLite database instead of MySQL.",
+                        default=None, type=str)
+
+    arguments = parser.parse_args()
+
+    # Imported here since IPGeolocator itself imports this module.
+    import IPGeolocator
+
+    if arguments.sqlite_database:
+        connection_pool = IPGeolocator.create_sqlite_connection_pool(arguments.sqlite_database, 1)
+    else:
+        connection_pool = IPGeolocator.create_default_connection_pool(1)
+
+    with connection_pool.connection() as connection:
+        if arguments.timeline:
+            report_list = generate_ban_timeline(connection, arguments.period, arguments.since, arguments.until)
+            title = f"Banned IP Addresses per {arguments.period}:"
+        else:
+            report_list = generate_ban_report(connection, arguments.period, arguments.dimension, arguments.since,
+                                              arguments.until, arguments.limit)
+            title = f"Top {arguments.limit} {arguments.dimension} values by banned IP Addresses:"
+
+    connection_pool.close()
+    print_ban_report(report_list, title)
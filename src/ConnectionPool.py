@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# ConnectionPool.py
+# A small database connection pool shared by DatabaseTest.py and IPGeolocator.py.
+#
+# Connections are created lazily up to a fixed pool size, checked for health
+# every time they're handed out, and keep their most recently used prepared
+# cursors around so the same statement is only prepared once per connection. The pool also keeps
+# track of how many checkouts happened and how long callers had to wait. If a
+# QueryInstrumentation object is passed, every cursor and commit is timed.
+# -------------------------------------------------------------------------------
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from threading import Lock
+from time import perf_counter
+import logging
+import sqlite3
+
+from QueryInstrumentation import InstrumentedCursor, QueryInstrumentation
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CHECKOUT_TIMEOUT = 30
+
+# Prepared cursors kept per connection. Each one holds a server-side prepared statement, and multi-row queries
+# generate a different statement per row count, so the least recently used ones are closed past this point.
+DEFAULT_MAX_PREPARED_CURSORS = 32
+
+
+class ConnectionPoolError(Exception):
+    """Raised when a connection can't be checked out of the pool."""
+
+
+class PooledConnection:
+    """Wrapper around a database connection that caches a prepared cursor for each of its most recent queries.
+
+    Any attribute that isn't defined here (rollback, is_connected, ...) is forwarded to the real connection,
+    so a PooledConnection can be passed to code that expects a plain connection.
+    """
+
+    def __init__(self, connection, instrumentation: QueryInstrumentation = None,
+                 max_prepared_cursors=DEFAULT_MAX_PREPARED_CURSORS):
+        self.connection = connection
+        self.instrumentation = instrumentation
+        self.max_prepared_cursors = max(1, max_prepared_cursors)
+        # Least recently used first.
+        self.prepared_cursor_dict = OrderedDict()
+
+    def __getattr__(self, attribute):
+        return getattr(self.connection, attribute)
+
+    def instrument_cursor(self, cursor):
+        """Wrap cursor so its queries are timed, if this connection is instrumented."""
+        return cursor if self.instrumentation is None else InstrumentedCursor(cursor, self.instrumentation)
+
+    def cursor(self, *args, **kwargs):
+        return self.instrument_cursor(self.connection.cursor(*args, **kwargs))
+
+    def commit(self):
+        if self.instrumentation is None:
+            return self.connection.commit()
+
+        start_time = perf_counter()
+        try:
+            return self.connection.commit()
+        finally:
+            self.instrumentation.record_commit(perf_counter() - start_time)
+
+    def prepared_cursor(self, query):
+        """Return the prepared cursor for query, creating it the first time the query is used on this connection."""
+        cursor = self.prepared_cursor_dict.get(query)
+        if cursor is not None:
+            self.prepared_cursor_dict.move_to_end(query)
+            return cursor
+
+        cursor = self.instrument_cursor(create_prepared_cursor(self.connection))
+        self.prepared_cursor_dict.update({query: cursor})
+        while len(self.prepared_cursor_dict) > self.max_prepared_cursors:
+            _, evicted_cursor = self.prepared_cursor_dict.popitem(last=False)
+            close_cursor(evicted_cursor)
+        return cursor
+
+    def close(self):
+        """Close every cached cursor and then the connection itself."""
+        for cursor in self.prepared_cursor_dict.values():
+            close_cursor(cursor)
+        self.prepared_cursor_dict.clear()
+        self.connection.close()
+
+
+def close_cursor(cursor):
+    """Close a cursor (which deallocates its prepared statement), ignoring errors from a dead connection."""
+    try:
+        cursor.close()
+    except Exception as error:
+        logging.debug(f"PooledConnection: Ignoring error while closing a cursor: {error}")
+
+
+def unwrap_connection(connection):
+    """Return the real connection object behind a PooledConnection (or the connection itself)."""
+    return connection.connection if isinstance(connection, PooledConnection) else connection
+
+
+def create_prepared_cursor(connection):
+    """Create a prepared cursor for a mysql.connector connection, or a plain cursor for SQLite.
+
+    SQLite already caches compiled statements per connection, so it doesn't need (or support) prepared=True.
+    """
+    connection = unwrap_connection(connection)
+    if isinstance(connection, sqlite3.Connection):
+        return connection.cursor()
+    return connection.cursor(prepared=True)
+
+
+def prepared_cursor(connection, query):
+    """Return a prepared cursor for query, reusing the cached one if connection came from a pool."""
+    if isinstance(connection, PooledConnection):
+        return connection.prepared_cursor(query)
+    return create_prepared_cursor(connection)
+
+
+def is_connection_healthy(connection):
+    """Check that a connection can still be used."""
+    try:
+        if hasattr(connection, "is_connected"):
+            return connection.is_connected()
+
+        connection.execute("SELECT 1").fetchall()
+        return True
+
+    except Exception as error:
+        logging.debug(f"is_connection_healthy(): Health check failed: {error}")
+        return False
+
+
+class ConnectionPool:
+    """Fixed-size pool of database connections created by connection_factory."""
+
+    def __init__(self, connection_factory, pool_size=DEFAULT_POOL_SIZE, checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT,
+                 health_check=is_connection_healthy, instrumentation: QueryInstrumentation = None):
+        self.connection_factory = connection_factory
+        self.instrumentation = instrumentation
+        self.pool_size = max(1, pool_size)
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+
+        self.idle_connections = LifoQueue()
+        self.lock = Lock()
+        self.created_count = 0
+        self.closed = False
+
+        self.checkout_count = 0
+        self.replaced_count = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def create_pooled_connection(self):
+        """Create a new connection using the factory."""
+        logging.debug(f"ConnectionPool: Creating connection {self.created_count} of {self.pool_size}.")
+        return PooledConnection(self.connection_factory(), self.instrumentation)
+
+    def checkout(self):
+        """Take a healthy connection out of the pool, waiting up to checkout_timeout seconds if all are in use."""
+        if self.closed:
+            raise ConnectionPoolError("Cannot check out a connection from a closed pool.")
+
+        start_time = perf_counter()
+        pooled_connection = None
+
+        try:
+            pooled_connection = self.idle_connections.get_nowait()
+        except Empty:
+            with self.lock:
+                can_create = self.created_count < self.pool_size
+                if can_create:
+                    self.created_count += 1
+
+            if can_create:
+                try:
+                    pooled_connection = self.create_pooled_connection()
+                except Exception:
+                    with self.lock:
+                        self.created_count -= 1
+                    raise
+            else:
+                try:
+                    pooled_connection = self.idle_connections.get(timeout=self.checkout_timeout)
+                except Empty:
+                    raise ConnectionPoolError(f"Timed out after {self.checkout_timeout}s waiting for a connection.")
+
+        if not self.health_check(pooled_connection.connection):
+            logging.debug("ConnectionPool: Replacing a connection that failed its health check.")
+            try:
+                pooled_connection.close()
+            except Exception as error:
+                logging.debug(f"ConnectionPool: Ignoring error while closing a dead connection: {error}")
+            try:
+                pooled_connection = self.create_pooled_connection()
+            except Exception:
+                # The dead connection is gone, so give its slot back for the next checkout to fill.
+                with self.lock:
+                    self.created_count -= 1
+                raise
+            self.replaced_count += 1
+
+        wait_time = perf_counter() - start_time
+        with self.lock:
+            self.checkout_count += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        return pooled_connection
+
+    def checkin(self, pooled_connection):
+        """Return a connection to the pool."""
+        if self.closed:
+            pooled_connection.close()
+            return
+        self.idle_connections.put(pooled_connection)
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out for the duration of a with block.
+
+        Any uncommitted work is rolled back if the block raises, so the next user gets a clean connection.
+        """
+        pooled_connection = self.checkout()
+        try:
+            yield pooled_connection
+        except BaseException:
+            try:
+                pooled_connection.rollback()
+            except Exception as error:
+                logging.debug(f"ConnectionPool: Ignoring error while rolling back: {error}")
+            raise
+        finally:
+            self.checkin(pooled_connection)
+
+    def close(self):
+        """Close every idle connection. Connections that are checked out are closed when they're checked in."""
+        self.closed = True
+        while True:
+            try:
+                pooled_connection = self.idle_connections.get_nowait()
+            except Empty:
+                break
+            pooled_connection.close()
+
+    def statistics(self):
+        """Return a dict with the checkout count and wait times (in seconds) recorded by this pool."""
+        average_wait_time = (self.total_wait_time / self.checkout_count) if self.checkout_count else 0.0
+        return {
+            "pool_size": self.pool_size,
+            "connections_created": self.created_count + self.replaced_count,
+            "connections_replaced": self.replaced_count,
+            "checkouts": self.checkout_count,
+            "total_wait_time": self.total_wait_time,
+            "average_wait_time": average_wait_time,
+            "max_wait_time": self.max_wait_time
+        }
@@ -4,13 +4,50 @@
 #
 # DatabaseTest.py
 # A Simple program to help me learn how to use mysql.connector.
+#
+# Pass --sqlite-database to run everything against a SQLite file instead, so no
+# MySQL server is needed for local testing.
 # -------------------------------------------------------------------------------
 
 from enum import Enum
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+import argparse
+import atexit
+import csv
+import json
 import logging
+import sqlite3
 import mysql.connector
 from mysql.connector import Error as MySQLError
 
+from ConnectionPool import ConnectionPool, DEFAULT_POOL_SIZE, prepared_cursor, unwrap_connection
+from QueryInstrumentation import QueryInstrumentation, DEFAULT_SLOW_QUERY_THRESHOLD, EXPORT_FORMAT_LIST
+
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_PAGE_SIZE = 1000
+
+# SQLite before 3.32 refuses statements with more than 999 parameters (and MySQL stops at 65535), so like
+# IPGeolocator's bulk upsert, no INSERT binds more than this many. A chunk is split over as many statements as that
+# takes.
+MAX_QUERY_PARAMETERS = 500
+# Number of values bound per row of the dummy table.
+DUMMY_ROW_PARAMETER_COUNT = 2
+
+# Errors raised by either backend.
+DATABASE_ERRORS = (MySQLError, sqlite3.Error)
+
+# SQLite version of the dummy table created by create_dummy_table().
+SQLITE_DUMMY_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dummy(
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+firstname TEXT NOT NULL,
+lastname TEXT NOT NULL,
+UNIQUE(firstname, lastname))
+"""
+
 
 class EXIT_CODE(Enum):
     """Simple Exit Code enum."""
@@ -19,12 +56,13 @@ class EXIT_CODE(Enum):
     FAILURE = 1
 
 
-def create_connection(hostname, username, user_password, database_name):
-    """Create a connection."""
+def create_connection(hostname, username, user_password, database_name, allow_local_infile=False):
+    """Create a connection. allow_local_infile has to be set for LOAD DATA LOCAL INFILE to work."""
     connection = None
     logging.debug("create_connection: Attempting to connect using passed credentials...")
     try:
-        connection = mysql.connector.connect(host=hostname, user=username, passwd=user_password, database=database_name)
+        connection = mysql.connector.connect(host=hostname, user=username, passwd=user_password, database=database_name,
+                                             allow_local_infile=allow_local_infile)
 
     except MySQLError as error:
         print(f"Error: {error}")
@@ -34,9 +72,55 @@ def create_connection(hostname, username, user_password, database_name):
     return connection
 
 
+def create_sqlite_connection(database_path):
+    """Create a connection to a SQLite database that stands in for the MySQL server."""
+    logging.debug(f"create_sqlite_connection: Opening {database_path}")
+    try:
+        # The connection is created by one thread of a pool and may be used by another one.
+        connection = sqlite3.connect(database_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    except sqlite3.Error as error:
+        print(f"Error: {error}")
+        exit(EXIT_CODE.FAILURE)
+
+
+def is_sqlite_connection(connection):
+    """Return True if connection is a SQLite stand-in instead of a mysql.connector connection."""
+    return isinstance(unwrap_connection(connection), sqlite3.Connection)
+
+
+def get_placeholder(connection):
+    """Return the parameter placeholder used by the connection's backend."""
+    return "?" if is_sqlite_connection(connection) else "%s"
+
+
+def create_connection_pool(hostname, username, user_password, database_name, pool_size=DEFAULT_POOL_SIZE,
+                           allow_local_infile=False, instrumentation: QueryInstrumentation = None):
+    """Create a pool of connections that all use the passed credentials."""
+    def connection_factory():
+        connection = create_connection(hostname, username, user_password, database_name, allow_local_infile)
+        if connection is None:
+            exit(EXIT_CODE.FAILURE)
+        return connection
+
+    return ConnectionPool(connection_factory, pool_size, instrumentation=instrumentation)
+
+
+def create_sqlite_connection_pool(database_path, pool_size=DEFAULT_POOL_SIZE,
+                                  instrumentation: QueryInstrumentation = None):
+    """Create a pool of connections to a SQLite database.
+
+    Every connection to ":memory:" would get its own empty database, so that pool only ever has one connection.
+    """
+    pool_size = 1 if database_path == ":memory:" else pool_size
+    return ConnectionPool(lambda: create_sqlite_connection(database_path), pool_size,
+                          instrumentation=instrumentation)
+
+
 def create_dummy_table(connection):
     """Create a dummy table in the database."""
-    cursor = connection.cursor(prepared=True)
     query = """
     CREATE table IF NOT EXISTS dummy(
     id bigint NOT NULL AUTO_INCREMENT,
@@ -45,73 +129,252 @@ def create_dummy_table(connection):
     constraint pk_dummy primary key (id, firstname, lastname),
     unique index index_name(firstname, lastname))
     """
+    if is_sqlite_connection(connection):
+        query = SQLITE_DUMMY_TABLE_SCHEMA
+    cursor = prepared_cursor(connection, query)
 
     logging.debug("create_dummy_table: Attempting to create predefined dummy table.")
     try:
         cursor.execute(query)
         connection.commit()
         logging.info("create_dummy_table: Dummy table was created successfully.")
-    except MySQLError as error:
+    except DATABASE_ERRORS as error:
         print(f"Error: {error}")
         exit(EXIT_CODE.FAILURE)
 
 
-def insert_into_dummy_table(connection, row_list):
-    """Insert into the dummy_table."""
-    if not row_list:
+def read_rows_from_file(file_path):
+    """Yield {"firstname": ..., "lastname": ...} rows from a CSV file (with a header) or a JSON Lines file.
+
+    The file is read one line at a time, so its size doesn't matter.
+    """
+    file_path = Path(file_path)
+    with open(file_path, "r", newline="", encoding="utf-8") as input_file:
+        if file_path.suffix.lower() in (".jsonl", ".ndjson"):
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(input_file)
+
+
+def generate_row_chunks(row_iterable, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of at most chunk_size (firstname, lastname) tuples taken from row_iterable."""
+    parameter_iterator = ((row["firstname"], row["lastname"]) for row in row_iterable)
+    while True:
+        chunk = list(islice(parameter_iterator, max(1, chunk_size)))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate_dummy_insert_query(row_count, use_sqlite=False):
+    """Generate a multi-row INSERT IGNORE with row_count (firstname, lastname) rows."""
+    if use_sqlite:
+        value_list = ", ".join(["(?,?)"] * row_count)
+        return f"""INSERT OR IGNORE INTO dummy(firstname, lastname) VALUES {value_list}"""
+
+    value_list = ", ".join(["(%s,%s)"] * row_count)
+    return f"""INSERT IGNORE INTO dummy(firstname, lastname) VALUES {value_list}"""
+
+
+def insert_into_dummy_table(connection, row_list, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Insert into the dummy_table.
+
+    row_list can be any iterable of rows (including a generator), and is sent with one commit per chunk_size rows,
+    so only a single chunk is held in memory at a time. Each chunk is sent as multi-row INSERTs that bind at most
+    MAX_QUERY_PARAMETERS values each. Returns the number of rows that were sent.
+    """
+    row_count = 0
+    use_sqlite = is_sqlite_connection(connection)
+    rows_per_statement = max(1, min(chunk_size, MAX_QUERY_PARAMETERS // DUMMY_ROW_PARAMETER_COUNT))
+    start_time = perf_counter()
+
+    try:
+        for chunk in generate_row_chunks(row_list, chunk_size):
+            for start in range(0, len(chunk), rows_per_statement):
+                statement_chunk = chunk[start:start + rows_per_statement]
+                # Every full statement uses the same query, so it's only prepared once per connection.
+                query = generate_dummy_insert_query(len(statement_chunk), use_sqlite)
+                cursor = prepared_cursor(connection, query)
+                cursor.execute(query, [value for row in statement_chunk for value in row])
+            connection.commit()
+            row_count += len(chunk)
+            logging.debug(f"insert_into_dummy_table: Inserted a chunk of {len(chunk)} rows ({row_count} so far).")
+
+    except DATABASE_ERRORS as error:
+        print(f"Error: {error}")
+        exit(EXIT_CODE.FAILURE)
+
+    if not row_count:
         logging.debug("insert_into_dummy_table: Aborting since row_list is empty.")
-        return
+        return 0
+
+    log_load_rate("insert_into_dummy_table", row_count, perf_counter() - start_time)
+    return row_count
+
+
+def load_data_into_dummy_table(connection, csv_path):
+    """Load a CSV file (with a firstname/lastname header) straight into the dummy table with LOAD DATA LOCAL INFILE.
 
-    cursor = connection.cursor(prepared=True)
+    This is the fastest way to load a large file, but the connection must have been created with
+    allow_local_infile=True and the server must have local_infile enabled. Returns the number of rows inserted.
+    """
+    if is_sqlite_connection(connection):
+        print("Error: LOAD DATA LOCAL INFILE is only supported by MySQL.")
+        exit(EXIT_CODE.FAILURE)
 
-    query = """INSERT IGNORE INTO dummy(firstname, lastname) VALUES (%s,%s)"""
-    parameter_list = []
+    csv_path = Path(csv_path).resolve()
+    with open(csv_path, "rb") as csv_file:
+        header_line = csv_file.readline()
 
-    for row in row_list:
-        temp_tuple = (row["firstname"], row["lastname"])
-        parameter_list.append(temp_tuple)
+    line_terminator = "\\r\\n" if header_line.endswith(b"\r\n") else "\\n"
+    header_list = next(csv.reader([header_line.decode("utf-8")]))
+    if "firstname" not in header_list or "lastname" not in header_list:
+        print(f"Error: {str(csv_path)} needs both a firstname and a lastname column.")
+        exit(EXIT_CODE.FAILURE)
 
-    # Now remove the last character:
+    # Columns other than firstname and lastname are read into a user variable and thrown away.
+    column_list = ", ".join(column if column in ("firstname", "lastname") else "@ignored" for column in header_list)
+    query = f"""
+    LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE dummy
+    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+    LINES TERMINATED BY '{line_terminator}'
+    IGNORE 1 LINES
+    ({column_list})
+    """
 
-    logging.debug(f"insert_into_dummy_table: Generated Query:\n{query}")
-    logging.debug(f"insert_into_dummy_table: Parameter list: {parameter_list}")
+    logging.debug(f"load_data_into_dummy_table: Loading {str(csv_path)} with LOAD DATA LOCAL INFILE.")
+    start_time = perf_counter()
     try:
-        cursor.executemany(query, parameter_list)
+        # LOAD DATA can't be run as a prepared statement.
+        cursor = unwrap_connection(connection).cursor()
+        if hasattr(connection, "instrument_cursor"):
+            cursor = connection.instrument_cursor(cursor)
+        cursor.execute(query, (str(csv_path),))
+        row_count = cursor.rowcount
         connection.commit()
-        logging.info("insert_into_dummy_table: Data was inserted successfully.")
+        cursor.close()
 
-    except MySQLError as error:
+    except DATABASE_ERRORS as error:
         print(f"Error: {error}")
         exit(EXIT_CODE.FAILURE)
 
+    log_load_rate("load_data_into_dummy_table", row_count, perf_counter() - start_time)
+    return row_count
+
+
+def load_file_into_dummy_table(connection, file_path, chunk_size=DEFAULT_CHUNK_SIZE, use_load_data=False):
+    """Stream a CSV or JSON Lines file into the dummy table. Returns the number of rows loaded."""
+    if use_load_data:
+        if Path(file_path).suffix.lower() != ".csv":
+            print("Error: LOAD DATA LOCAL INFILE can only be used with a CSV file.")
+            exit(EXIT_CODE.FAILURE)
+        return load_data_into_dummy_table(connection, file_path)
+
+    return insert_into_dummy_table(connection, read_rows_from_file(file_path), chunk_size)
+
+
+def log_load_rate(function_name, row_count, elapsed_time):
+    """Log how many rows were loaded and how fast."""
+    rows_per_second = (row_count / elapsed_time) if elapsed_time > 0 else float("inf")
+    logging.info(f"{function_name}: Loaded {row_count} rows in {elapsed_time:.2f}s ({rows_per_second:,.0f} rows/s).")
+
+
+def select_from_dummy_table(connection, last_id=0, page_size=DEFAULT_PAGE_SIZE):
+    """Select rows from the dummy table, yielding one (id, firstname, lastname) row at a time.
+
+    The table is walked with keyset pagination: every page is a separate `WHERE id > last_id ORDER BY id LIMIT`
+    query, so only page_size rows are ever held in memory, and the connection is free between pages. To resume
+    an interrupted scan, pass the id of the last row that was handled as last_id.
+    """
+    placeholder = get_placeholder(connection)
+    query = f"""SELECT id, firstname, lastname from dummy where id > {placeholder} order by id limit {placeholder}"""
+    page_size = max(1, page_size)
+
+    while True:
+        cursor = prepared_cursor(connection, query)
+
+        # PROTIP: You need a comma for every parameter you pass to execute, even it's
+        # a single parameter
+        specified_value = (last_id, page_size)
+
+        logging.debug(f"select_from_dummy_table: Attempting to execute query {query} with {specified_value}")
+        try:
+            cursor.execute(query, specified_value)
+            page_list = cursor.fetchall()
+            connection.commit()
+
+        except DATABASE_ERRORS as error:
+            print(f"Error: {error}")
+            exit(EXIT_CODE.FAILURE)
+
+        yield from page_list
+
+        if len(page_list) < page_size:
+            return
+        last_id = page_list[-1][0]
 
-def select_from_dummy_table(connection):
-    """Select rows from the dummy table."""
-    result_list = None
-    cursor = connection.cursor(prepared=True)
 
-    query = """SELECT id, firstname, lastname from dummy where id > %s """
+def stream_from_dummy_table(connection, last_id=0, fetch_size=DEFAULT_PAGE_SIZE):
+    """Stream rows from the dummy table using a single query, fetching fetch_size rows at a time.
 
-    # PROTIP: You need a comma for every parameter you pass to execute, even it's
-    # a single parameter
-    specified_value = (0,)
+    Unlike select_from_dummy_table, the rows are read from one unbuffered result set, so the connection can't be
+    used for anything else until the generator is exhausted or closed.
+    """
+    query = f"""SELECT id, firstname, lastname from dummy where id > {get_placeholder(connection)} order by id"""
+    cursor = prepared_cursor(connection, query)
+    specified_value = (last_id,)
 
-    logging.debug(f"select_from_dummy_table: Attempting to execute query {query} with {specified_value}")
+    logging.debug(f"stream_from_dummy_table: Attempting to execute query {query} with {specified_value}")
     try:
         cursor.execute(query, specified_value)
-        result_list = cursor.fetchall()
+        while True:
+            row_list = cursor.fetchmany(max(1, fetch_size))
+            if not row_list:
+                break
+            yield from row_list
+
         connection.commit()
-        logging.info("select_from_dummy_table: Results of select query was stored in result_list.")
 
-    except MySQLError as error:
+    except DATABASE_ERRORS as error:
         print(f"Error: {error}")
         exit(EXIT_CODE.FAILURE)
 
-    return result_list
+    finally:
+        # Read whatever wasn't consumed so the connection can be reused.
+        try:
+            cursor.fetchall()
+        except DATABASE_ERRORS:
+            pass
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--load-file", help="Load the rows of this CSV or JSON Lines file instead of the two "
+                        "example rows.", default=None, type=str)
+    parser.add_argument("--chunk-size", help="Number of rows sent per INSERT.", default=DEFAULT_CHUNK_SIZE, type=int)
+    parser.add_argument("--load-data-infile", help="Load --load-file with LOAD DATA LOCAL INFILE.",
+                        action="store_true")
+    parser.add_argument("--page-size", help="Number of rows read from the dummy table at a time.",
+                        default=DEFAULT_PAGE_SIZE, type=int)
+    parser.add_argument("--resume-from-id", help="Only read rows with an id greater than this one.", default=0,
+                        type=int)
+    parser.add_argument("--streaming-cursor", help="Read the dummy table with one streaming query instead of "
+                        "keyset pagination.", action="store_true")
+    parser.add_argument("--sqlite-database", help="Use this SQLite database instead of the MySQL server.",
+                        default=None, type=str)
+    parser.add_argument("--query-metrics", help="Time every query and write the metrics to this file at exit.",
+                        default=None, type=str)
+    parser.add_argument("--query-metrics-format", help="Format of the --query-metrics file.",
+                        choices=EXPORT_FORMAT_LIST, default="json", type=str)
+    parser.add_argument("--slow-query-threshold", help="Queries that take at least this many seconds are kept as "
+                        "slow query samples.", default=DEFAULT_SLOW_QUERY_THRESHOLD, type=float)
+
+    arguments = parser.parse_args()
+
     options = {
         "hostname": "localhost",
         "username": "dummyuser",
@@ -119,16 +382,43 @@ if __name__ == "__main__":
         "database": "test"
     }
 
-    connection = create_connection(options['hostname'], options["username"], options["password"], options["database"])
-
-    create_dummy_table(connection)
-    row_list = [{"firstname": "John", "lastname": "Smith"},
-                {"firstname": "Jane", "lastname": "Doe"}]
-
-    insert_into_dummy_table(connection, row_list)
-    result_list = select_from_dummy_table(connection)
-
-    print(result_list)
-    print("Now attempting to iterate through the result_list:")
-    for row in result_list:
-        print(row)
+    query_instrumentation = None
+    if arguments.query_metrics:
+        query_instrumentation = QueryInstrumentation(arguments.slow_query_threshold)
+        atexit.register(query_instrumentation.export, arguments.query_metrics, arguments.query_metrics_format)
+
+    if arguments.sqlite_database:
+        connection_pool = create_sqlite_connection_pool(arguments.sqlite_database,
+                                                        instrumentation=query_instrumentation)
+    else:
+        connection_pool = create_connection_pool(options['hostname'], options["username"], options["password"],
+                                                 options["database"], allow_local_infile=arguments.load_data_infile,
+                                                 instrumentation=query_instrumentation)
+
+    with connection_pool.connection() as connection:
+        create_dummy_table(connection)
+        if arguments.load_file:
+            load_file_into_dummy_table(connection, arguments.load_file, arguments.chunk_size,
+                                       arguments.load_data_infile)
+        else:
+            row_list = [{"firstname": "John", "lastname": "Smith"},
+                        {"firstname": "Jane", "lastname": "Doe"}]
+
+            insert_into_dummy_table(connection, row_list, arguments.chunk_size)
+
+        # result_list is a generator, so the rows have to be read before the connection is checked back in.
+        if arguments.streaming_cursor:
+            result_list = stream_from_dummy_table(connection, arguments.resume_from_id, arguments.page_size)
+        else:
+            result_list = select_from_dummy_table(connection, arguments.resume_from_id, arguments.page_size)
+
+        print("Now attempting to iterate through the result_list:")
+        last_id = arguments.resume_from_id
+        for row in result_list:
+            print(row)
+            last_id = row[0]
+
+        logging.info(f"Last id read was {last_id}; pass --resume-from-id {last_id} to continue from here.")
+
+    logging.info(f"Connection pool statistics: {connection_pool.statistics()}")
+    connection_pool.close()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# DoujinshiIndex.py
+# Persistent content index of the "Doujins by Author" library, used by
+# Move_Doujinshi.py to spot duplicates that have a different name.
+#
+# Every archive in the library is recorded with its size and mtime. Hashes are
+# only computed when they're needed: a partial hash (the size plus the first
+# and last 64 KiB) once another file has the same size, and a full hash once
+# the partial hashes match too. Directory mtimes are recorded as well, so
+# update() only lists the directories that changed since the last run and
+# checking a new file is usually a single indexed lookup by size.
+#
+# Usage: ./DoujinshiIndex.py "../Doujins by Author" [--find some_file.zip]
+# -------------------------------------------------------------------------------
+
+from hashlib import blake2b
+from pathlib import Path
+from threading import Lock
+import argparse
+import logging
+import os
+import sqlite3
+
+DEFAULT_INDEX_PATH = Path.home() / ".cache" / "move_doujinshi" / "library_index.sqlite3"
+DEFAULT_ACCEPTED_FORMATS = ['.zip', '.rar', '.cbz']
+
+# How much of the start and end of a file goes into its partial hash, and the block size used for full hashes.
+PARTIAL_HASH_SIZE = 64 * 1024
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def calculate_partial_hash(path, size=None):
+    """Hash the size and the first and last PARTIAL_HASH_SIZE bytes of a file."""
+    size = os.stat(path).st_size if size is None else size
+    digest = blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as input_file:
+        digest.update(input_file.read(PARTIAL_HASH_SIZE))
+        if size > 2 * PARTIAL_HASH_SIZE:
+            input_file.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            digest.update(input_file.read(PARTIAL_HASH_SIZE))
+    return digest.hexdigest()
+
+
+def calculate_full_hash(path):
+    """Hash the whole file."""
+    digest = blake2b(digest_size=32)
+    with open(path, "rb") as input_file:
+        while block := input_file.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def files_are_identical(first_path, second_path):
+    """Return True if both files have the same contents, reading as little of them as possible."""
+    try:
+        first_size, second_size = os.stat(first_path).st_size, os.stat(second_path).st_size
+        if first_size != second_size:
+            return False
+        if calculate_partial_hash(first_path, first_size) != calculate_partial_hash(second_path, second_size):
+            return False
+        return calculate_full_hash(first_path) == calculate_full_hash(second_path)
+
+    except OSError as error:
+        logging.debug(f"files_are_identical(): Could not compare {first_path} and {second_path}: {error}")
+        return False
+
+
+class DoujinshiIndex:
+    """SQLite backed index of the archives in a library, with lazily computed content hashes.
+
+    It's safe to use from several threads; hashing happens outside the lock.
+    """
+
+    def __init__(self, database_path=DEFAULT_INDEX_PATH, accepted_formats=None):
+        self.database_path = Path(database_path)
+        self.accepted_formats = DEFAULT_ACCEPTED_FORMATS if accepted_formats is None else accepted_formats
+        self.lock = Lock()
+
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        logging.debug(f"DoujinshiIndex: Opening index at {str(self.database_path)}")
+        self.connection = sqlite3.connect(str(self.database_path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS library_file(
+        path TEXT PRIMARY KEY,
+        directory TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        partial_hash TEXT,
+        full_hash TEXT)
+        """)
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS library_directory(
+        path TEXT PRIMARY KEY,
+        parent TEXT,
+        mtime_ns INTEGER NOT NULL)
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS index_file_size ON library_file(size)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS index_file_directory ON library_file(directory)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS index_directory_parent ON library_directory(parent)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM library_file").fetchone()[0]
+
+    def close(self):
+        """Close the underlying SQLite connection."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def is_accepted(self, name):
+        return os.path.splitext(name)[1] in self.accepted_formats
+
+    def update(self, library_directory):
+        """Bring the index up to date with library_directory.
+
+        Directories whose mtime hasn't changed since the last update aren't listed again (their subdirectories
+        are still checked). Files are only stat()ed, never read. Returns the number of directories that were
+        listed.
+        """
+        library_directory = os.path.abspath(library_directory)
+        listed_count = 0
+        stack = [(library_directory, None)]
+
+        while stack:
+            directory, parent = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                self.forget_directory(directory)
+                continue
+
+            with self.lock:
+                row = self.connection.execute("SELECT mtime_ns FROM library_directory WHERE path = ?",
+                                              (directory,)).fetchone()
+
+            if row is not None and row[0] == mtime_ns:
+                with self.lock:
+                    child_list = [child[0] for child in self.connection.execute(
+                        "SELECT path FROM library_directory WHERE parent = ?", (directory,))]
+                stack.extend((child, directory) for child in child_list)
+                continue
+
+            listed_count += 1
+            stack.extend((child, directory) for child in self.scan_directory(directory, parent, mtime_ns))
+
+        logging.debug(f"DoujinshiIndex: Listed {listed_count} changed directories under {library_directory}.")
+        return listed_count
+
+    def scan_directory(self, directory, parent, mtime_ns):
+        """List a directory that changed, refresh its files in the index and return its subdirectories."""
+        file_row_list = []
+        child_list = []
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                if entry.is_dir(follow_symlinks=False):
+                    child_list.append(entry.path)
+                elif entry.is_file() and self.is_accepted(entry.name):
+                    stat_result = entry.stat()
+                    file_row_list.append((entry.path, directory, stat_result.st_size, stat_result.st_mtime_ns))
+
+        with self.lock:
+            known_file_dict = {row[0]: (row[1], row[2]) for row in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM library_file WHERE directory = ?", (directory,))}
+            known_child_set = {row[0] for row in self.connection.execute(
+                "SELECT path FROM library_directory WHERE parent = ?", (directory,))}
+
+            # Files that changed lose their hashes; unchanged ones keep them.
+            changed_row_list = [row for row in file_row_list if known_file_dict.get(row[0]) != (row[2], row[3])]
+            self.connection.executemany("""
+            INSERT INTO library_file (path, directory, size, mtime_ns) VALUES (?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+            partial_hash = NULL, full_hash = NULL
+            """, changed_row_list)
+
+            current_path_set = {row[0] for row in file_row_list}
+            self.connection.executemany("DELETE FROM library_file WHERE path = ?",
+                                        [(path,) for path in known_file_dict if path not in current_path_set])
+            self.connection.execute("""
+            INSERT INTO library_directory (path, parent, mtime_ns) VALUES (?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET parent = excluded.parent, mtime_ns = excluded.mtime_ns
+            """, (directory, parent, mtime_ns))
+            self.connection.commit()
+
+        for vanished_child in known_child_set - set(child_list):
+            self.forget_directory(vanished_child)
+
+        return child_list
+
+    def forget_directory(self, directory):
+        """Remove a directory that no longer exists, and everything under it, from the index."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        # LIKE would treat _ and % in the name as wildcards, so compare the prefix with substr() instead.
+        with self.lock:
+            self.connection.execute("DELETE FROM library_file WHERE directory = ? OR substr(directory, 1, ?) = ?",
+                                    (directory, len(prefix), prefix))
+            self.connection.execute("DELETE FROM library_directory WHERE path = ? OR substr(path, 1, ?) = ?",
+                                    (directory, len(prefix), prefix))
+            self.connection.commit()
+
+    def add(self, path):
+        """Record a single file that was just moved into the library. Only stat()s it."""
+        path = os.path.abspath(path)
+        stat_result = os.stat(path)
+        with self.lock:
+            self.connection.execute("""
+            INSERT INTO library_file (path, directory, size, mtime_ns) VALUES (?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+            partial_hash = NULL, full_hash = NULL
+            """, (path, os.path.dirname(path), stat_result.st_size, stat_result.st_mtime_ns))
+            self.connection.commit()
+
+    def remove(self, path):
+        """Forget a single file."""
+        with self.lock:
+            self.connection.execute("DELETE FROM library_file WHERE path = ?", (os.path.abspath(path),))
+            self.connection.commit()
+
+    def fill_hash(self, path, column, hash_function):
+        """Return the partial_hash/full_hash of an indexed file, computing and storing it if needed.
+
+        The file is stat()ed first, so a file that was rewritten in place since it was indexed is hashed again.
+        """
+        try:
+            stat_result = os.stat(path)
+        except OSError as error:
+            # The file went away without the index noticing.
+            logging.debug(f"DoujinshiIndex: Dropping {path} from the index: {error}")
+            self.remove(path)
+            return None
+
+        with self.lock:
+            row = self.connection.execute(f"SELECT size, mtime_ns, {column} FROM library_file WHERE path = ?",
+                                          (path,)).fetchone()
+        is_unchanged = row is not None and (row[0], row[1]) == (stat_result.st_size, stat_result.st_mtime_ns)
+        if is_unchanged and row[2] is not None:
+            return row[2]
+
+        hash_value = hash_function(path)
+        with self.lock:
+            if not is_unchanged:
+                self.connection.execute("""
+                UPDATE library_file SET size = ?, mtime_ns = ?, partial_hash = NULL, full_hash = NULL WHERE path = ?
+                """, (stat_result.st_size, stat_result.st_mtime_ns, path))
+            self.connection.execute(f"UPDATE library_file SET {column} = ? WHERE path = ?", (hash_value, path))
+            self.connection.commit()
+        return hash_value
+
+    def find_duplicate(self, path):
+        """Return the path of a library file with exactly the same contents as path, or None.
+
+        Most new files have a size nothing in the library shares, so this is usually a single lookup.
+        """
+        path = os.path.abspath(path)
+        size = os.stat(path).st_size
+        with self.lock:
+            candidate_list = [row[0] for row in self.connection.execute(
+                "SELECT path FROM library_file WHERE size = ? AND path != ?", (size, path))]
+        if not candidate_list:
+            return None
+
+        partial_hash = calculate_partial_hash(path, size)
+        candidate_list = [candidate for candidate in candidate_list
+                          if self.fill_hash(candidate, "partial_hash", calculate_partial_hash) == partial_hash]
+        if not candidate_list:
+            return None
+
+        full_hash = calculate_full_hash(path)
+        for candidate in candidate_list:
+            if self.fill_hash(candidate, "full_hash", calculate_full_hash) == full_hash:
+                return candidate
+
+        return None
+
+    def statistics(self):
+        """Return the number of indexed files and directories, and how many of the files have been hashed."""
+        with self.lock:
+            file_count, partial_count, full_count = self.connection.execute(
+                "SELECT COUNT(*), COUNT(partial_hash), COUNT(full_hash) FROM library_file").fetchone()
+            directory_count = self.connection.execute("SELECT COUNT(*) FROM library_directory").fetchone()[0]
+        return {"files": file_count, "directories": directory_count, "partial_hashes": partial_count,
+                "full_hashes": full_count}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("library_directory", help="The \"Doujins by Author\" directory to index.", type=str)
+    parser.add_argument("--index-path", help="Path to the index database.", default=str(DEFAULT_INDEX_PATH),
+                        type=str)
+    parser.add_argument("--find", help="Print the library file that has the same contents as this one.",
+                        default=None, type=str)
+
+    arguments = parser.parse_args()
+
+    with DoujinshiIndex(arguments.index_path) as index:
+        listed_count = index.update(arguments.library_directory)
+        print(f"Listed {listed_count} changed director(ies). Index statistics: {index.statistics()}")
+
+        if arguments.find:
+            duplicate = index.find_duplicate(arguments.find)
+            print(f"{arguments.find} is a duplicate of {duplicate}" if duplicate
+                  else f"{arguments.find} isn't in the library.")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# GeolocationCache.py
+# Small on-disk cache used by IPGeolocator.py so that IPs fail2ban keeps banning
+# over and over don't need a new request to geolocation-db.com on every run.
+# Entries are stored in a SQLite database keyed by IP Address, expire after a
+# configurable TTL, and the least recently used ones are evicted once the cache
+# grows past its size cap.
+# -------------------------------------------------------------------------------
+
+from pathlib import Path
+from time import time
+import argparse
+import logging
+import sqlite3
+import json
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "ipgeolocator" / "geolocation_cache.sqlite3"
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 50000
+
+# SQLite limits the number of parameters in a single statement, so IN (...) lookups are chunked.
+QUERY_CHUNK_SIZE = 500
+
+
+class GeolocationCache:
+    """SQLite backed TTL/LRU cache that maps an IP Address to its geolocation JSON object."""
+
+    def __init__(self, database_path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.database_path = Path(database_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        logging.debug(f"GeolocationCache: Opening cache at {str(self.database_path)}")
+        self.connection = sqlite3.connect(str(self.database_path))
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS geolocation_cache(
+        ip_address TEXT PRIMARY KEY,
+        raw_json TEXT NOT NULL,
+        created_timestamp REAL NOT NULL,
+        last_access_timestamp REAL NOT NULL)
+        """)
+        self.connection.execute("""
+        CREATE INDEX IF NOT EXISTS index_last_access ON geolocation_cache(last_access_timestamp)
+        """)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM geolocation_cache").fetchone()[0]
+
+    def close(self):
+        """Close the underlying SQLite connection."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get(self, ip_address: str):
+        """Return the cached JSON object for ip_address, or None if it's missing or has expired."""
+        return self.get_many([ip_address]).get(ip_address)
+
+    def get_many(self, ip_address_list: list):
+        """Return a dict of {ip_address: json_object} for every IP in ip_address_list that is cached and fresh.
+
+        Every IP Address that is found counts as a hit and every other one counts as a miss. The access
+        time of each hit is refreshed in a single transaction.
+        """
+        result_dict = {}
+        current_time = time()
+        oldest_valid_time = current_time - self.ttl_seconds
+
+        for index in range(0, len(ip_address_list), QUERY_CHUNK_SIZE):
+            chunk = ip_address_list[index:index + QUERY_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            query = f"""
+            SELECT ip_address, raw_json FROM geolocation_cache
+            WHERE ip_address IN ({placeholders}) AND created_timestamp >= ?
+            """
+            for ip_address, raw_json in self.connection.execute(query, (*chunk, oldest_valid_time)):
+                result_dict.update({ip_address: json.loads(raw_json)})
+
+        if result_dict:
+            self.connection.executemany("""
+            UPDATE geolocation_cache SET last_access_timestamp = ? WHERE ip_address = ?
+            """, [(current_time, ip_address) for ip_address in result_dict])
+            self.connection.commit()
+
+        self.hits += len(result_dict)
+        self.misses += len(ip_address_list) - len(result_dict)
+        logging.debug(f"GeolocationCache: {len(result_dict)} hit(s) out of {len(ip_address_list)} lookup(s).")
+        return result_dict
+
+    def put(self, ip_address: str, json_object: dict):
+        """Store the JSON object for a single IP Address."""
+        self.put_many({ip_address: json_object})
+
+    def put_many(self, ip_address_dict: dict):
+        """Store every {ip_address: json_object} pair in one transaction, then evict entries if needed."""
+        if not ip_address_dict:
+            return
+
+        current_time = time()
+        parameter_list = [(ip_address, json.dumps(json_object), current_time, current_time)
+                          for ip_address, json_object in ip_address_dict.items()]
+
+        self.connection.executemany("""
+        REPLACE INTO geolocation_cache (ip_address, raw_json, created_timestamp, last_access_timestamp)
+        VALUES (?, ?, ?, ?)
+        """, parameter_list)
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then drop the least recently used entries until the size cap is respected."""
+        oldest_valid_time = time() - self.ttl_seconds
+        cursor = self.connection.execute("DELETE FROM geolocation_cache WHERE created_timestamp < ?",
+                                         (oldest_valid_time,))
+        evicted_count = cursor.rowcount
+
+        overflow_count = len(self) - self.max_entries
+        if overflow_count > 0:
+            cursor = self.connection.execute("""
+            DELETE FROM geolocation_cache WHERE ip_address IN (
+            SELECT ip_address FROM geolocation_cache ORDER BY last_access_timestamp ASC LIMIT ?)
+            """, (overflow_count,))
+            evicted_count += cursor.rowcount
+
+        self.connection.commit()
+        self.evictions += evicted_count
+
+        if evicted_count:
+            logging.debug(f"GeolocationCache: Evicted {evicted_count} entries.")
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        self.connection.execute("DELETE FROM geolocation_cache")
+        self.connection.commit()
+
+    def statistics(self):
+        """Return a dict containing the hit/miss/eviction counters for this session."""
+        lookup_count = self.hits + self.misses
+        hit_ratio = (self.hits / lookup_count) if lookup_count else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": hit_ratio,
+            "entries": len(self)
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-path", help="Path to the geolocation cache database.",
+                        default=str(DEFAULT_CACHE_PATH), type=str)
+    parser.add_argument("--clear", help="Remove every entry from the cache.", action="store_true")
+
+    arguments = parser.parse_args()
+
+    with GeolocationCache(arguments.cache_path) as cache:
+        if arguments.clear:
+            cache.clear()
+            print(f"Cleared {arguments.cache_path}.")
+        else:
+            print(f"{len(cache)} IP Address(es) cached in {arguments.cache_path}.")
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# GeolocationClient.py
+# HTTP client used by IPGeolocator.py to talk to geolocation-db.com.
+#
+# Every request goes through one keep-alive session (so the TLS handshake only
+# happens once per connection), waits for a token from a rate limiter matched to
+# the provider's limits, and is retried with exponential backoff and jitter when
+# it fails for a transient reason. A circuit breaker stops the client from
+# hammering the provider while it's down, and the latency of every request is
+# recorded so it can be reported at the end of a run.
+# -------------------------------------------------------------------------------
+
+from collections import deque
+from threading import Lock
+from time import monotonic, sleep
+import argparse
+import logging
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = "https://geolocation-db.com/jsonp"
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+DEFAULT_RATE_LIMIT = 5.0
+DEFAULT_BURST_SIZE = 10
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60.0
+DEFAULT_CONNECTION_POOL_SIZE = 8
+
+# Only this many latency samples are kept for the percentiles, so a long-running daemon stays bounded.
+LATENCY_SAMPLE_SIZE = 10000
+
+# Status codes that mean "try again later" rather than "this request is wrong".
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of making a request while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket that allows `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, capacity=DEFAULT_BURST_SIZE):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.last_refill_time = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it. A rate of 0 (or less) disables the limit."""
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                current_time = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (current_time - self.last_refill_time) * self.rate)
+                self.last_refill_time = current_time
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait_time = (1 - self.tokens) / self.rate
+
+            sleep(wait_time)
+
+
+class CircuitBreaker:
+    """Stop sending requests after failure_threshold failures in a row, and try again after reset_timeout seconds.
+
+    While open, every request fails immediately. Once reset_timeout has passed a single trial request is let
+    through (half-open); if it succeeds the breaker closes again, otherwise it reopens.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_time = None
+        self.trial_in_progress = False
+        self.lock = Lock()
+
+    def allow_request(self):
+        """Return True if a request may be made right now."""
+        with self.lock:
+            if self.opened_time is None:
+                return True
+
+            if monotonic() - self.opened_time >= self.reset_timeout and not self.trial_in_progress:
+                self.trial_in_progress = True
+                return True
+
+            return False
+
+    def record_success(self):
+        """Close the circuit after a successful request."""
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_time = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        """Count a failed request, opening the circuit if there have been too many in a row."""
+        with self.lock:
+            self.consecutive_failures += 1
+            should_open = self.trial_in_progress or self.consecutive_failures >= self.failure_threshold
+
+            if should_open and self.opened_time is None:
+                logging.warning(f"CircuitBreaker: Opening the circuit after {self.consecutive_failures} "
+                                f"failure(s) in a row.")
+            if should_open:
+                self.opened_time = monotonic()
+            self.trial_in_progress = False
+
+    @property
+    def is_open(self):
+        """True while requests are being rejected."""
+        return self.opened_time is not None
+
+
+def calculate_percentile(sorted_value_list: list, percentile):
+    """Return the nearest-rank percentile of an already sorted list (or 0.0 for an empty list)."""
+    if not sorted_value_list:
+        return 0.0
+
+    rank = max(0, min(len(sorted_value_list) - 1, round(percentile / 100 * len(sorted_value_list)) - 1))
+    return sorted_value_list[rank]
+
+
+class GeolocationClient:
+    """Rate limited, retrying and circuit-broken client for geolocation-db.com (or a local stand-in)."""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX, rate_limit=DEFAULT_RATE_LIMIT,
+                 burst_size=DEFAULT_BURST_SIZE, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, connection_pool_size=DEFAULT_CONNECTION_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.rate_limiter = TokenBucket(rate_limit, burst_size)
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        # Retries are handled here (with jitter and the circuit breaker), so urllib3 must not retry on its own.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connection_pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.statistics_lock = Lock()
+        self.latency_samples = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+        self.rejected_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the underlying session and its pooled connections."""
+        self.session.close()
+
+    def calculate_backoff(self, attempt, retry_after=None):
+        """Return how long to wait before retry number `attempt` (full jitter, capped at backoff_max)."""
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def record_latency(self, latency):
+        """Record how long a single request took."""
+        with self.statistics_lock:
+            self.request_count += 1
+            self.latency_samples.append(latency)
+
+    def send_request(self, ip_address: str):
+        """Make exactly one GET Request for ip_address and return the response."""
+        self.rate_limiter.acquire()
+
+        start_time = monotonic()
+        try:
+            return self.session.get(f"{self.base_url}/{ip_address}", timeout=self.timeout)
+        finally:
+            self.record_latency(monotonic() - start_time)
+
+    def fetch_raw_json(self, ip_address: str):
+        """Return the raw JSON string that the provider returns for ip_address.
+
+        Failures (connection errors, timeouts, broken responses, 429 and 5xx responses) are retried up to
+        max_retries times. Raises CircuitOpenError without making a request while the circuit breaker is open, and
+        requests.RequestException once every attempt has failed.
+        """
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow_request():
+                with self.statistics_lock:
+                    self.rejected_count += 1
+                raise CircuitOpenError(f"Not looking up {ip_address} since the provider looks to be down.")
+
+            retry_after = None
+            try:
+                response = self.send_request(ip_address)
+
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    retry_after_header = response.headers.get("Retry-After", "")
+                    retry_after = float(retry_after_header) if retry_after_header.isdigit() else None
+
+                response.raise_for_status()
+                self.circuit_breaker.record_success()
+
+                # Now remove the callback() text from the json:
+                response.encoding = "utf-8"
+                return response.text[9:-1]
+
+            except requests.HTTPError as error:
+                if error.response is not None and error.response.status_code not in RETRYABLE_STATUS_CODES:
+                    # The provider is up; it just didn't like this request, so retrying won't help.
+                    self.circuit_breaker.record_success()
+                    with self.statistics_lock:
+                        self.failure_count += 1
+                    raise
+                last_error = error
+
+            except requests.RequestException as error:
+                # Connection errors and timeouts, but also e.g. a response that was cut off half way. Every one of
+                # them has to reach record_failure(), or a half-open trial would never finish.
+                last_error = error
+
+            self.circuit_breaker.record_failure()
+
+            if attempt < self.max_retries:
+                backoff_time = self.calculate_backoff(attempt, retry_after)
+                logging.debug(f"GeolocationClient: Attempt {attempt + 1} for {ip_address} failed ({last_error}), "
+                              f"retrying in {backoff_time:.2f}s.")
+                with self.statistics_lock:
+                    self.retry_count += 1
+                sleep(backoff_time)
+
+        with self.statistics_lock:
+            self.failure_count += 1
+        raise last_error
+
+    def statistics(self):
+        """Return a dict with request counts and latency percentiles (in seconds)."""
+        with self.statistics_lock:
+            latency_list = sorted(self.latency_samples)
+            result = {
+                "requests": self.request_count,
+                "retries": self.retry_count,
+                "failures": self.failure_count,
+                "rejected_by_circuit_breaker": self.rejected_count
+            }
+
+        result.update({
+            "latency_mean": (sum(latency_list) / len(latency_list)) if latency_list else 0.0,
+            "latency_p50": calculate_percentile(latency_list, 50),
+            "latency_p90": calculate_percentile(latency_list, 90),
+            "latency_p99": calculate_percentile(latency_list, 99),
+            "latency_max": latency_list[-1] if latency_list else 0.0
+        })
+        return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ip_address", help="The IP Address to look up.", type=str)
+    parser.add_argument("--base-url", help="Base URL of the geolocation provider.", default=DEFAULT_BASE_URL,
+                        type=str)
+
+    arguments = parser.parse_args()
+
+    with GeolocationClient(arguments.base_url) as client:
+        try:
+            print(client.fetch_raw_json(arguments.ip_address))
+        except requests.RequestException as error:
+            print(f"Error: Could not look up {arguments.ip_address}. Here's the reason: {error}")
+            exit(1)
+        logging.info(f"Client statistics: {client.statistics()}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# IPAddressSet.py
+# Compact set of IP Addresses for IPGeolocator.py.
+#
+# Instead of keeping every address as a Python string, IPv4 addresses are stored
+# as a sorted array of unsigned 32-bit integers and IPv6 addresses as a sorted
+# array of (high, low) unsigned 64-bit pairs. Membership tests are binary
+# searches, set operations are linear merges of the sorted arrays, and addresses
+# can be grouped into the CIDR blocks (/24, /16, ...) that contain them.
+# -------------------------------------------------------------------------------
+
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+import ipaddress
+import logging
+
+UINT64_MASK = (1 << 64) - 1
+DEFAULT_IPV4_PREFIX_LENGTH = 24
+DEFAULT_IPV6_PREFIX_LENGTH = 64
+
+
+def merge_sorted_values(left_values, right_values, keep_left_only, keep_both, keep_right_only):
+    """Walk two sorted, duplicate-free sequences of integers and yield the values selected by the keep_* flags."""
+    left_index = right_index = 0
+    left_length, right_length = len(left_values), len(right_values)
+
+    while left_index < left_length and right_index < right_length:
+        left_value, right_value = left_values[left_index], right_values[right_index]
+        if left_value < right_value:
+            if keep_left_only:
+                yield left_value
+            left_index += 1
+        elif left_value > right_value:
+            if keep_right_only:
+                yield right_value
+            right_index += 1
+        else:
+            if keep_both:
+                yield left_value
+            left_index += 1
+            right_index += 1
+
+    if keep_left_only:
+        for index in range(left_index, left_length):
+            yield left_values[index]
+    if keep_right_only:
+        for index in range(right_index, right_length):
+            yield right_values[index]
+
+
+class IPv6Values:
+    """Read-only sequence view over a 'Q' array that stores 128-bit values as (high, low) pairs."""
+
+    def __init__(self, pair_array):
+        self.pair_array = pair_array
+
+    def __len__(self):
+        return len(self.pair_array) // 2
+
+    def __getitem__(self, index):
+        return (self.pair_array[2 * index] << 64) | self.pair_array[2 * index + 1]
+
+
+def pack_ipv6_values(value_iterable):
+    """Pack an iterable of 128-bit integers into a 'Q' array of (high, low) pairs."""
+    pair_array = array("Q")
+    for value in value_iterable:
+        pair_array.append(value >> 64)
+        pair_array.append(value & UINT64_MASK)
+    return pair_array
+
+
+class IPAddressSet:
+    """Immutable, sorted set of IPv4 and IPv6 Addresses backed by integer arrays.
+
+    Iterating over the set yields the addresses as strings, IPv4 first, each family in numeric order.
+    """
+
+    def __init__(self, ip_address_iterable=()):
+        ipv4_value_set = set()
+        ipv6_value_set = set()
+
+        for ip_address in ip_address_iterable:
+            try:
+                address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                logging.warning(f"IPAddressSet: Ignoring invalid IP Address {ip_address!r}")
+                continue
+
+            if address.version == 4:
+                ipv4_value_set.add(int(address))
+            else:
+                ipv6_value_set.add(int(address))
+
+        self.ipv4_array = array("I", sorted(ipv4_value_set))
+        self.ipv6_array = pack_ipv6_values(sorted(ipv6_value_set))
+
+    @classmethod
+    def from_arrays(cls, ipv4_array, ipv6_array):
+        """Build a set directly from already sorted, duplicate-free arrays."""
+        ip_address_set = cls.__new__(cls)
+        ip_address_set.ipv4_array = ipv4_array
+        ip_address_set.ipv6_array = ipv6_array
+        return ip_address_set
+
+    @property
+    def ipv6_values(self):
+        """The IPv6 Addresses as a sequence of 128-bit integers."""
+        return IPv6Values(self.ipv6_array)
+
+    def __len__(self):
+        return len(self.ipv4_array) + len(self.ipv6_array) // 2
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        for value in self.ipv4_array:
+            yield str(ipaddress.IPv4Address(value))
+        for value in self.ipv6_values:
+            yield str(ipaddress.IPv6Address(value))
+
+    def __contains__(self, ip_address):
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+
+        values = self.ipv4_array if address.version == 4 else self.ipv6_values
+        index = bisect_left(values, int(address))
+        return index < len(values) and values[index] == int(address)
+
+    def __eq__(self, other):
+        if not isinstance(other, IPAddressSet):
+            return NotImplemented
+        return self.ipv4_array == other.ipv4_array and self.ipv6_array == other.ipv6_array
+
+    def __repr__(self):
+        return f"IPAddressSet({len(self.ipv4_array)} IPv4, {len(self.ipv6_array) // 2} IPv6)"
+
+    def combine(self, other, keep_left_only, keep_both, keep_right_only):
+        """Merge this set with another IPAddressSet, keeping the values selected by the keep_* flags."""
+        if not isinstance(other, IPAddressSet):
+            other = IPAddressSet(other)
+
+        ipv4_array = array("I", merge_sorted_values(self.ipv4_array, other.ipv4_array,
+                                                    keep_left_only, keep_both, keep_right_only))
+        ipv6_array = pack_ipv6_values(merge_sorted_values(self.ipv6_values, other.ipv6_values,
+                                                          keep_left_only, keep_both, keep_right_only))
+        return IPAddressSet.from_arrays(ipv4_array, ipv6_array)
+
+    def union(self, other):
+        """Return the addresses found in either set."""
+        return self.combine(other, True, True, True)
+
+    def intersection(self, other):
+        """Return the addresses found in both sets."""
+        return self.combine(other, False, True, False)
+
+    def difference(self, other):
+        """Return the addresses in this set that aren't in other."""
+        return self.combine(other, True, False, False)
+
+    def symmetric_difference(self, other):
+        """Return the addresses found in exactly one of the two sets."""
+        return self.combine(other, True, False, True)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def group_by_network(self, ipv4_prefix_length=DEFAULT_IPV4_PREFIX_LENGTH,
+                         ipv6_prefix_length=DEFAULT_IPV6_PREFIX_LENGTH):
+        """Return a {network: [ip_address, ...]} dict grouping every address by the CIDR block that contains it.
+
+        Since the arrays are sorted, addresses in the same block are next to each other and a single pass is enough.
+        """
+        network_dict = {}
+        for values, bit_count, prefix_length, address_class, network_class in (
+                (self.ipv4_array, 32, ipv4_prefix_length, ipaddress.IPv4Address, ipaddress.IPv4Network),
+                (self.ipv6_values, 128, ipv6_prefix_length, ipaddress.IPv6Address, ipaddress.IPv6Network)):
+            host_bit_count = bit_count - prefix_length
+            value_iterable = (values[index] for index in range(len(values)))
+
+            for network_value, member_values in groupby(value_iterable, key=lambda value: value >> host_bit_count):
+                network = network_class((network_value << host_bit_count, prefix_length))
+                network_dict.update({str(network): [str(address_class(value)) for value in member_values]})
+
+        return network_dict
+
+    def collapse(self, ipv4_prefix_length=DEFAULT_IPV4_PREFIX_LENGTH, ipv6_prefix_length=DEFAULT_IPV6_PREFIX_LENGTH):
+        """Return a {network: member_count} dict of every CIDR block that contains at least one address."""
+        return {network: len(member_list) for network, member_list
+                in self.group_by_network(ipv4_prefix_length, ipv6_prefix_length).items()}
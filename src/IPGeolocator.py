@@ -13,89 +13,543 @@
 import mysql.connector
 import requests
 import logging
+import sqlite3
 import json
+import argparse
+import atexit
 
 import subprocess
-from shlex import split
+import signal
+import os
+import re
+import ipaddress
+from pathlib import Path
+from ast import literal_eval
+from time import time, monotonic
+from threading import Event, Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from GeolocationCache import GeolocationCache, DEFAULT_CACHE_PATH, DEFAULT_TTL_SECONDS, DEFAULT_MAX_ENTRIES
+from IPRangeIndex import IPRangeIndex, IPRangeIndexError
+from ConnectionPool import ConnectionPool, DEFAULT_POOL_SIZE, prepared_cursor, unwrap_connection
+from BanStatistics import update_ban_rollups
+from IPAddressSet import IPAddressSet, DEFAULT_IPV6_PREFIX_LENGTH
+from QueryInstrumentation import QueryInstrumentation, DEFAULT_SLOW_QUERY_THRESHOLD, EXPORT_FORMAT_LIST
+from GeolocationClient import GeolocationClient, DEFAULT_BASE_URL, DEFAULT_MAX_RETRIES, DEFAULT_RATE_LIMIT, \
+    DEFAULT_BURST_SIZE
 
 EXIT_SUCCESS = 0
 EXIT_FAILURE = 1
 
+# Number of geolocation requests that may be in flight at the same time, and how
+# long (in seconds) a single request may take before it is counted as a failure.
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUEST_TIMEOUT = 10
+
+# Lookups that aren't passed a GeolocationClient share one of these per timeout.
+default_geolocation_client_dict = {}
+default_geolocation_client_lock = Lock()
+
+# fail2ban is queried through its client by default, but its SQLite database can be read directly instead.
+FAIL2BAN_CLIENT_COMMAND = ["sudo", "fail2ban-client"]
+DEFAULT_FAIL2BAN_DATABASE = "/var/lib/fail2ban/fail2ban.sqlite3"
+DEFAULT_JAIL_LIST = ["sshd"]
+BAN_SOURCE_LIST = ["client", "database"]
+
+# Where the ban list seen by the previous run is kept when running with --incremental.
+DEFAULT_BAN_STATE_PATH = Path.home() / ".cache" / "ipgeolocator" / "last_ban_set.json"
+
+# Settings used by --daemon, which follows fail2ban's log instead of polling fail2ban-client.
+DEFAULT_FAIL2BAN_LOG = "/var/log/fail2ban.log"
+DEFAULT_MAX_BATCH_SIZE = 50
+DEFAULT_MAX_BATCH_DELAY = 5.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Matches the lines fail2ban writes when an IP is banned or unbanned, e.g.
+# "2024-01-13 13:59:00,123 fail2ban.actions  [812]: NOTICE  [sshd] Ban 192.0.2.1"
+# "2024-01-13 13:59:00,123 fail2ban.actions  [812]: NOTICE  [sshd] Restore Ban 192.0.2.1" (after a restart)
+# "2024-01-13 13:59:00,123 fail2ban.observer [812]: NOTICE  [sshd] Increase Ban 192.0.2.1 (2 # 2:00:00 -> ...)"
+# "2024-01-13 14:09:00,123 fail2ban.actions  [812]: NOTICE  [sshd] Unban 192.0.2.1"
+# Restored and increased bans count as bans.
+FAIL2BAN_LOG_PATTERN = re.compile(r"\[(?P<jail>[^\]]+)\]\s+(?:Restore\s+|Increase\s+)?(?P<action>Ban|Unban)\s+"
+                                  r"(?P<ip_address>[^\s(]+)(?:\s+\(.*\))?\s*$")
+
+# Number of IP Addresses written per commit.
+DEFAULT_BATCH_SIZE = 500
+
+# SQLite before 3.32 refuses statements with more than 999 parameters, so like GeolocationCache's lookups, no
+# statement binds more than this many. A batch is split over as many multi-row statements as that takes.
+MAX_QUERY_PARAMETERS = 500
+# Number of values bound per row by the bulk upsert.
+UPSERT_ROW_PARAMETER_COUNT = 6
+
+# Same layout as the MySQL table, so a SQLite database can stand in for it when testing.
+SQLITE_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sshd_banned_ip_database(
+ip_address TEXT PRIMARY KEY,
+city TEXT NOT NULL,
+state TEXT NOT NULL,
+country TEXT NOT NULL,
+latitude REAL NOT NULL DEFAULT 0.0,
+longitude REAL NOT NULL DEFAULT 0.0,
+first_ban_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+last_ban_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+last_unban_timestamp TIMESTAMP NULL DEFAULT NULL)
+"""
+
+
+def parse_banned_ip_list(status_output: str):
+    """Pull the IP Addresses out of the "Banned IP list:" line printed by `fail2ban-client status <jail>`."""
+    for line in status_output.splitlines():
+        _, separator, ip_list_string = line.partition("Banned IP list:")
+        if separator:
+            return ip_list_string.split()
+
+    return []
+
+
+def run_fail2ban_client(argument_list: list):
+    """Run fail2ban-client with the passed arguments and return its stdout. Raises OSError/CalledProcessError."""
+    command = FAIL2BAN_CLIENT_COMMAND + argument_list
+    logging.debug(f"run_fail2ban_client(): Running {command}")
+    process = subprocess.run(command, capture_output=True, check=True, text=True)
+    return process.stdout
+
+
+def read_banned_ips_from_fail2ban_client(jail_list: list):
+    """Ask fail2ban-client for the IPs currently banned in each jail of jail_list.
+
+    `fail2ban-client banned` returns every jail's ban list from a single process. Older versions of fail2ban
+    don't have that command, in which case `fail2ban-client status <jail>` is run once per jail instead.
+    """
+    try:
+        jail_ban_list = literal_eval(run_fail2ban_client(["banned"]).strip())
+        jail_ban_dict = {jail: ip_list for jail_dict in jail_ban_list for jail, ip_list in jail_dict.items()}
+        return [ip_address for jail in jail_list for ip_address in jail_ban_dict.get(jail, [])]
+
+    except (subprocess.CalledProcessError, ValueError, SyntaxError, TypeError, AttributeError) as error:
+        logging.debug(f"read_banned_ips_from_fail2ban_client(): `fail2ban-client banned` is unusable ({error}), "
+                      f"falling back to `fail2ban-client status`.")
+
+    ip_list = []
+    for jail in jail_list:
+        ip_list.extend(parse_banned_ip_list(run_fail2ban_client(["status", jail])))
+
+    return ip_list
+
 
-def retrieve_current_banned_sshd_ips():
-    """Retrieve a list of currently banned ips that attempted to login through SSH."""
-    command_list = [
-        "sudo fail2ban-client status sshd",
-        "grep -Ei \"Banned IP list:\"",
-        "awk -F : '{print $2;}'"
-    ]
+def read_banned_ips_from_fail2ban_database(jail_list: list, database_path=DEFAULT_FAIL2BAN_DATABASE):
+    """Read the IPs whose ban hasn't expired yet straight out of fail2ban's SQLite database.
 
-    # You'll have to use Popen since you're piping the results:
-    process: subprocess.Popen = subprocess.Popen(split("printf \"\""))
+    A ban is current if its bantime is negative (permanent) or if timeofban + bantime is still in the future.
+    """
+    placeholders = ", ".join("?" * len(jail_list))
+    query = f"""
+    SELECT ip FROM bans
+    WHERE jail IN ({placeholders}) AND (bantime < 0 OR timeofban + bantime > ?)
+    ORDER BY timeofban
+    """
 
-    index = 0
-    for command in command_list:
-        stdin_value = process.stdout if index != 0 else None
-        split_command = split(command)
-        logging.debug(f"retrieve_currently_banned_sshd_ips(): Splitting {command} to {split_command}")
-        logging.debug("retrieve_currently_banned_sshd_ips(): Now running the process:")
-        logging.debug(f"retrieve_currently_banned_sshd_ips(): Current stdout value: {process.stdout}")
-        process = subprocess.Popen(split_command, stdin=stdin_value, stdout=subprocess.PIPE)
-        index += 1
+    logging.debug(f"read_banned_ips_from_fail2ban_database(): Reading bans from {database_path}")
+    connection = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in connection.execute(query, (*jail_list, int(time())))]
+    finally:
+        connection.close()
 
-    # Finally, use run to get back your result.
-    last_process = subprocess.run("cat", stdin=process.stdout, capture_output=True)
 
-    text_result = last_process.stdout.decode("utf-8").strip()
+def retrieve_current_banned_sshd_ips(jail_list: list = None, ban_source="client",
+                                     database_path=DEFAULT_FAIL2BAN_DATABASE):
+    """Retrieve a list of currently banned ips that attempted to login through SSH.
 
-    ip_list = [] if not text_result else text_result.split(" ")
+    The IPs banned in every jail of jail_list (just sshd by default) are read either through fail2ban-client
+    or from fail2ban's database, depending on ban_source. The returned list contains no duplicates.
+    """
+    jail_list = DEFAULT_JAIL_LIST if not jail_list else jail_list
+
+    try:
+        if ban_source == "database":
+            raw_ip_list = read_banned_ips_from_fail2ban_database(jail_list, database_path)
+        else:
+            raw_ip_list = read_banned_ips_from_fail2ban_client(jail_list)
+
+    except (OSError, subprocess.CalledProcessError, sqlite3.Error) as error:
+        print(f"Error: Could not retrieve the banned IP list from fail2ban. Here's the reason: {error}")
+        exit(EXIT_FAILURE)
+
+    ip_list = list(dict.fromkeys(ip_address for ip_address in raw_ip_list if ip_address))
 
     logging.debug(f"retrieve_currently_banned_sshd_ips(): IP List: {ip_list}")
     return ip_list
 
 
-def find_ip_geography_info(ip_address: str):
-    """Identify the geographic information for the passed IP Address by creating a GET Request to geolocation-db.com"""
-    url_path = f"https://geolocation-db.com/jsonp/{ip_address}"
+def load_previous_ban_set(state_path=DEFAULT_BAN_STATE_PATH):
+    """Load the IPAddressSet of IP Addresses that were banned during the previous incremental run."""
+    state_path = Path(state_path)
+    if not state_path.exists():
+        logging.debug(f"load_previous_ban_set(): {str(state_path)} doesn't exist, so every ban is treated as new.")
+        return IPAddressSet()
+
     try:
-        request: requests.Response = requests.get(url_path)
-        request.raise_for_status()
+        with open(state_path, "r") as state_file:
+            return IPAddressSet(json.load(state_file))
 
-    except requests.HTTPError:
-        logging.error(f"Error: HTTP GET Request to {url_path} failed. Here's the reason: {request.reason}.\n"
-                      f"Here's the raw text that was returned: {request.text}")
-        exit(EXIT_FAILURE)
+    except (OSError, json.JSONDecodeError, TypeError) as error:
+        logging.warning(f"load_previous_ban_set(): Ignoring unreadable ban state {str(state_path)}: {error}")
+        return IPAddressSet()
+
+
+def save_ban_set(ip_address_set: IPAddressSet, state_path=DEFAULT_BAN_STATE_PATH):
+    """Save the current ban set for the next incremental run. The file is replaced atomically."""
+    state_path = Path(state_path)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = state_path.with_name(state_path.name + ".tmp")
+
+    if not isinstance(ip_address_set, IPAddressSet):
+        ip_address_set = IPAddressSet(ip_address_set)
 
-    # # Now remove the callback() text from the json and then transform it:
-    request.encoding = "utf-8"
-    raw_json = request.text[9:-1]
-    return raw_json
+    with open(temporary_path, "w") as state_file:
+        json.dump(list(ip_address_set), state_file)
+    os.replace(temporary_path, state_path)
+    logging.debug(f"save_ban_set(): Saved {len(ip_address_set)} IP Addresses to {str(state_path)}")
 
 
-def identify_all_ip_addresses(raw_ip_address_list: list):
-    """Retrieve the geographic information for each IP Address by making a HTTP request to geolocation-db.com"""
+def split_invalid_ip_addresses(ip_address_list: list):
+    """Return (valid_ip_address_list, invalid_ip_address_list), both in the order of ip_address_list."""
+    valid_ip_address_list, invalid_ip_address_list = [], []
+    for ip_address in ip_address_list:
+        try:
+            ipaddress.ip_address(ip_address)
+            valid_ip_address_list.append(ip_address)
+        except ValueError:
+            invalid_ip_address_list.append(ip_address)
+    return valid_ip_address_list, invalid_ip_address_list
+
+
+def compute_ban_diff(current_ip_address_list: list, previous_ip_address_set: IPAddressSet):
+    """Return (added_ip_address_list, removed_ip_address_list) between the previous and current ban lists.
+
+    Added IPs keep the order of current_ip_address_list; removed IPs are in numeric order.
+    """
+    if not isinstance(previous_ip_address_set, IPAddressSet):
+        previous_ip_address_set = IPAddressSet(previous_ip_address_set)
+
+    current_ip_address_set = IPAddressSet(current_ip_address_list)
+    added_ip_address_set = current_ip_address_set - previous_ip_address_set
+    added_ip_address_list = [ip_address for ip_address in current_ip_address_list
+                             if ip_address in added_ip_address_set]
+    removed_ip_address_list = list(previous_ip_address_set - current_ip_address_set)
+
+    logging.debug(f"compute_ban_diff(): {len(added_ip_address_list)} new ban(s), "
+                  f"{len(removed_ip_address_list)} unban(s).")
+    return added_ip_address_list, removed_ip_address_list
+
+
+class LogFollower:
+    """Follow a log file like `tail -F`, picking up the new file after logrotate replaces or truncates it."""
+
+    def __init__(self, log_path, start_at_end=True):
+        self.log_path = Path(log_path)
+        self.log_file = None
+        self.inode = None
+        self.partial_line = ""
+        self.open_log_file(start_at_end)
+
+    def open_log_file(self, start_at_end):
+        """(Re)open the log file, optionally skipping everything that's already in it."""
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+        try:
+            self.log_file = open(self.log_path, "r", encoding="utf-8", errors="replace")
+        except FileNotFoundError:
+            logging.debug(f"LogFollower: {str(self.log_path)} doesn't exist yet.")
+            return
+
+        self.inode = os.fstat(self.log_file.fileno()).st_ino
+        self.partial_line = ""
+        if start_at_end:
+            self.log_file.seek(0, os.SEEK_END)
+
+    def read_lines(self):
+        """Return every complete line written since the last call."""
+        if self.log_file is None:
+            self.open_log_file(start_at_end=False)
+            if self.log_file is None:
+                return []
+
+        line_list = self.read_available_lines()
+
+        # Check whether the file was rotated away (new inode) or truncated in place.
+        try:
+            current_stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return line_list
+
+        if current_stat.st_ino != self.inode or current_stat.st_size < self.log_file.tell():
+            logging.debug(f"LogFollower: {str(self.log_path)} was rotated, reopening it.")
+            self.open_log_file(start_at_end=False)
+            if self.log_file is not None:
+                line_list.extend(self.read_available_lines())
+
+        return line_list
+
+    def read_available_lines(self):
+        """Read whatever is left in the current file, holding on to an unfinished last line."""
+        data = self.partial_line + self.log_file.read()
+        line_list = data.split("\n")
+        self.partial_line = line_list.pop()
+        return line_list
+
+    def close(self):
+        """Close the log file."""
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+
+def parse_fail2ban_log_line(line: str, jail_list: list):
+    """Return an (action, ip_address) tuple for a Ban/Unban line from one of the jails in jail_list, else None."""
+    match = FAIL2BAN_LOG_PATTERN.search(line)
+    if match is None or match.group("jail") not in jail_list:
+        return None
+
+    return match.group("action"), match.group("ip_address")
+
+
+def watch_fail2ban_log(process_batch_callback, jail_list: list = None, log_path=DEFAULT_FAIL2BAN_LOG,
+                       max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_batch_delay=DEFAULT_MAX_BATCH_DELAY,
+                       poll_interval=DEFAULT_POLL_INTERVAL, stop_event: Event = None):
+    """Follow fail2ban's log and pass Ban/Unban events to process_batch_callback in small batches.
+
+    process_batch_callback(ban_ip_address_list, unban_ip_address_list) is called once max_batch_size events
+    are pending or the oldest pending event is max_batch_delay seconds old, whichever comes first. The loop
+    runs until stop_event is set, at which point any pending events are flushed before returning.
+    """
+    jail_list = DEFAULT_JAIL_LIST if not jail_list else jail_list
+    stop_event = Event() if stop_event is None else stop_event
+    log_follower = LogFollower(log_path)
+
+    # Only the latest event per IP matters, so a Ban followed by an Unban in the same batch cancels out.
+    pending_event_dict = {}
+    first_pending_time = None
+
+    def flush_pending_events():
+        ban_ip_address_list = [ip_address for ip_address, action in pending_event_dict.items() if action == "Ban"]
+        unban_ip_address_list = [ip_address for ip_address, action in pending_event_dict.items() if action == "Unban"]
+        pending_event_dict.clear()
+        logging.debug(f"watch_fail2ban_log(): Flushing {len(ban_ip_address_list)} ban(s) and "
+                      f"{len(unban_ip_address_list)} unban(s).")
+        process_batch_callback(ban_ip_address_list, unban_ip_address_list)
+
+    logging.info(f"watch_fail2ban_log(): Watching {log_path} for jails {jail_list}.")
+    try:
+        while not stop_event.is_set():
+            for line in log_follower.read_lines():
+                event = parse_fail2ban_log_line(line, jail_list)
+                if event is None:
+                    continue
+
+                action, ip_address = event
+                pending_event_dict.pop(ip_address, None)
+                pending_event_dict.update({ip_address: action})
+                if first_pending_time is None:
+                    first_pending_time = monotonic()
+
+                if len(pending_event_dict) >= max_batch_size:
+                    flush_pending_events()
+                    first_pending_time = None
+
+            if pending_event_dict and monotonic() - first_pending_time >= max_batch_delay:
+                flush_pending_events()
+                first_pending_time = None
+
+            # Sleep until the next poll, the batch deadline or a shutdown request, whichever comes first.
+            wait_time = poll_interval
+            if first_pending_time is not None:
+                wait_time = min(wait_time, max(0.0, first_pending_time + max_batch_delay - monotonic()))
+            stop_event.wait(wait_time)
+
+        if pending_event_dict:
+            flush_pending_events()
+
+    finally:
+        log_follower.close()
+        logging.info("watch_fail2ban_log(): Stopped watching the log.")
+
+
+def get_default_geolocation_client(timeout=DEFAULT_REQUEST_TIMEOUT):
+    """Return the GeolocationClient shared by lookups that weren't passed one, creating it on first use.
+
+    There's one per timeout, so every request still gets rate limiting, retries and the circuit breaker.
+    """
+    with default_geolocation_client_lock:
+        client = default_geolocation_client_dict.get(timeout)
+        if client is None:
+            client = GeolocationClient(DEFAULT_BASE_URL, timeout)
+            default_geolocation_client_dict.update({timeout: client})
+        return client
+
+
+def lookup_ip_address(ip_address: str, timeout=DEFAULT_REQUEST_TIMEOUT, client: GeolocationClient = None):
+    """Look up a single IP Address and return a (json_object, error_message) tuple.
+
+    Exactly one of the two values will be None. This is what each worker in identify_all_ip_addresses runs.
+    If a client is passed, it's used (with its own timeout) instead of the default client for timeout.
+    """
+    client = get_default_geolocation_client(timeout) if client is None else client
+    try:
+        raw_json = client.fetch_raw_json(ip_address)
+        return json.loads(raw_json), None
+
+    except requests.RequestException as error:
+        return None, f"HTTP GET Request failed: {error}"
+
+    except json.JSONDecodeError as error:
+        return None, f"Could not parse the returned JSON: {error}"
+
+
+def identify_all_ip_addresses(raw_ip_address_list: list, max_workers=DEFAULT_MAX_WORKERS,
+                              timeout=DEFAULT_REQUEST_TIMEOUT, failed_ip_address_dict: dict = None,
+                              cache: GeolocationCache = None, range_index: IPRangeIndex = None, offline=False,
+                              client: GeolocationClient = None, subnet_prefix_length=None):
+    """Retrieve the geographic information for each IP Address by making a HTTP request to geolocation-db.com
+
+    Up to max_workers requests are made concurrently, each with its own timeout. The returned dict is
+    in the same order as raw_ip_address_list. IPs whose lookup failed are left out of it; if
+    failed_ip_address_dict is passed, each of them is recorded there along with the reason.
+
+    If a range_index is passed, IPs are first resolved against it with a local binary search. If a cache
+    is passed, IPs found in it skip the HTTP request entirely, and every successful lookup is stored back
+    into it. When offline is True, IPs that neither of them can resolve are recorded as failures instead
+    of being sent to geolocation-db.com. Otherwise the remaining IPs are requested through client when one
+    is passed, which takes care of rate limiting and retries.
+
+    If subnet_prefix_length is set, only one IP per IPv4 block of that size (and per IPv6 /64) is requested,
+    and its location is reused for the other IPs in the same block. Only the requested IPs are stored in the
+    cache, since the others were never really looked up.
+    """
     information_dict = {}
 
     if not raw_ip_address_list:
         return information_dict
 
-    for ip_address in raw_ip_address_list:
-        # Skip any empty ip_address if it occurs:
-        if not ip_address:
-            logging.debug("retrieve_geographic_ip_information(): Skipping Empty IP Addresses.")
-            continue
+    # Skip any empty (or repeated) ip_address while keeping the original order:
+    ip_address_list = [ip_address for ip_address in dict.fromkeys(raw_ip_address_list) if ip_address]
+    if len(ip_address_list) != len(raw_ip_address_list):
+        logging.debug("identify_all_ip_addresses(): Skipping Empty or Duplicate IP Addresses.")
 
-        raw_json = find_ip_geography_info(ip_address)
-        json_object = json.loads(raw_json)
+    if not ip_address_list:
+        return information_dict
 
-        information_dict.update({ip_address: json_object})
+    offline_ip_address_dict = {}
+    if range_index is not None:
+        for ip_address in ip_address_list:
+            json_object = range_index.lookup(ip_address)
+            if json_object is not None:
+                offline_ip_address_dict.update({ip_address: json_object})
+        logging.debug(f"identify_all_ip_addresses(): Resolved {len(offline_ip_address_dict)} IP Addresses "
+                      f"using the offline range index.")
+
+    # The cache is only touched from this thread; the workers below only make HTTP requests.
+    remaining_ip_address_list = [ip_address for ip_address in ip_address_list
+                                 if ip_address not in offline_ip_address_dict]
+    cached_ip_address_dict = cache.get_many(remaining_ip_address_list) if cache is not None else {}
+    uncached_ip_address_list = [ip_address for ip_address in remaining_ip_address_list
+                                if ip_address not in cached_ip_address_dict]
+
+    if offline:
+        for ip_address in uncached_ip_address_list:
+            logging.warning(f"identify_all_ip_addresses(): Could not resolve {ip_address} offline.")
+            if failed_ip_address_dict is not None:
+                failed_ip_address_dict.update({ip_address: "Not found in the offline range index or the cache."})
+        uncached_ip_address_list = []
+
+    # Map each IP that will actually be requested to the IPs that share its result (itself included).
+    if subnet_prefix_length is not None:
+        # IPAddressSet returns addresses in their canonical form ("2001:DB8::1" comes back as "2001:db8::1"), so
+        # keep track of how each of them was written, and of the ones it couldn't parse at all.
+        original_ip_address_dict = {}
+        for ip_address in uncached_ip_address_list:
+            try:
+                canonical_ip_address = str(ipaddress.ip_address(ip_address))
+            except ValueError:
+                logging.warning(f"identify_all_ip_addresses(): {ip_address} is not a valid IP Address.")
+                if failed_ip_address_dict is not None:
+                    failed_ip_address_dict.update({ip_address: "Not a valid IP Address."})
+                continue
+            original_ip_address_dict.setdefault(canonical_ip_address, []).append(ip_address)
+
+        network_dict = IPAddressSet(original_ip_address_dict).group_by_network(subnet_prefix_length,
+                                                                               DEFAULT_IPV6_PREFIX_LENGTH)
+        shared_ip_address_dict = {}
+        for member_list in network_dict.values():
+            original_member_list = [ip_address for canonical_ip_address in member_list
+                                    for ip_address in original_ip_address_dict.pop(canonical_ip_address, [])]
+            if original_member_list:
+                shared_ip_address_dict.update({original_member_list[0]: original_member_list})
+
+        # Anything left over (e.g. an IPv6 Address with a scope id) didn't survive the round trip.
+        for leftover_ip_address_list in original_ip_address_dict.values():
+            for ip_address in leftover_ip_address_list:
+                logging.warning(f"identify_all_ip_addresses(): Could not group {ip_address} by network.")
+                if failed_ip_address_dict is not None:
+                    failed_ip_address_dict.update({ip_address: "Could not group the IP Address by network."})
+    else:
+        shared_ip_address_dict = {ip_address: [ip_address] for ip_address in uncached_ip_address_list}
+
+    resolved_ip_address_dict = {}
+    if shared_ip_address_dict:
+        request_ip_address_list = list(shared_ip_address_dict)
+        worker_count = max(1, min(max_workers, len(request_ip_address_list)))
+        logging.debug(f"identify_all_ip_addresses(): Looking up {len(request_ip_address_list)} IP Addresses "
+                      f"using {worker_count} workers.")
+
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            # executor.map() yields results in the order they were submitted, not the order they finished.
+            result_list = executor.map(lambda ip_address: lookup_ip_address(ip_address, timeout, client),
+                                       request_ip_address_list)
+
+            for ip_address, (json_object, error_message) in zip(request_ip_address_list, result_list):
+                for member_ip_address in shared_ip_address_dict[ip_address]:
+                    if error_message:
+                        logging.warning(f"identify_all_ip_addresses(): Could not look up {member_ip_address}: "
+                                        f"{error_message}")
+                        if failed_ip_address_dict is not None:
+                            failed_ip_address_dict.update({member_ip_address: error_message})
+                        continue
+
+                    member_json_object = json_object
+                    if member_ip_address != ip_address:
+                        # Only the location is shared; the address fields must describe the neighbour itself.
+                        member_json_object = dict(json_object)
+                        for address_key in ("IPv4", "IPv6"):
+                            if address_key in member_json_object:
+                                member_json_object.update({address_key: member_ip_address})
+
+                    resolved_ip_address_dict.update({member_ip_address: member_json_object})
+
+        if cache is not None:
+            cache.put_many({ip_address: resolved_ip_address_dict[ip_address] for ip_address in request_ip_address_list
+                            if ip_address in resolved_ip_address_dict})
+
+    # Put everything back together in the original order:
+    for ip_address in ip_address_list:
+        for resolved_dict in (offline_ip_address_dict, cached_ip_address_dict, resolved_ip_address_dict):
+            json_object = resolved_dict.get(ip_address)
+            if json_object is not None:
+                break
+
+        if json_object is not None:
+            information_dict.update({ip_address: json_object})
 
     return information_dict
 
 
 def display_ip_address_list(ip_address_dict: dict):
     """Display each currently banned IP along with its geographic information."""
-    if not ip_address_list:
+    if not ip_address_dict:
         print("No Banned IP Addresses were detected :(")
         return
 
@@ -126,15 +580,42 @@ def create_connection(hostname, username, user_password, database_name):
     return connection
 
 
-def insert_new_ip_address_entry(connection, cursor, ip_address, json_object: dict):
-    """Insert a new IP Address Entry."""
-    insert_query = """
-    REPLACE INTO sshd_banned_ip_database (ip_address, city, state, country, latitude, longitude)
-    VALUES(%s, %s, %s, %s, %s, %s)
-    """
+def create_sqlite_connection(database_path):
+    """Create a SQLite connection (with the sshd_banned_ip_database table) to stand in for the MySQL database."""
+    logging.debug(f"create_sqlite_connection: Opening {database_path} as a stand-in database...")
+    try:
+        # The connection may be handed between threads by the connection pool, but never used by two at once.
+        connection = sqlite3.connect(database_path, check_same_thread=False)
+        connection.execute(SQLITE_TABLE_SCHEMA)
+        connection.commit()
+
+    except sqlite3.Error as error:
+        print(f"Error: Could not open {database_path}. Here's the error message : {error}")
+        exit(EXIT_FAILURE)
+
+    return connection
+
+
+def is_sqlite_connection(connection):
+    """Return True if the connection is a SQLite stand-in instead of a mysql.connector connection."""
+    return isinstance(unwrap_connection(connection), sqlite3.Connection)
+
+
+def create_connection_pool(hostname, username, user_password, database_name, pool_size=DEFAULT_POOL_SIZE,
+                           instrumentation: QueryInstrumentation = None):
+    """Create a pool of MySQL connections that all use the passed credentials."""
+    return ConnectionPool(lambda: create_connection(hostname, username, user_password, database_name), pool_size,
+                          instrumentation=instrumentation)
+
 
-    parameter_list = []
+def create_sqlite_connection_pool(database_path, pool_size=DEFAULT_POOL_SIZE,
+                                  instrumentation: QueryInstrumentation = None):
+    """Create a pool of connections to a SQLite stand-in database."""
+    return ConnectionPool(lambda: create_sqlite_connection(database_path), pool_size, instrumentation=instrumentation)
 
+
+def generate_ip_address_row(ip_address, json_object: dict):
+    """Turn an IP Address and its JSON object into a (ip_address, city, state, country, latitude, longitude) tuple."""
     country_name = "Unknown Country" if not json_object['country_name'] else json_object['country_name']
     city = "Unknown City" if not json_object["city"] else json_object["city"]
     state = "Unknown State" if not json_object["state"] else json_object["state"]
@@ -145,96 +626,314 @@ def insert_new_ip_address_entry(connection, cursor, ip_address, json_object: dic
     longitude = json_object["longitude"]
     longitude = 0.0 if (not longitude or longitude == "Not found") else longitude
 
-    temp_tuple = (ip_address, city, state, country_name, latitude, longitude)
-    parameter_list.append(temp_tuple)
-
-    logging.debug(f"insert_ip_addresses_into_database(): Generated Replace Query:\n{insert_query}")
-    logging.debug(f"insert_ip_addresses_into_database(): Parameter list: {parameter_list}")
+    return ip_address, city, state, country_name, latitude, longitude
 
-    try:
-        cursor.executemany(insert_query, parameter_list)
-        connection.commit()
-        logging.debug(f"insert_ip_addresses_into_database(): Inserted {ip_address} into the database.")
-
-    except mysql.connector.Error as error:
-        print(f"Error: Could not insert {ip_address} into the database. Here's the error: {error}")
-        exit(EXIT_FAILURE)
 
+def generate_bulk_upsert_query(row_count, use_sqlite=False):
+    """Generate a multi-row INSERT that only refreshes last_ban_timestamp for IPs that were logged before.
 
-def update_ip_address_entry(connection, cursor, ip_address, json_object: dict):
-    """Update the IP Address Entry."""
-    update_query = """
-    UPDATE sshd_banned_ip_database
-    SET last_ban_timestamp = NOW()
-    WHERE ip_address = %s
+    A banned IP isn't unbanned anymore, so last_unban_timestamp is cleared for those.
     """
-    specified_value = (ip_address,)
-
-    logging.debug(f"insert_ip_addresses_into_database(): Generated Update Query:\n{update_query}")
-
-    try:
-        cursor.execute(update_query, specified_value)
-        connection.commit()
-        logging.debug(f"insert_ip_address_into_database(): Updated last ban timestamp for {ip_address}")
-
-    except mysql.connector.Error as error:
-        print(f"insert_ip_address_into_database(): Could not update the last ban timestamp for {ip_address} "
-              f"Here's the error:\n{error}")
-        exit(EXIT_FAILURE)
-
+    if use_sqlite:
+        value_list = ", ".join(["(?, ?, ?, ?, ?, ?)"] * row_count)
+        conflict_clause = ("ON CONFLICT(ip_address) DO UPDATE SET last_ban_timestamp = CURRENT_TIMESTAMP, "
+                           "last_unban_timestamp = NULL")
+    else:
+        value_list = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * row_count)
+        conflict_clause = "ON DUPLICATE KEY UPDATE last_ban_timestamp = NOW(), last_unban_timestamp = NULL"
 
-def add_ip_address_to_database(connection, ip_address, json_object: dict):
-    """Insert an ip address into the database."""
-    result_list = None
-    cursor = connection.cursor(prepared=True)
+    return f"""
+    INSERT INTO sshd_banned_ip_database (ip_address, city, state, country, latitude, longitude)
+    VALUES {value_list}
+    {conflict_clause}
+    """
 
-    # First, check if the ip_address has been logged before.
-    select_query = """SELECT ip_address from sshd_banned_ip_database where ip_address = %s"""
 
-    # PROTIP: You need a comma for every parameter you pass to execute, even it's
-    # a single parameter.
-    specified_value = (ip_address,)
+def bulk_upsert_ip_addresses(connection, ip_address_dict: dict, batch_size=DEFAULT_BATCH_SIZE):
+    """Write every IP Address in ip_address_dict using multi-row upserts, committing once per batch.
 
-    logging.debug(f"insert_ip_address_into_database(): Checking if IP Address {ip_address} has been logged before...")
-    try:
-        cursor.execute(select_query, specified_value)
-        result_list = cursor.fetchall()
-        connection.commit()
-        logging.debug("insert_ip_address_into_database(): Results of select query was stored in result_list.")
+    New IP Addresses are inserted along with their location, while ones that were logged before only have
+    their last_ban_timestamp updated. Each statement binds at most MAX_QUERY_PARAMETERS values. Works with both a
+    mysql.connector connection and a SQLite stand-in. Returns the number of IP Addresses written.
+    """
+    use_sqlite = is_sqlite_connection(connection)
+    database_error = sqlite3.Error if use_sqlite else mysql.connector.Error
+    batch_size = max(1, batch_size)
+    rows_per_statement = max(1, min(batch_size, MAX_QUERY_PARAMETERS // UPSERT_ROW_PARAMETER_COUNT))
+
+    row_list = [generate_ip_address_row(ip_address, json_object) for ip_address, json_object in ip_address_dict.items()]
+
+    for index in range(0, len(row_list), batch_size):
+        batch = row_list[index:index + batch_size]
+        logging.debug(f"bulk_upsert_ip_addresses(): Writing IP Addresses {index + 1}-{index + len(batch)} "
+                      f"of {len(row_list)}.")
+        try:
+            for statement_index in range(0, len(batch), rows_per_statement):
+                statement_batch = batch[statement_index:statement_index + rows_per_statement]
+                upsert_query = generate_bulk_upsert_query(len(statement_batch), use_sqlite)
+                # Every full statement uses the same query text, so a pooled connection only prepares it once.
+                cursor = prepared_cursor(connection, upsert_query)
+                cursor.execute(upsert_query, [value for row in statement_batch for value in row])
+            connection.commit()
+
+        except database_error as error:
+            connection.rollback()
+            print(f"Error: Could not write IP Addresses {index + 1}-{index + len(batch)} into the database. "
+                  f"Here's the error: {error}")
+            exit(EXIT_FAILURE)
+
+    return len(row_list)
+
+
+def record_unbanned_ip_addresses(connection, ip_address_list: list, batch_size=DEFAULT_BATCH_SIZE):
+    """Set last_unban_timestamp for every IP Address in ip_address_list, committing once per batch."""
+    use_sqlite = is_sqlite_connection(connection)
+    database_error = sqlite3.Error if use_sqlite else mysql.connector.Error
+    placeholder = "?" if use_sqlite else "%s"
+    current_time_function = "CURRENT_TIMESTAMP" if use_sqlite else "NOW()"
+    batch_size = max(1, min(batch_size, MAX_QUERY_PARAMETERS))
+
+    for index in range(0, len(ip_address_list), batch_size):
+        batch = ip_address_list[index:index + batch_size]
+        update_query = f"""
+        UPDATE sshd_banned_ip_database
+        SET last_unban_timestamp = {current_time_function}
+        WHERE ip_address IN ({", ".join([placeholder] * len(batch))})
+        """
+
+        cursor = prepared_cursor(connection, update_query)
+        try:
+            cursor.execute(update_query, batch)
+            connection.commit()
+
+        except database_error as error:
+            connection.rollback()
+            print(f"Error: Could not record the unban timestamp for {len(batch)} IP Addresses. "
+                  f"Here's the error: {error}")
+            exit(EXIT_FAILURE)
+
+    return len(ip_address_list)
+
+
+def create_default_connection_pool(pool_size=DEFAULT_POOL_SIZE, instrumentation: QueryInstrumentation = None):
+    """Create a pool of connections to the MySQL database that stores the banned IP Addresses."""
+    hostname = "[REDACTED]"
+    username = "[REDACTED]"
+    password = "[REDACTED]"
+    database = "[REDACTED]"
 
-    except mysql.connector.Error as error:
-        print(f"insert_ip_address_into_database(): Could not check if {ip_address} has been logged before. "
-              f"Here's the error:\n{error}")
-        exit(EXIT_FAILURE)
+    return create_connection_pool(hostname, username, password, database, pool_size, instrumentation)
 
-    if not result_list:
-        # If not, then insert it into the database
-        insert_new_ip_address_entry(connection, cursor, ip_address, json_object)
-    else:
-        # Otherwise, just update the last time it was seen.
-        update_ip_address_entry(connection, cursor, ip_address, json_object)
 
+def insert_ip_addresses_into_database(ip_address_dict: dict, batch_size=DEFAULT_BATCH_SIZE,
+                                      connection_pool: ConnectionPool = None):
+    """Insert the list of IP Addresses into the database and add them to the daily/monthly ban rollups.
 
-def insert_ip_addresses_into_database(ip_address_dict: dict):
-    """Insert the list of IP Addresses into the database."""
-    if not ip_address_list:
+    If no connection_pool is passed, a single-use pool for the MySQL database is created.
+    """
+    if not ip_address_dict:
         print("Warning: No banned IP addresses were detected.")
         return
 
-    hostname = "[REDACTED]"
-    username = "[REDACTED]"
-    password = "[REDACTED]"
-    database = "[REDACTED]"
+    owns_connection_pool = connection_pool is None
+    if owns_connection_pool:
+        connection_pool = create_default_connection_pool(1)
 
-    connection = create_connection(hostname, username, password, database)
+    with connection_pool.connection() as connection:
+        written_count = bulk_upsert_ip_addresses(connection, ip_address_dict, batch_size)
+        update_ban_rollups(connection, ip_address_dict)
+    logging.debug(f"insert_ip_addresses_into_database(): Wrote {written_count} IP Addresses into the database.")
 
-    for ip_address, json_object in ip_address_dict.items():
-        add_ip_address_to_database(connection, ip_address, json_object)
+    if owns_connection_pool:
+        connection_pool.close()
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    ip_address_list = retrieve_current_banned_sshd_ips()
-    discovered_ip_address_dict = identify_all_ip_addresses(ip_address_list)
-    insert_ip_addresses_into_database(discovered_ip_address_dict)
-    display_ip_address_list(discovered_ip_address_dict)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jail", help="fail2ban jail to read banned IP Addresses from. Can be passed more than once.",
+                        action="append", dest="jail_list", default=None, type=str)
+    parser.add_argument("--ban-source", help="Read banned IP Addresses through fail2ban-client or directly from "
+                        "fail2ban's database.", choices=BAN_SOURCE_LIST, default="client", type=str)
+    parser.add_argument("--fail2ban-database", help="Path to fail2ban's SQLite database.",
+                        default=DEFAULT_FAIL2BAN_DATABASE, type=str)
+    parser.add_argument("--max-workers", help="Number of geolocation requests to make at the same time.",
+                        default=DEFAULT_MAX_WORKERS, type=int)
+    parser.add_argument("--timeout", help="Number of seconds before a single geolocation request is abandoned.",
+                        default=DEFAULT_REQUEST_TIMEOUT, type=float)
+    parser.add_argument("--max-retries", help="Number of times a failed geolocation request is retried.",
+                        default=DEFAULT_MAX_RETRIES, type=int)
+    parser.add_argument("--rate-limit", help="Maximum number of geolocation requests per second (0 for no limit).",
+                        default=DEFAULT_RATE_LIMIT, type=float)
+    parser.add_argument("--burst-size", help="Number of geolocation requests that may be sent in a burst.",
+                        default=DEFAULT_BURST_SIZE, type=int)
+    parser.add_argument("--geolocation-url", help="Base URL of the geolocation provider.",
+                        default=DEFAULT_BASE_URL, type=str)
+    parser.add_argument("--share-subnet-lookups", help="Only look up one IP Address per IPv4 block of this prefix "
+                        "length (e.g. 24) and reuse its location for the rest of the block.",
+                        dest="subnet_prefix_length", default=None, type=int)
+    parser.add_argument("--cache-path", help="Path to the on-disk geolocation cache.",
+                        default=str(DEFAULT_CACHE_PATH), type=str)
+    parser.add_argument("--cache-ttl", help="Number of seconds a cached geolocation stays valid.",
+                        default=DEFAULT_TTL_SECONDS, type=int)
+    parser.add_argument("--cache-size", help="Maximum number of IP Addresses to keep in the cache.",
+                        default=DEFAULT_MAX_ENTRIES, type=int)
+    parser.add_argument("--no-cache", help="Always query geolocation-db.com instead of using the cache.",
+                        action="store_true")
+    parser.add_argument("--batch-size", help="Number of IP Addresses written to the database per transaction.",
+                        default=DEFAULT_BATCH_SIZE, type=int)
+    parser.add_argument("--pool-size", help="Maximum number of database connections to keep open.",
+                        default=DEFAULT_POOL_SIZE, type=int)
+    parser.add_argument("--sqlite-database", help="Write to this SQLite database instead of the MySQL database.",
+                        default=None, type=str)
+    parser.add_argument("--query-metrics", help="Time every database query and write the metrics to this file "
+                        "when the script exits.", default=None, type=str)
+    parser.add_argument("--query-metrics-format", help="Format of the --query-metrics file.",
+                        choices=EXPORT_FORMAT_LIST, default="json", type=str)
+    parser.add_argument("--slow-query-threshold", help="Queries that take at least this many seconds are kept as "
+                        "slow query samples.", default=DEFAULT_SLOW_QUERY_THRESHOLD, type=float)
+    parser.add_argument("--range-index", help="Path to an index built by IPRangeIndex.py that is used to resolve "
+                        "IP Addresses offline before querying geolocation-db.com.", default=None, type=str)
+    parser.add_argument("--incremental", help="Only process IP Addresses that were banned or unbanned since the "
+                        "previous incremental run.", action="store_true")
+    parser.add_argument("--ban-state-path", help="Where --incremental keeps the previously seen ban list.",
+                        default=str(DEFAULT_BAN_STATE_PATH), type=str)
+    parser.add_argument("--daemon", help="Keep running and react to Ban/Unban lines in fail2ban's log instead of "
+                        "reading the ban list once.", action="store_true")
+    parser.add_argument("--fail2ban-log", help="Path to the fail2ban log followed by --daemon.",
+                        default=DEFAULT_FAIL2BAN_LOG, type=str)
+    parser.add_argument("--max-batch-size", help="Number of pending log events that triggers a batch in --daemon mode.",
+                        default=DEFAULT_MAX_BATCH_SIZE, type=int)
+    parser.add_argument("--max-batch-delay", help="Number of seconds a log event may wait for its batch in --daemon "
+                        "mode.", default=DEFAULT_MAX_BATCH_DELAY, type=float)
+    parser.add_argument("--poll-interval", help="Number of seconds between checks of the fail2ban log.",
+                        default=DEFAULT_POLL_INTERVAL, type=float)
+    parser.add_argument("--offline", help="Never query geolocation-db.com; IP Addresses missing from the range index "
+                        "and the cache are reported as failures.", action="store_true")
+
+    arguments = parser.parse_args()
+    logging.debug(f"main(): Passed Arguments: {arguments}")
+
+    if arguments.subnet_prefix_length is not None and not 0 <= arguments.subnet_prefix_length <= 32:
+        print(f"Error: --share-subnet-lookups expects an IPv4 prefix length between 0 and 32, "
+              f"not {arguments.subnet_prefix_length}.")
+        exit(EXIT_FAILURE)
+
+    geolocation_cache = None
+    if not arguments.no_cache:
+        geolocation_cache = GeolocationCache(arguments.cache_path, arguments.cache_ttl, arguments.cache_size)
+
+    ip_range_index = None
+    if arguments.range_index:
+        try:
+            ip_range_index = IPRangeIndex(arguments.range_index)
+        except (OSError, IPRangeIndexError) as error:
+            print(f"Error: Could not open the range index {arguments.range_index}. Here's the reason: {error}")
+            exit(EXIT_FAILURE)
+
+    geolocation_client = GeolocationClient(arguments.geolocation_url, arguments.timeout, arguments.max_retries,
+                                           rate_limit=arguments.rate_limit, burst_size=arguments.burst_size,
+                                           connection_pool_size=arguments.max_workers)
+
+    query_instrumentation = None
+    if arguments.query_metrics:
+        query_instrumentation = QueryInstrumentation(arguments.slow_query_threshold)
+        # Registered with atexit so the metrics are written even when the script bails out with exit().
+        atexit.register(query_instrumentation.export, arguments.query_metrics, arguments.query_metrics_format)
+
+    if arguments.sqlite_database:
+        database_pool = create_sqlite_connection_pool(arguments.sqlite_database, arguments.pool_size,
+                                                      query_instrumentation)
+    else:
+        database_pool = create_default_connection_pool(arguments.pool_size, query_instrumentation)
+
+    def report_failed_ip_addresses(failed_ip_address_dict):
+        for failed_ip_address, reason in failed_ip_address_dict.items():
+            print(f"Warning: Could not look up {failed_ip_address}. Here's the reason: {reason}")
+
+    if arguments.daemon:
+        def process_ban_batch(ban_ip_address_list, unban_ip_address_list):
+            failed_ip_address_dict = {}
+            discovered_ip_address_dict = identify_all_ip_addresses(ban_ip_address_list, arguments.max_workers,
+                                                                   arguments.timeout, failed_ip_address_dict,
+                                                                   geolocation_cache, ip_range_index,
+                                                                   arguments.offline, geolocation_client,
+                                                                   arguments.subnet_prefix_length)
+            report_failed_ip_addresses(failed_ip_address_dict)
+
+            if discovered_ip_address_dict:
+                insert_ip_addresses_into_database(discovered_ip_address_dict, arguments.batch_size, database_pool)
+                display_ip_address_list(discovered_ip_address_dict)
+
+            if unban_ip_address_list:
+                with database_pool.connection() as connection:
+                    record_unbanned_ip_addresses(connection, unban_ip_address_list, arguments.batch_size)
+
+        stop_event = Event()
+
+        def request_shutdown(signal_number, frame):
+            logging.info(f"main(): Received signal {signal_number}, shutting down after the current batch.")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_shutdown)
+        signal.signal(signal.SIGINT, request_shutdown)
+
+        watch_fail2ban_log(process_ban_batch, arguments.jail_list, arguments.fail2ban_log, arguments.max_batch_size,
+                           arguments.max_batch_delay, arguments.poll_interval, stop_event)
+        discovered_ip_address_dict = None
+    else:
+        ip_address_list = retrieve_current_banned_sshd_ips(arguments.jail_list, arguments.ban_source,
+                                                           arguments.fail2ban_database)
+
+        # In incremental mode, only the IPs that changed since the last run are looked up and written.
+        lookup_ip_address_list = ip_address_list
+        removed_ip_address_list = []
+        if arguments.incremental:
+            # The ban state can't hold entries that aren't IP Addresses, so they're dropped here once instead of
+            # being diffed (and warned about by every IPAddressSet built from them) on every run.
+            ip_address_list, invalid_ip_address_list = split_invalid_ip_addresses(ip_address_list)
+            if invalid_ip_address_list:
+                logging.warning(f"main(): Ignoring {len(invalid_ip_address_list)} banned entries that aren't IP "
+                                f"Addresses: {invalid_ip_address_list}")
+            lookup_ip_address_list = ip_address_list
+            previous_ip_address_set = load_previous_ban_set(arguments.ban_state_path)
+            lookup_ip_address_list, removed_ip_address_list = compute_ban_diff(ip_address_list,
+                                                                               previous_ip_address_set)
+            logging.info(f"main(): {len(lookup_ip_address_list)} new ban(s) and {len(removed_ip_address_list)} "
+                         f"unban(s) out of {len(ip_address_list)} banned IP Addresses.")
+
+        failed_ip_address_dict = {}
+        discovered_ip_address_dict = identify_all_ip_addresses(lookup_ip_address_list, arguments.max_workers,
+                                                               arguments.timeout, failed_ip_address_dict,
+                                                               geolocation_cache, ip_range_index, arguments.offline,
+                                                               geolocation_client, arguments.subnet_prefix_length)
+        report_failed_ip_addresses(failed_ip_address_dict)
+
+        if discovered_ip_address_dict or not arguments.incremental:
+            insert_ip_addresses_into_database(discovered_ip_address_dict, arguments.batch_size, database_pool)
+
+        if removed_ip_address_list:
+            with database_pool.connection() as connection:
+                record_unbanned_ip_addresses(connection, removed_ip_address_list, arguments.batch_size)
+
+        if arguments.incremental:
+            # IPs that couldn't be looked up are left out so that the next run retries them.
+            save_ban_set(IPAddressSet(ip_address_list) - IPAddressSet(failed_ip_address_dict),
+                         arguments.ban_state_path)
+
+    logging.info(f"main(): Geolocation client statistics: {geolocation_client.statistics()}")
+    geolocation_client.close()
+
+    if geolocation_cache is not None:
+        logging.info(f"main(): Geolocation cache statistics: {geolocation_cache.statistics()}")
+        geolocation_cache.close()
+
+    if ip_range_index is not None:
+        ip_range_index.close()
+
+    logging.info(f"main(): Connection pool statistics: {database_pool.statistics()}")
+    database_pool.close()
+
+    if discovered_ip_address_dict is not None:
+        display_ip_address_list(discovered_ip_address_dict)
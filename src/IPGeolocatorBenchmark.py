@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# IPGeolocatorBenchmark.py
+# Repeatable benchmark for the IPGeolocator.py pipeline:
+#
+#   retrieve_current_banned_sshd_ips -> identify_all_ip_addresses -> insert_ip_addresses_into_database
+#
+# Nothing external is touched. fail2ban-client is replaced by a small fake script,
+# geolocation-db.com by a local HTTP server that answers in the same JSONP format
+# after a configurable delay, and MySQL by a temporary SQLite database (or a local
+# MariaDB/MySQL server if credentials are passed). For each ban list size the
+# throughput, the min/median/max time of every stage over the timed runs, the
+# p50/p99 latency of every geolocation request and the peak memory are reported.
+#
+# Usage: ./IPGeolocatorBenchmark.py --sizes 10 1000 100000 --latency 0.005
+# -------------------------------------------------------------------------------
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter, sleep
+from pathlib import Path
+import ipaddress
+import tracemalloc
+import resource
+import argparse
+import logging
+import json
+import sys
+
+import IPGeolocator
+from GeolocationClient import GeolocationClient, calculate_percentile
+from JSONParser import TerminalColor
+
+DEFAULT_SIZE_LIST = [10, 1000, 100000]
+DEFAULT_REPEAT_COUNT = 3
+DEFAULT_LATENCY = 0.005
+
+# The benchmark IPs are consecutive addresses starting here.
+FIRST_BENCHMARK_IP = int(ipaddress.IPv4Address("11.0.0.0"))
+
+STAGE_LIST = ["retrieve", "identify", "insert"]
+
+FAKE_FAIL2BAN_CLIENT = """#!{python}
+# Fake fail2ban-client used by IPGeolocatorBenchmark.py. It reports the IPs listed in {ip_list_path}.
+import sys
+
+with open({ip_list_path!r}) as ip_list_file:
+    ip_list = ip_list_file.read().split()
+
+if sys.argv[1:] == ["banned"]:
+    print(repr([{{"sshd": ip_list}}]))
+else:
+    print("Status for the jail: sshd")
+    print("`- Actions")
+    print("   `- Banned IP list:\\t" + " ".join(ip_list))
+"""
+
+
+def create_geolocation_handler(latency):
+    """Create a request handler class that answers like geolocation-db.com after sleeping for `latency` seconds."""
+
+    class GeolocationHandler(BaseHTTPRequestHandler):
+        """Serve /jsonp/<ip_address> in the same callback({...}) format as geolocation-db.com."""
+
+        protocol_version = "HTTP/1.1"
+
+        # The headers and body are written separately, so Nagle's algorithm would add ~40ms to every response.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            ip_address = self.path.rsplit("/", 1)[-1]
+            json_object = {
+                "country_code": "XX",
+                "country_name": "Benchmark Country",
+                "city": "Benchmark City",
+                "postal": None,
+                "latitude": 12.5,
+                "longitude": -45.25,
+                "IPv4": ip_address,
+                "state": "Benchmark State"
+            }
+            body = f"callback({json.dumps(json_object)})".encode("utf-8")
+
+            if latency > 0:
+                sleep(latency)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/javascript")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep the benchmark output readable.
+            pass
+
+    return GeolocationHandler
+
+
+def start_geolocation_server(latency):
+    """Start the stand-in geolocation server on a random local port and return it."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), create_geolocation_handler(latency))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    logging.debug(f"start_geolocation_server(): Listening on port {server.server_port}")
+    return server
+
+
+def generate_ip_address_list(ip_count):
+    """Generate ip_count distinct IPv4 Addresses."""
+    return [str(ipaddress.IPv4Address(FIRST_BENCHMARK_IP + index)) for index in range(ip_count)]
+
+
+def create_fake_fail2ban_client(directory: Path, ip_address_list: list):
+    """Write the IP list and a fake fail2ban-client script into directory, and return the script's path."""
+    ip_list_path = directory / "banned_ip_list.txt"
+    ip_list_path.write_text(" ".join(ip_address_list))
+
+    script_path = directory / "fail2ban-client"
+    script_path.write_text(FAKE_FAIL2BAN_CLIENT.format(python=sys.executable, ip_list_path=str(ip_list_path)))
+    script_path.chmod(0o755)
+    return script_path
+
+
+def measure_stage(stage_function, trace_memory):
+    """Run stage_function and return (result, elapsed seconds, peak traced memory in bytes).
+
+    tracemalloc slows allocation-heavy code down a lot, so memory is only traced when trace_memory is True
+    (and the elapsed time of such a run shouldn't be trusted).
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    start_time = perf_counter()
+    try:
+        result = stage_function()
+    finally:
+        elapsed_time = perf_counter() - start_time
+        peak_memory = 0
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    return result, elapsed_time, peak_memory
+
+
+def benchmark_size(ip_count, arguments, server_url, work_directory: Path):
+    """Run the whole pipeline `arguments.repeat` times against ip_count banned IPs and summarize the results."""
+    ip_address_list = generate_ip_address_list(ip_count)
+    IPGeolocator.FAIL2BAN_CLIENT_COMMAND = [str(create_fake_fail2ban_client(work_directory, ip_address_list))]
+
+    if arguments.mysql_host:
+        database_pool = IPGeolocator.create_connection_pool(arguments.mysql_host, arguments.mysql_user,
+                                                            arguments.mysql_password, arguments.mysql_database)
+    else:
+        database_path = work_directory / f"benchmark_{ip_count}.sqlite3"
+        database_pool = IPGeolocator.create_sqlite_connection_pool(str(database_path))
+
+    stage_time_dict = {stage: [] for stage in STAGE_LIST}
+    stage_memory_dict = {stage: 0 for stage in STAGE_LIST}
+    request_latency_list = []
+    failure_count = 0
+
+    # Iteration 0 is an untimed warm-up that traces memory; the remaining ones are timed without tracing.
+    for iteration in range(arguments.repeat + 1):
+        trace_memory = iteration == 0
+        logging.info(f"benchmark_size(): {ip_count} IPs, iteration {iteration} of {arguments.repeat}")
+
+        # A new client per iteration, so that the latency samples aren't mixed between iterations.
+        client = GeolocationClient(server_url, rate_limit=0, connection_pool_size=arguments.max_workers)
+        failed_ip_address_dict = {}
+
+        retrieved_ip_list, retrieve_time, retrieve_memory = measure_stage(
+            lambda: IPGeolocator.retrieve_current_banned_sshd_ips(), trace_memory)
+        information_dict, identify_time, identify_memory = measure_stage(
+            lambda: IPGeolocator.identify_all_ip_addresses(retrieved_ip_list, arguments.max_workers,
+                                                           failed_ip_address_dict=failed_ip_address_dict,
+                                                           client=client), trace_memory)
+        _, insert_time, insert_memory = measure_stage(
+            lambda: IPGeolocator.insert_ip_addresses_into_database(information_dict, arguments.batch_size,
+                                                                   database_pool), trace_memory)
+
+        for stage, elapsed_time, peak_memory in (("retrieve", retrieve_time, retrieve_memory),
+                                                 ("identify", identify_time, identify_memory),
+                                                 ("insert", insert_time, insert_memory)):
+            stage_memory_dict[stage] = max(stage_memory_dict[stage], peak_memory)
+            if not trace_memory:
+                stage_time_dict[stage].append(elapsed_time)
+
+        if not trace_memory:
+            request_latency_list.extend(client.latency_samples)
+            failure_count += len(failed_ip_address_dict)
+        client.close()
+
+    database_pool.close()
+
+    total_time_list = sorted(sum(stage_time_dict[stage][index] for stage in STAGE_LIST)
+                             for index in range(arguments.repeat))
+    total_time_median = calculate_percentile(total_time_list, 50)
+    request_latency_list.sort()
+
+    result = {
+        "ip_count": ip_count,
+        "repeat": arguments.repeat,
+        "failures": failure_count,
+        "throughput_ips_per_second": ip_count / total_time_median if total_time_median > 0 else 0.0,
+        "request_latency_p50": calculate_percentile(request_latency_list, 50),
+        "request_latency_p99": calculate_percentile(request_latency_list, 99),
+        "stages": {}
+    }
+
+    # Each stage is timed once per run, so with a handful of runs only the min/median/max say anything.
+    for stage in STAGE_LIST:
+        time_list = sorted(stage_time_dict[stage])
+        stage_time_median = calculate_percentile(time_list, 50)
+        result["stages"].update({stage: {
+            "min": time_list[0],
+            "median": stage_time_median,
+            "max": time_list[-1],
+            "ips_per_second": ip_count / stage_time_median if stage_time_median > 0 else 0.0,
+            "peak_memory_bytes": stage_memory_dict[stage]
+        }})
+
+    return result
+
+
+def print_result(result: dict):
+    """Print the summary of a single benchmark size."""
+    print(f"{TerminalColor.BOLD}{result['ip_count']} IPs{TerminalColor.CLEAR_COLOR} "
+          f"({result['repeat']} run(s), {result['failures']} failed lookup(s))")
+    print(f"    Throughput      : {result['throughput_ips_per_second']:.1f} IPs/s")
+    print(f"    Request latency : p50 {result['request_latency_p50'] * 1000:.2f} ms, "
+          f"p99 {result['request_latency_p99'] * 1000:.2f} ms")
+
+    for stage, stage_result in result["stages"].items():
+        print(f"    {stage:<16}: min {stage_result['min'] * 1000:10.2f} ms  "
+              f"median {stage_result['median'] * 1000:10.2f} ms  "
+              f"max {stage_result['max'] * 1000:10.2f} ms  "
+              f"{stage_result['ips_per_second']:12.1f} IPs/s  "
+              f"peak {stage_result['peak_memory_bytes'] / 1024:10.1f} KiB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", help="Ban list sizes to benchmark.", nargs="+", default=DEFAULT_SIZE_LIST, type=int)
+    parser.add_argument("--repeat", help="Number of times the pipeline is run for each size.",
+                        default=DEFAULT_REPEAT_COUNT, type=int)
+    parser.add_argument("--latency", help="Number of seconds the stand-in server waits before each response.",
+                        default=DEFAULT_LATENCY, type=float)
+    parser.add_argument("--max-workers", help="Number of concurrent geolocation requests.",
+                        default=IPGeolocator.DEFAULT_MAX_WORKERS, type=int)
+    parser.add_argument("--batch-size", help="Number of IP Addresses per database transaction.",
+                        default=IPGeolocator.DEFAULT_BATCH_SIZE, type=int)
+    parser.add_argument("--json-output", help="Also write the results to this JSON file.", default=None, type=str)
+    parser.add_argument("--mysql-host", help="Benchmark against this MySQL/MariaDB server instead of SQLite.",
+                        default=None, type=str)
+    parser.add_argument("--mysql-user", help="MySQL/MariaDB username.", default=None, type=str)
+    parser.add_argument("--mysql-password", help="MySQL/MariaDB password.", default=None, type=str)
+    parser.add_argument("--mysql-database", help="MySQL/MariaDB database containing sshd_banned_ip_database.",
+                        default=None, type=str)
+
+    arguments = parser.parse_args()
+    arguments.repeat = max(1, arguments.repeat)
+
+    geolocation_server = start_geolocation_server(arguments.latency)
+    server_url = f"http://127.0.0.1:{geolocation_server.server_port}/jsonp"
+
+    result_list = []
+    with TemporaryDirectory(prefix="ipgeolocator_benchmark_") as temporary_directory:
+        for ip_count in arguments.sizes:
+            result = benchmark_size(ip_count, arguments, server_url, Path(temporary_directory))
+            result_list.append(result)
+            print_result(result)
+
+    geolocation_server.shutdown()
+
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Peak resident memory of the whole benchmark: {peak_rss / 1024:.1f} MiB")
+
+    if arguments.json_output:
+        with open(arguments.json_output, "w") as json_file:
+            json.dump({"results": result_list, "peak_rss_kib": peak_rss}, json_file, indent=4)
+        print(f"Results written to {arguments.json_output}.")
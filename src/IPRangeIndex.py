@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# IPRangeIndex.py
+# Offline IP-to-location lookups for IPGeolocator.py.
+#
+# A CSV of IP ranges in the form start,end,country,city,latitude,longitude is
+# compiled once into a binary index file made of sorted integer arrays. The index
+# is then memory-mapped, so opening it is nearly free, and each lookup is a binary
+# search over the range starts instead of a HTTP GET Request.
+#
+# Usage: ./IPRangeIndex.py ranges.csv ranges.idx
+# -------------------------------------------------------------------------------
+
+from pathlib import Path
+from array import array
+from bisect import bisect_right
+import ipaddress
+import argparse
+import logging
+import struct
+import mmap
+import json
+import csv
+import sys
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+
+# Header: magic, byte order, IPv4 range count, IPv6 range count, record count, record blob length.
+INDEX_MAGIC = b"IPRIDX01"
+HEADER_FORMAT = "<8s8sQQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+UINT64_MASK = (1 << 64) - 1
+
+
+class IPRangeIndexError(Exception):
+    """Raised when a range index can't be built or loaded."""
+
+
+class UInt128View:
+    """Read-only sequence of 128-bit integers stored as (high, low) pairs in a 64-bit memoryview.
+
+    This only exists so that bisect can binary search the IPv6 range starts without copying them.
+    """
+
+    def __init__(self, uint64_view):
+        self.uint64_view = uint64_view
+
+    def __len__(self):
+        return len(self.uint64_view) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return (self.uint64_view[2 * index] << 64) | self.uint64_view[2 * index + 1]
+
+
+def align_to_eight(offset):
+    """Round offset up to the next multiple of 8 so that every array section is aligned."""
+    return (offset + 7) & ~7
+
+
+def calculate_index_size(ipv4_count, ipv6_count, record_count, blob_length):
+    """Return the size in bytes of an index file with these counts, laid out the way build_range_index writes it."""
+    offset = HEADER_SIZE
+    for type_code, item_count in (("I", ipv4_count), ("I", ipv4_count), ("I", ipv4_count), ("Q", 2 * ipv6_count),
+                                  ("Q", 2 * ipv6_count), ("I", ipv6_count), ("Q", record_count + 1)):
+        offset = align_to_eight(offset) + item_count * array(type_code).itemsize
+    return offset + blob_length
+
+
+def parse_ip_value(value: str):
+    """Convert either an IP Address string or a plain integer string into an ipaddress object."""
+    value = value.strip()
+    return ipaddress.ip_address(int(value) if value.isdigit() else value)
+
+
+def parse_coordinate(value: str):
+    """Convert a latitude/longitude column into a float, or None if the column is empty or invalid."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def build_range_index(csv_path, index_path):
+    """Compile a CSV of start,end,country,city,latitude,longitude rows into a binary index file.
+
+    Returns a (ipv4_count, ipv6_count, record_count) tuple.
+    """
+    ipv4_range_list = []
+    ipv6_range_list = []
+    record_id_dict = {}
+
+    logging.debug(f"build_range_index(): Reading ranges from {str(csv_path)}")
+    with open(csv_path, "r", newline="", encoding="utf-8") as csv_file:
+        for line_number, row in enumerate(csv.reader(csv_file), start=1):
+            if len(row) < 6:
+                logging.debug(f"build_range_index(): Skipping line {line_number} since it's too short.")
+                continue
+
+            try:
+                start_address = parse_ip_value(row[0])
+                end_address = parse_ip_value(row[1])
+            except ValueError:
+                # Most likely the header row.
+                logging.debug(f"build_range_index(): Skipping line {line_number} since it has no valid IPs.")
+                continue
+
+            if start_address.version != end_address.version or int(start_address) > int(end_address):
+                raise IPRangeIndexError(f"Line {line_number} of {str(csv_path)} is not a valid range.")
+
+            record_key = tuple(column.strip() for column in row[2:6])
+            record_id = record_id_dict.setdefault(record_key, len(record_id_dict))
+
+            range_list = ipv4_range_list if start_address.version == 4 else ipv6_range_list
+            range_list.append((int(start_address), int(end_address), record_id))
+
+    ipv4_range_list.sort()
+    ipv6_range_list.sort()
+
+    for range_list in (ipv4_range_list, ipv6_range_list):
+        for index in range(1, len(range_list)):
+            if range_list[index][0] <= range_list[index - 1][1]:
+                raise IPRangeIndexError(f"{str(csv_path)} contains overlapping ranges starting at "
+                                        f"{ipaddress.ip_address(range_list[index][0])}.")
+
+    # Each distinct location is stored once as a JSON string; ranges refer to it by id.
+    record_blob = bytearray()
+    record_offsets = array("Q", [0])
+    for country_name, city, latitude, longitude in record_id_dict:
+        record = {"country_name": country_name, "city": city,
+                  "latitude": parse_coordinate(latitude), "longitude": parse_coordinate(longitude)}
+        record_blob += json.dumps(record, separators=(",", ":")).encode("utf-8")
+        record_offsets.append(len(record_blob))
+
+    ipv4_starts = array("I", (start for start, _, _ in ipv4_range_list))
+    ipv4_ends = array("I", (end for _, end, _ in ipv4_range_list))
+    ipv4_records = array("I", (record_id for _, _, record_id in ipv4_range_list))
+
+    ipv6_starts = array("Q")
+    ipv6_ends = array("Q")
+    for start, end, _ in ipv6_range_list:
+        ipv6_starts.extend((start >> 64, start & UINT64_MASK))
+        ipv6_ends.extend((end >> 64, end & UINT64_MASK))
+    ipv6_records = array("I", (record_id for _, _, record_id in ipv6_range_list))
+
+    header = struct.pack(HEADER_FORMAT, INDEX_MAGIC, sys.byteorder.encode("ascii").ljust(8, b"\0"),
+                         len(ipv4_range_list), len(ipv6_range_list), len(record_id_dict), len(record_blob))
+
+    with open(index_path, "wb") as index_file:
+        index_file.write(header)
+        for section in (ipv4_starts, ipv4_ends, ipv4_records, ipv6_starts, ipv6_ends, ipv6_records,
+                        record_offsets):
+            index_file.write(b"\0" * (align_to_eight(index_file.tell()) - index_file.tell()))
+            section.tofile(index_file)
+        index_file.write(record_blob)
+
+    logging.debug(f"build_range_index(): Wrote {len(ipv4_range_list)} IPv4 ranges, {len(ipv6_range_list)} IPv6 "
+                  f"ranges and {len(record_id_dict)} locations to {str(index_path)}")
+    return len(ipv4_range_list), len(ipv6_range_list), len(record_id_dict)
+
+
+class IPRangeIndex:
+    """Memory-mapped, read-only index built by build_range_index."""
+
+    def __init__(self, index_path):
+        self.index_path = Path(index_path)
+        self.index_file = open(self.index_path, "rb")
+        self.mapped_file = None
+        self.file_view = None
+        self.section_list = []
+        try:
+            self.mapped_file = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.index_file.close()
+            raise IPRangeIndexError(f"{str(self.index_path)} is empty.")
+
+        file_size = len(self.mapped_file)
+        if file_size < HEADER_SIZE:
+            self.close()
+            raise IPRangeIndexError(f"{str(self.index_path)} is too short to be an IP range index.")
+
+        magic, byte_order, ipv4_count, ipv6_count, record_count, blob_length = \
+            struct.unpack_from(HEADER_FORMAT, self.mapped_file)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise IPRangeIndexError(f"{str(self.index_path)} is not an IP range index.")
+        if byte_order.rstrip(b"\0").decode("ascii") != sys.byteorder:
+            self.close()
+            raise IPRangeIndexError(f"{str(self.index_path)} was built on a machine with a different byte order.")
+        # A truncated file would otherwise only fail once a section is cast or looked up.
+        expected_size = calculate_index_size(ipv4_count, ipv6_count, record_count, blob_length)
+        if file_size < expected_size:
+            self.close()
+            raise IPRangeIndexError(f"{str(self.index_path)} is truncated or corrupt: the header describes "
+                                    f"{expected_size} bytes, but the file only has {file_size}.")
+
+        self.file_view = memoryview(self.mapped_file)
+        self.offset = HEADER_SIZE
+
+        self.ipv4_starts = self.map_section("I", ipv4_count)
+        self.ipv4_ends = self.map_section("I", ipv4_count)
+        self.ipv4_records = self.map_section("I", ipv4_count)
+        self.ipv6_starts = UInt128View(self.map_section("Q", 2 * ipv6_count))
+        self.ipv6_ends = UInt128View(self.map_section("Q", 2 * ipv6_count))
+        self.ipv6_records = self.map_section("I", ipv6_count)
+        self.record_offsets = self.map_section("Q", record_count + 1)
+        self.record_blob = self.file_view[self.offset:self.offset + blob_length]
+        self.section_list.append(self.record_blob)
+
+        if self.record_offsets[-1] != blob_length:
+            self.close()
+            raise IPRangeIndexError(f"{str(self.index_path)} is corrupt: its location offsets don't match the "
+                                    f"location data.")
+
+        logging.debug(f"IPRangeIndex: Mapped {ipv4_count} IPv4 ranges and {ipv6_count} IPv6 ranges from "
+                      f"{str(self.index_path)}")
+
+    def map_section(self, type_code, item_count):
+        """Return a typed memoryview over the next section of the file without copying it."""
+        self.offset = align_to_eight(self.offset)
+        item_size = array(type_code).itemsize
+        raw_section = self.file_view[self.offset:self.offset + item_count * item_size]
+        section = raw_section.cast(type_code)
+        self.section_list.extend((section, raw_section))
+        self.offset += item_count * item_size
+        return section
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.ipv4_starts) + len(self.ipv6_starts)
+
+    def close(self):
+        """Release every view over the mapped file, then unmap and close it."""
+        for section in self.section_list:
+            section.release()
+        self.section_list.clear()
+
+        if self.file_view is not None:
+            self.file_view.release()
+            self.file_view = None
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+            self.mapped_file = None
+        self.index_file.close()
+
+    def lookup(self, ip_address: str):
+        """Return a geolocation-db.com style JSON object for ip_address, or None if no range contains it."""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+
+        if address.version == 4:
+            starts, ends, records = self.ipv4_starts, self.ipv4_ends, self.ipv4_records
+        else:
+            starts, ends, records = self.ipv6_starts, self.ipv6_ends, self.ipv6_records
+
+        address_value = int(address)
+        index = bisect_right(starts, address_value) - 1
+        if index < 0 or address_value > ends[index]:
+            return None
+
+        record_id = records[index]
+        raw_record = self.record_blob[self.record_offsets[record_id]:self.record_offsets[record_id + 1]]
+        record = json.loads(bytes(raw_record))
+
+        return {
+            "country_code": None,
+            "country_name": record["country_name"],
+            "city": record["city"],
+            "postal": None,
+            "latitude": record["latitude"],
+            "longitude": record["longitude"],
+            f"IPv{address.version}": ip_address,
+            "state": None
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("csv_path", help="CSV file of start,end,country,city,latitude,longitude rows.", type=str)
+    parser.add_argument("index_path", help="Where the compiled index should be written.", type=str)
+
+    arguments = parser.parse_args()
+
+    try:
+        ipv4_count, ipv6_count, record_count = build_range_index(arguments.csv_path, arguments.index_path)
+    except (OSError, IPRangeIndexError) as error:
+        print(f"Error: Could not build the range index. Here's the reason: {error}")
+        exit(EXIT_FAILURE)
+
+    print(f"Wrote {ipv4_count} IPv4 ranges and {ipv6_count} IPv6 ranges ({record_count} locations) to "
+          f"{arguments.index_path}.")
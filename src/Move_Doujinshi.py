@@ -8,15 +8,25 @@
 # ------------------------------------------------------------------------------
 
 # Modules
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from shutil import move
-from shutil import rmtree
-from time import sleep
-from textwrap import fill
-from shlex import split
-from subprocess import run
+from threading import BoundedSemaphore, Event, Lock
+from time import monotonic
+import argparse
+import errno
+import json
+import os
 import re
 import logging
+import signal
+
+from ArchiveMetadata import get_archive_artist
+from ArtistNameIndex import ArtistNameIndex, DEFAULT_MIN_SIMILARITY, calculate_name_similarity, normalize_artist_name
+from DoujinshiIndex import DoujinshiIndex, DEFAULT_INDEX_PATH, files_are_identical
+from SortHistory import SortHistory, DEFAULT_HISTORY_PATH, print_records
 
 # Global variables
 accepted_formats = ['.zip', '.rar', '.cbz']
@@ -25,6 +35,52 @@ current_directory = Path.cwd()
 dummy_directory = Path.cwd() / "dummy_directory"
 doujinshi_directory = current_directory.parent / "Doujins by Author"
 
+# Renames within a filesystem are cheap and can run in parallel, but copies to another device are limited so the
+# disk isn't thrashed. Same-filesystem moves are handed to the workers in batches of MOVE_BATCH_SIZE.
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_COPY_WORKERS = 2
+MOVE_BATCH_SIZE = 256
+
+# Settings used by --watch. A download counts as finished once its size and mtime haven't changed for
+# DEFAULT_SETTLE_TIME seconds, and finished downloads are sorted in batches like the ones in IPGeolocator's --daemon.
+DEFAULT_SETTLE_TIME = 2.0
+DEFAULT_MAX_BATCH_SIZE = 50
+DEFAULT_MAX_BATCH_DELAY = 5.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# What strip_artist_name() returns when the filename doesn't name an artist.
+UNKNOWN_ARTIST = "UNKNOWN ARTIST"
+
+# Number of filenames/directory names whose classification is remembered.
+CLASSIFIER_CACHE_SIZE = 1 << 16
+
+# Parses every supported filename format in a single pass:
+# (CONVENTION) [Group Name (Artist_Name)] Title
+# [Group Name (Artist_Name)] Title
+# [Artist Name] Title
+FILENAME_PATTERN = re.compile(r"""
+    ^(?:\((?P<convention>.+?)\))?\s*
+    \[(?P<group>[^\]\(]*)
+    (?:\((?P<artist>[^\)\]]*)\)?)?
+    [^\]]*\]
+    (?P<title>.+)$
+""", re.VERBOSE)
+
+# Language directories in the order they're checked. A name with characters from several of these ends up in
+# the first one (e.g. kanji also count as Chinese, but a name with kanji is filed under [Japanese]).
+LANGUAGE_DIRECTORY_DICT = {
+    "Japanese": "[Japanese]",
+    "Korean": "[Korean]",
+    "Chinese": "[Chinese]"
+}
+
+JAPANESE_RANGE_LIST = [(0x4E00, 0x9FA0), (0x3041, 0x3094), (0x30A1, 0x30F4), (0x30FC, 0x30FC), (0x3005, 0x3006),
+                       (0x3024, 0x3024), (0x30F6, 0x30F6)]
+KOREAN_RANGE_LIST = [(0x1100, 0x11FF), (0x3130, 0x318F), (0xA960, 0xA97F), (0xAC00, 0xD7FF)]
+CHINESE_RANGE_LIST = [(0x4E00, 0x9FFF)]
+
+DoujinFilename = namedtuple("DoujinFilename", ["convention", "group", "artist", "title"])
+
 
 # variables to handle color:
 class TermColor:
@@ -50,277 +106,811 @@ def print_line(char, length):
     print(f"{char}" * length)
 
 
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def parse_doujin_filename(filename):
+    """Split a filename into a DoujinFilename(convention, group, artist, title), or return None if it doesn't follow
+    one of the supported formats. Fields that aren't present are None."""
+    match = FILENAME_PATTERN.match(filename)
+    if match is None:
+        return None
+
+    convention, group, artist, title = match.group("convention", "group", "artist", "title")
+    if not group and artist is None:
+        # Empty brackets
+        return None
+
+    return DoujinFilename(convention, group, artist, title)
+
+
 def strip_artist_name(filename):
     """Given an string containing a filename in the form (Convention Name) [Artist_Name] Doujin Name*,
-    Strip the Artist name using regular expressions."""
-    # First confirm that the filename follows the following formats:
-    # (CONVENTION) [Group Name (Artist_Name)] Title
-    # [Group Name (Artist_Name)] Title
-    # [Artist Name] Title
-    initial_pattern = r"^(\(.+\))?\s*\[.+(\(.+\))?\].+$"
-    initial_match = re.search(initial_pattern, filename)
-
-    if initial_match is None:
-        return "UNKNOWN ARTIST"
-
-    # Extract the string containing the group name (if found)
-    # print(f"Initial pattern matches for {filename}...")
-    second_pattern = r"\[[^\]\(]*(\([^\)]*\))?[^\]]*"
-
-    result_string = re.search(second_pattern, filename).group(0)[1:]
-
-    # Check if the string contains a group name
-    third_pattern = r"\([^\)]*"
-    third_match = re.search(third_pattern, result_string)
-
-    if (third_match is None):
-        # artist = result_string[1:]
-        return result_string
-    else:
-        # Determine if the name in the () is a list of authors.
-        # If so, simply use the group name instead.
-        artist = third_match.group(0)[1:]
-
-        search_comma = artist.find(",")
-        if (search_comma != -1):
-            fourth_pattern = r"[^\(]*"
-            fourth_match = re.search(fourth_pattern, result_string)
-            return fourth_match.group(0)
-        else:
-            return artist
+    Strip the Artist name using regular expressions.
+
+    >>> strip_artist_name("(C97) [Group Name (Artist Name)] Title")
+    'Artist Name'
+    >>> strip_artist_name("[Artist Name] Title")
+    'Artist Name'
+
+    Malformed names that the old multi-pattern parser handled differently:
+
+    >>> strip_artist_name("([A]) [B] T")  # Was 'A': the convention is no longer taken for the artist.
+    'B'
+    >>> strip_artist_name("[]A( ]…")  # Was '': empty brackets don't name anyone.
+    'UNKNOWN ARTIST'
+    >>> strip_artist_name("[(ba]]]漢カ[)-漢]")  # Was 'ba]]]漢カ[': the artist stops at the first "]".
+    'ba'
+    """
+    parsed_filename = parse_doujin_filename(filename)
+    if parsed_filename is None:
+        return UNKNOWN_ARTIST
 
+    # No (Artist_Name), so the name in the brackets is the artist.
+    if parsed_filename.artist is None:
+        return parsed_filename.group
 
-def contains_eastern_characters(directory_name):
-    """Check if a directory name contains Japanese/Chinese/Korean characters."""
-    japanese_pattern = r"[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+|[々〆〤ヶ]+"
-    korean_pattern = r"[\u1100-\u11FF\u3130-\u318F\uA960-\uA97F\uAC00-\uD7AF\uD7B0-\uD7FF]"
-    chinese_pattern = r"[\u4e00-\u9fff]+"
+    # Determine if the name in the () is a list of authors.
+    # If so, simply use the group name instead.
+    if "," in parsed_filename.artist:
+        return parsed_filename.group
 
-    complete_pattern = f"({japanese_pattern})|({korean_pattern})|({chinese_pattern})"
+    return parsed_filename.artist
 
-    match = re.search(complete_pattern, directory_name)
 
-    return True if match else False
+def resolve_artist_name(path):
+    """Return the lowercase artist name of the doujin at path.
 
+    The filename is tried first. Only if it doesn't name an artist is the ComicInfo.xml inside the archive read.
+    """
+    path = Path(path)
+    artist_name = strip_artist_name(path.stem)
+    if artist_name.strip() and artist_name != UNKNOWN_ARTIST:
+        return artist_name.lower()
 
-def contains_japanese_characters(directory_name):
-    """Check if a directory name contains Japanese characters."""
-    japanese_pattern = r"[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+|[々〆〤ヶ]+"
+    metadata_artist_name = get_archive_artist(path)
+    if metadata_artist_name:
+        logging.debug(f"resolve_artist_name(): Found {metadata_artist_name} in the metadata of {path.name}.")
+        return metadata_artist_name.lower()
 
-    match = re.search(japanese_pattern, directory_name)
+    return artist_name.lower()
 
-    return True if match else False
 
+def is_in_ranges(codepoint, range_list):
+    """Return True if codepoint falls into one of the (first, last) ranges."""
+    for first, last in range_list:
+        if first <= codepoint <= last:
+            return True
+    return False
 
-def contains_korean_characters(directory_name):
-    """Check if a directory name contains Korean characters."""
-    korean_pattern = r"[\u1100-\u11FF\u3130-\u318F\uA960-\uA97F\uAC00-\uD7AF\uD7B0-\uD7FF]"
 
-    match = re.search(korean_pattern, directory_name)
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def classify_script(name):
+    """Return "Japanese", "Korean", "Chinese", "Latin-1" or "Unknown" depending on the characters in name.
 
-    return True if match else False
+    The name is only scanned once: the first Japanese character settles it, Korean and Chinese characters are
+    remembered in case no Japanese one turns up, and anything past U+00FF rules out Latin-1.
+    """
+    has_korean = has_chinese = False
+    is_latin1 = True
 
+    for character in name:
+        codepoint = ord(character)
+        if codepoint <= 0xFF:
+            continue
 
-def contains_chinese_characters(directory_name):
-    """Check if a directory name contains Chinese characters."""
-    chinese_pattern = r"[\u4e00-\u9fff]+"
-    match = re.search(chinese_pattern, directory_name)
+        is_latin1 = False
+        if is_in_ranges(codepoint, JAPANESE_RANGE_LIST):
+            return "Japanese"
+        if not has_korean and is_in_ranges(codepoint, KOREAN_RANGE_LIST):
+            has_korean = True
+        elif not has_chinese and is_in_ranges(codepoint, CHINESE_RANGE_LIST):
+            has_chinese = True
 
-    return True if match else False
+    if has_korean:
+        return "Korean"
+    if has_chinese:
+        return "Chinese"
+    return "Latin-1" if is_latin1 else "Unknown"
 
 
-def check_and_move_if_directory_name_has_language_chars(directory,
-                                                        contains_language_chraracter_callback,
-                                                        language_directory_name):
-    """Check if a directory name contains characters from a specific language.
-    If so, move it to a directory specified by the language directory name.
+class ParallelMover:
+    """Move files and directories from a pool of worker threads and keep count of what happened.
 
-    Returns True if the directory contained the language characters. Otherwise, it returns False.
+    A move is first tried as os.rename(), which is a single cheap syscall when the source and destination are on
+    the same filesystem. Only if that fails with EXDEV is the file copied, and at most max_copy_workers copies run
+    at the same time.
     """
-    # Immediately fail if the directory doesn't exist.
-    if not directory.exists():
-        return False
-
-    if contains_language_chraracter_callback(directory.name):
-        language_folder = dummy_directory / language_directory_name
-        print(fill(f"Moving {str(directory)} to {str(language_folder)}."))
-        language_folder.mkdir(exist_ok=True)
-
-        new_directory_path = language_folder / directory.name
-
-        if new_directory_path.exists():
-            # If for whatever reason, The folder already exists, simply move all of its children over.
-            for directory_file in directory.iterdir():
-                temp_file = new_directory_path / directory_file
-                # If the file exists in the new directory, simply delete it.
-                if temp_file.exists():
-                    directory_file.unlink()
-                else:
-                    directory_file.rename(temp_file)
-        else:
-            directory.rename(new_directory_path)
 
-        return True
-        # move(str(directory), str(language_folder))
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_copy_workers=DEFAULT_MAX_COPY_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.copy_semaphore = BoundedSemaphore(max(1, max_copy_workers))
+        self.lock = Lock()
+        self.created_directory_set = set()
+        self.future_list = []
+        self.start_time = monotonic()
+
+        self.renamed_count = 0
+        self.copied_count = 0
+        self.duplicate_list = []
+        self.kept_duplicate_list = []
+        self.failure_list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Wait for every queued move and stop the worker threads."""
+        self.wait()
+        self.executor.shutdown()
+
+    def ensure_directory(self, directory):
+        """Create directory (and its parents) unless this mover already did."""
+        with self.lock:
+            if directory in self.created_directory_set:
+                return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            self.created_directory_set.add(directory)
+
+    def record_duplicate(self, path, deleted=True):
+        with self.lock:
+            (self.duplicate_list if deleted else self.kept_duplicate_list).append(path)
+
+    def record_failure(self, path, error):
+        logging.debug(f"ParallelMover: Could not move {str(path)}: {error}")
+        with self.lock:
+            self.failure_list.append((path, str(error)))
+
+    def move(self, source, destination):
+        """Move source to destination (the full new path, not its parent). Returns True if it was moved.
+
+        Never overwrites: if destination already exists the move is recorded as a failure.
+        """
+        try:
+            if os.path.lexists(destination):
+                raise FileExistsError(errno.EEXIST, "Destination already exists", str(destination))
+
+            try:
+                os.rename(source, destination)
+                with self.lock:
+                    self.renamed_count += 1
+                return True
+
+            except OSError as error:
+                if error.errno != errno.EXDEV:
+                    raise
+
+            with self.copy_semaphore:
+                move(str(source), str(destination))
+            with self.lock:
+                self.copied_count += 1
+            return True
+
+        except OSError as error:
+            self.record_failure(source, error)
+            return False
+
+    def move_batch(self, move_pair_list):
+        for source, destination in move_pair_list:
+            self.move(source, destination)
+
+    def move_many(self, move_pair_list):
+        """Queue a list of (source, destination) moves, handing them to the workers in batches."""
+        for index in range(0, len(move_pair_list), MOVE_BATCH_SIZE):
+            self.submit(self.move_batch, move_pair_list[index:index + MOVE_BATCH_SIZE])
+
+    def submit(self, function, *args):
+        """Run function(*args) on a worker thread."""
+        self.future_list.append(self.executor.submit(function, *args))
+
+    def wait(self):
+        """Wait for everything that was queued so far."""
+        future_list, self.future_list = self.future_list, []
+        for future in future_list:
+            try:
+                future.result()
+            except Exception as error:
+                self.record_failure("(worker)", error)
+
+    def print_summary(self, title):
+        """Print a single summary of every move made so far."""
+        elapsed_time = monotonic() - self.start_time
+        moved_count = self.renamed_count + self.copied_count
+        print(f"{title}: Moved {moved_count} item(s) in {elapsed_time:.2f}s "
+              f"({self.renamed_count} renamed, {self.copied_count} copied across devices, "
+              f"{len(self.duplicate_list)} duplicate(s) deleted, {len(self.failure_list)} failure(s)).")
+
+        for duplicate in self.duplicate_list:
+            print(f"    Deleted duplicate: {str(duplicate)}")
+        for duplicate in self.kept_duplicate_list:
+            print(f"    Duplicate left in place: {str(duplicate)}")
+        for path, error in self.failure_list:
+            print(f"{TermColor.RED}    Failed: {str(path)} ({error}){TermColor.CLEAR}")
+
+
+def prompt_merge_into_doujinshi_directory(index: DoujinshiIndex = None, history: SortHistory = None,
+                                          delete_identical=False):
+    """Ask whether the sorted directories should be merged into {doujinshi_directory}, and do so if asked to."""
+    print_line("-", 80)
+    print(f"{TermColor.BOLD}")
+    option = input(f"Do you want to merge the subdirectories into {str(doujinshi_directory)}? [y/n] ")
+    print(f"{TermColor.CLEAR}")
+
+    if option.lower() == "y":
+        merge_into_doujinshi_directory(index=index, history=history, delete_identical=delete_identical)
     else:
-        return False
+        print("Complete!")
 
 
-def organize_doujins_by_artist():
-    """Organize Doujinishi by Artist Name by parsing their filename and placing the file into a directory with name {Artist_Name}."""
-    print_line("-", 80)
-    print("Organizing Doujins by Artist...\n")
-    sleep(1)
+def get_bucket_name(artist_directory_name):
+    """Return the directory in {dummy_directory} that an artist directory belongs in."""
+    script = classify_script(artist_directory_name)
+    if script in LANGUAGE_DIRECTORY_DICT:
+        return LANGUAGE_DIRECTORY_DICT[script]
+    if script == "Unknown":
+        return "[Unknown]"
+    return artist_directory_name[:1].upper()
 
-    with open("output.txt", "w") as output_file:
-        for file in current_directory.iterdir():
-            # Skip any directories
-            if file.is_dir():
-                continue
 
-            if file.suffix in accepted_formats:
-                # Now handle lowercase artists:
-                artist_name = strip_artist_name(file.stem).lower()
-                print(fill(f"Placing {file.name} into {artist_name}/ ...") + "\n")
-                output_file.write(f"Filename: \"{file.name}\"\n")
-                output_file.write(f"Artist Name: {artist_name}\n\n")
-
-                # Create a directory with name artist name and move the file to a directory.
-                # Capitalize first character in each word:
-                artist_name = capitalize_each_string_word(artist_name).strip()
-                artist_directory = current_directory / artist_name
-                artist_directory.mkdir(exist_ok=True)
-                move(str(file), str(artist_directory))
-            else:
-                print(fill(f"SKIPPING {file.name}...") + "\n")
-    print_line("-", 80)
-    print("")
+class DirectoryListing:
+    """Names found in (or planned for) each directory, read with a single os.scandir() per directory.
 
+    A directory that doesn't exist (and isn't planned to) is listed as None.
+    """
 
-def move_to_dummy_directory():
-    """Place all the Artist directories into single-letter directories in {dummy_directory}."""
-    print_line("-", 80)
-    print(fill(f"Now placing directories into {dummy_directory} ...\n") + "\n")
-    sleep(1)
+    def __init__(self):
+        self.listing_dict = {}
+
+    def get(self, directory):
+        if directory not in self.listing_dict:
+            try:
+                with os.scandir(directory) as iterator:
+                    self.listing_dict[directory] = {entry.name for entry in iterator}
+            except (FileNotFoundError, NotADirectoryError):
+                self.listing_dict[directory] = None
+        return self.listing_dict[directory]
+
+    def set(self, directory, name_set):
+        self.listing_dict[directory] = name_set
+
+
+def plan_sort(source_directory=None, target_directory=None, history: SortHistory = None, name_set=None,
+              artist_index: ArtistNameIndex = None):
+    """Work out every move needed to sort source_directory into target_directory without touching the disk.
+
+    source_directory is scanned once. Loose doujins go straight to {target}/{bucket}/{Artist}/ and existing artist
+    directories are renamed into their bucket (or merged file by file if the bucket already has them). If a history
+    is passed, filenames that were sorted before reuse the artist they were resolved to instead of being parsed
+    again. Artist names that only differ in case, spacing or punctuation ("Artist Name", "artist_name") share one
+    directory, named like the one already in artist_index if there is one. If name_set is passed, only those
+    entries of source_directory are planned. Returns a JSON-serializable
+    dict with the directories to create, the moves to make, the collisions (names that already exist at the
+    destination, whose source is deleted as a duplicate), the directories left empty by a merge, the files that
+    were skipped and how many artists were known from the history.
+    """
+    source_directory = current_directory if source_directory is None else Path(source_directory)
+    target_directory = dummy_directory if target_directory is None else Path(target_directory)
+
+    listing = DirectoryListing()
+    plan = {"directories": [], "moves": [], "collisions": [], "removals": [], "skipped": []}
+    planned_directory_set = set()
+    # {normalized artist name: directory name} for every artist seen in this plan.
+    artist_directory_name_dict = {}
+
+    def choose_artist_directory_name(name):
+        key = normalize_artist_name(name)
+        if not key:
+            return name
+        if key not in artist_directory_name_dict:
+            existing_directory = None if artist_index is None else artist_index.find_existing(name)
+            artist_directory_name_dict.update({key: os.path.basename(existing_directory) if existing_directory
+                                               else name})
+        return artist_directory_name_dict[key]
+
+    def plan_directory(directory):
+        # Plan the directory (and any missing parents) unless it already exists.
+        if listing.get(directory) is not None:
+            return
+        if directory.parent != directory:
+            plan_directory(directory.parent)
+        listing.set(directory, set())
+        if directory not in planned_directory_set:
+            planned_directory_set.add(directory)
+            plan["directories"].append(str(directory))
+
+    def plan_move(source, destination, move_type, artist=None):
+        destination_name_set = listing.get(destination.parent)
+        if destination.name in destination_name_set:
+            plan["collisions"].append({"source": str(source), "destination": str(destination)})
+            return False
+
+        destination_name_set.add(destination.name)
+        move_entry = {"type": move_type, "source": str(source), "destination": str(destination)}
+        if artist is not None:
+            move_entry.update({"artist": artist})
+        plan["moves"].append(move_entry)
+        return True
+
+    with os.scandir(source_directory) as iterator:
+        entry_list = sorted((entry for entry in iterator if name_set is None or entry.name in name_set),
+                            key=lambda entry: entry.name)
+
+    # Existing artist directories go first, so loose files for the same artist see what they'll be merged into.
+    for entry in entry_list:
+        if not entry.is_dir() or Path(entry.path) == target_directory:
+            continue
+
+        source = Path(entry.path)
+        artist_directory_name = choose_artist_directory_name(entry.name)
+        bucket_directory = target_directory / get_bucket_name(artist_directory_name)
+        destination = bucket_directory / artist_directory_name
+        plan_directory(bucket_directory)
 
-    for sub_directory in current_directory.iterdir():
-        logging.debug(f"move_to_dummy_directory(): Testing {str(sub_directory)}")
-        if not sub_directory.is_dir() or sub_directory == dummy_directory:
+        if listing.get(destination) is None:
+            plan_move(source, destination, "directory")
+            listing.set(destination, set(listing.get(source)))
             continue
 
-        # subdirectory_name = sub_directory.name
-        if contains_eastern_characters(sub_directory.name):
-            check_and_move_if_directory_name_has_language_chars(sub_directory,
-                                                                contains_japanese_characters,
-                                                                "[Japanese]")
-            check_and_move_if_directory_name_has_language_chars(sub_directory,
-                                                                contains_korean_characters,
-                                                                "[Korean]")
-            check_and_move_if_directory_name_has_language_chars(sub_directory,
-                                                                contains_chinese_characters,
-                                                                "[Chinese]")
+        # The artist is already in the bucket, so merge the directory's contents into it.
+        for name in sorted(listing.get(source)):
+            plan_move(source / name, destination / name, "file")
+        plan["removals"].append(str(source))
+
+    known_artist_dict = {} if history is None else history.lookup_artists(
+        entry.name for entry in entry_list if entry.is_file())
+    plan.update({"known": len(known_artist_dict)})
+
+    for entry in entry_list:
+        if not entry.is_file():
+            continue
+
+        if Path(entry.name).suffix not in accepted_formats:
+            plan["skipped"].append(entry.name)
             continue
 
-        # check if the directory name is ASCII or not.
+        artist_name = known_artist_dict.get(entry.name)
+        if artist_name is None:
+            artist_name = resolve_artist_name(entry.path)
+        artist_directory_name = choose_artist_directory_name(
+            capitalize_each_string_word(artist_name).strip() or "Unknown Artist")
+        artist_directory = target_directory / get_bucket_name(artist_directory_name) / artist_directory_name
+        plan_directory(artist_directory)
+        plan_move(Path(entry.path), artist_directory / entry.name, "file", artist_name)
+
+    return plan
+
+
+def apply_plan(plan: dict, mover: ParallelMover, history: SortHistory = None, output_mode="w", delete_identical=True):
+    """Carry out a plan made by plan_sort(), and record the doujins that were sorted in history if one is passed.
+
+    Collisions with an identical file are deleted, unless delete_identical is False, in which case they're left where
+    they are.
+    """
+    # Parents are always planned before their children, so the directories can be made in order.
+    for directory in plan["directories"]:
         try:
-            dir_name = sub_directory.name
-            dir_name.encode("latin1")
-        except UnicodeEncodeError:
-            # Directory name contains unknown characters, so place it in the [Unknown] directory.
-
-            unknown_folder = dummy_directory / "[Unknown]"
-            print(fill(f"Moving {sub_directory.name} to {unknown_folder}...") + "\n")
-            unknown_folder.mkdir(exist_ok=True)
-            move(str(sub_directory), str(unknown_folder))
+            os.mkdir(directory)
+        except FileExistsError:
+            pass
+
+    # Directories have to be in place before files are moved into them.
+    directory_move_list = [(Path(move_entry["source"]), Path(move_entry["destination"]))
+                           for move_entry in plan["moves"] if move_entry["type"] == "directory"]
+    file_move_list = [(Path(move_entry["source"]), Path(move_entry["destination"]))
+                      for move_entry in plan["moves"] if move_entry["type"] == "file"]
+
+    mover.move_many(directory_move_list)
+    mover.wait()
+    mover.move_many(file_move_list)
+    mover.wait()
+
+    for collision in plan["collisions"]:
+        # Only delete the duplicate if the copy it collided with made it to the destination and is byte-identical.
+        if not os.path.exists(collision["destination"]):
+            mover.record_failure(collision["source"], "Collided with a file that was never moved")
             continue
+        if not files_are_identical(collision["source"], collision["destination"]):
+            mover.record_failure(collision["source"], f"A different file named {collision['destination']} exists")
+            continue
+        if not delete_identical:
+            mover.record_duplicate(f"{collision['source']} (same as {collision['destination']})", deleted=False)
+            continue
+        try:
+            os.unlink(collision["source"])
+            mover.record_duplicate(collision["source"])
+        except OSError as error:
+            mover.record_failure(collision["source"], error)
 
-        # Otherwise, place it in a folder with the first
-        # character of the artist.
-        new_folder_name = str(sub_directory.name)
-        new_folder_name = new_folder_name[:1].upper()
-
-        new_folder = dummy_directory / new_folder_name
-        print(fill(f"Moving {sub_directory.name} to {new_folder}...") + "\n")
-        new_folder.mkdir(exist_ok=True)
-
-        # If the folder exists, simply move the contents of the subdirectory to the new folder.
-        possible_path = new_folder / sub_directory.name
-
-        logging.debug(f"move_to_dummy_directory(): Possible Path: {str(possible_path)}")
-        if possible_path.exists():
-            for doujin in sub_directory.iterdir():
-                logging.debug(f"move_to_dummy_directory(): Doujin Path: {str(doujin)}")
-                if doujin.is_file():
-                    # Handle duplicates:
-                    if Path(possible_path / doujin.name).exists():
-                        print(f"Warning: \"{doujin.name}\" already exists, deleting...")
-                        doujin.unlink()
-                    else:
-                        move(str(doujin), str(possible_path))
-
-            # Now delete the sub_dir:
-            logging.debug(f"move_to_dummy_directory(): Deleting {str(sub_directory)}")
-            rmtree(sub_directory)
-        else:
-            move(str(sub_directory), str(new_folder))
+    for directory in plan["removals"]:
+        try:
+            os.rmdir(directory)
+        except OSError as error:
+            mover.record_failure(directory, error)
+
+    with open("output.txt", output_mode) as output_file:
+        for move_entry in plan["moves"]:
+            if "artist" in move_entry:
+                output_file.write(f"Filename: \"{Path(move_entry['source']).name}\"\n")
+                output_file.write(f"Artist Name: {move_entry['artist']}\n\n")
+
+    if history is not None:
+        # A move that failed leaves nothing at its destination.
+        history.record([(Path(move_entry["source"]).name, move_entry["artist"], move_entry["destination"])
+                        for move_entry in plan["moves"]
+                        if "artist" in move_entry and os.path.lexists(move_entry["destination"])])
+
+    mover.print_summary("Sorting")
+    print(f"Skipped {len(plan['skipped'])} file(s) that aren't in {accepted_formats}.")
+    if plan.get("known"):
+        print(f"Reused the artist of {plan['known']} file(s) that were sorted before.")
+
+
+def merge_directory_tree(source, destination, mover: ParallelMover, conflict_list: list,
+                         index: DoujinshiIndex = None, history: SortHistory = None):
+    """Merge the source directory into destination.
+
+    If destination doesn't exist yet, the whole directory is moved with a single rename. Otherwise each entry is
+    renamed into place, and subdirectories are merged the same way. Files whose name already exists at the
+    destination, or (if an index is passed) whose contents already exist anywhere in the library, are left where
+    they are and added to conflict_list. source is removed if it ends up empty. history, if passed, is kept
+    pointing at wherever the files end up.
+    """
+    if not os.path.lexists(destination):
+        if index is None:
+            if mover.move(source, destination) and history is not None:
+                history.relocate(source, destination)
+            return
+
+        # The directory can still be moved in one go as long as none of its files is already in the library.
+        file_list = [Path(root) / name for root, _, name_list in os.walk(source) for name in name_list]
+        if not any(index.find_duplicate(file) for file in file_list if index.is_accepted(file.name)):
+            if mover.move(source, destination):
+                if history is not None:
+                    history.relocate(source, destination)
+                for file in file_list:
+                    if index.is_accepted(file.name):
+                        index.add(destination / file.relative_to(source))
+            return
+
+        mover.ensure_directory(destination)
+
+    with os.scandir(source) as iterator:
+        entry_list = list(iterator)
+
+    for entry in entry_list:
+        entry_destination = destination / entry.name
+        if entry.is_dir(follow_symlinks=False):
+            merge_directory_tree(Path(entry.path), entry_destination, mover, conflict_list, index, history)
+            continue
 
-    print_line("-", 80)
-    print(f"{TermColor.BOLD}")
-    option = input(f"Do you want to merge the subdirectories into {str(doujinshi_directory)}? [y/n] ")
-    print(f"{TermColor.CLEAR}")
+        duplicate = index.find_duplicate(entry.path) if index is not None and index.is_accepted(entry.name) else None
+        if duplicate is not None:
+            conflict_list.append({"source": entry.path, "destination": duplicate, "identical": True})
+        elif os.path.lexists(entry_destination):
+            conflict_list.append({"source": entry.path, "destination": str(entry_destination),
+                                  "identical": files_are_identical(entry.path, entry_destination)})
+        elif mover.move(Path(entry.path), entry_destination):
+            if history is not None:
+                history.relocate(entry.path, entry_destination)
+            if index is not None and index.is_accepted(entry.name):
+                index.add(entry_destination)
+
+    try:
+        os.rmdir(source)
+    except OSError:
+        # Conflicts (or failed moves) are still in there.
+        pass
+
+
+def remove_empty_directories(directory):
+    """Remove directory and every directory under it that is (or becomes) empty."""
+    for root, _, _ in os.walk(directory, topdown=False):
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass
 
-    if option.lower() == "y":
-        merge_into_doujinshi_directory()
-    else:
-        print("Complete!")
 
+def delete_identical_conflicts(conflict_list: list, mover: ParallelMover, history: SortHistory = None):
+    """Delete the conflicts found by merge_directory_tree() that are byte-for-byte copies of their destination.
 
-def merge_into_doujinshi_directory():
-    """Merge the subdirectories found in the dummy directory into the doujinshi directory."""
-    print(f"Now merging subdirectories into {str(doujinshi_directory)}...")
-    for directory in dummy_directory.iterdir():
-        if not directory.is_dir():
-            logging.debug(f"merge_into_doujinshi_directory(): Skipping {directory.name} since it is not a directory.")
+    Returns the conflicts that were left alone.
+    """
+    different_conflict_list = []
+    for conflict in conflict_list:
+        if not conflict["identical"]:
+            different_conflict_list.append(conflict)
             continue
+        try:
+            os.unlink(conflict["source"])
+            mover.record_duplicate(f"{conflict['source']} (same as {conflict['destination']})")
+            if history is not None:
+                history.relocate(conflict["source"], conflict["destination"])
+        except OSError as error:
+            mover.record_failure(conflict["source"], error)
+
+    return different_conflict_list
+
+
+def merge_into_doujinshi_directory(mover: ParallelMover = None, delete_conflicts=None, index: DoujinshiIndex = None,
+                                   history: SortHistory = None, delete_identical=False):
+    """Merge the subdirectories found in the dummy directory into the doujinshi directory.
 
-        # Generate a rsync call to merge the directory:
-        rsync_command = f"rsync -avLP --ignore-existing --remove-source-files \"{directory}\" \"{doujinshi_directory}\""
-        logging.debug(f"merge_into_doujinshi_directory(): Running the following Rsync Command: {rsync_command}")
-        split_rsync_command = split(rsync_command)
-        logging.debug(f"merge_into_doujinshi_directory(): Split Rsync Command: {split_rsync_command}")
-
-        # Now run the damn thing:
-        run(split_rsync_command)
-        # Now make sure that the directory and its contents are deleted:
-        subdirectory_contents = directory.rglob("*")
-        existing_doujinshi_file_list = []
-        for file in subdirectory_contents:
-            if (file.suffix in accepted_formats):
-                existing_doujinshi_file_list.append(file)
-
-        if existing_doujinshi_file_list:
-            print(f"{TermColor.RED}Unmoved Doujinshi have been detected in {str(directory)}{TermColor.CLEAR}")
-            # print(f"{TermColor.RED}These are most likely duplicates.{TermColor.CLEAR}")
-
-            for existing_doujinshi in existing_doujinshi_file_list:
-                print(f"{TermColor.RED}    * {existing_doujinshi.name}{TermColor.CLEAR}")
-            user_input = input("These are most likely duplicates, so would you like to delete them? [y/n] ").lower()
-            if user_input == "y":
-                for existing_doujinshi in existing_doujinshi_file_list:
-                    existing_doujinshi.unlink()
-
-                # Also delete the whole directory as well:
-                rmtree(str(directory))
-                print(f"{TermColor.BLUE}Files and directory have been deleted. :){TermColor.CLEAR}")
-            else:
-                print(f"{TermColor.BLUE}Alright, I hope you know what you're doing then.{TermColor.CLEAR}")
+    Returns a report dict with the number of moves and the conflicts (files whose name or contents already exist
+    in the doujinshi directory). If delete_identical is True, conflicts with identical contents are deleted right
+    away. For the rest, the user is asked unless delete_conflicts is passed.
+    """
+    print(f"Now merging subdirectories into {str(doujinshi_directory)}...")
+    doujinshi_directory.mkdir(parents=True, exist_ok=True)
+    if index is not None:
+        index.update(doujinshi_directory)
+
+    owns_mover = mover is None
+    mover = ParallelMover() if owns_mover else mover
+    conflict_list = []
+
+    # Every letter/language directory merges into a different directory, so they can run at the same time.
+    with os.scandir(dummy_directory) as iterator:
+        for entry in iterator:
+            if not entry.is_dir():
+                logging.debug(f"merge_into_doujinshi_directory(): Skipping {entry.name} since it is not a directory.")
+                continue
+            mover.submit(merge_directory_tree, Path(entry.path), doujinshi_directory / entry.name, mover,
+                         conflict_list, index, history)
+
+    mover.wait()
+    report = {
+        "renamed": mover.renamed_count,
+        "copied": mover.copied_count,
+        "conflicts": conflict_list,
+        "failures": [{"source": str(path), "error": error} for path, error in mover.failure_list]
+    }
+
+    remaining_conflict_list = conflict_list
+    if delete_identical:
+        remaining_conflict_list = delete_identical_conflicts(conflict_list, mover, history)
+    mover.print_summary("Merging")
+    if remaining_conflict_list:
+        print(f"{TermColor.RED}Unmoved Doujinshi have been detected in {str(dummy_directory)}{TermColor.CLEAR}")
+        for conflict in remaining_conflict_list:
+            contents = "identical" if conflict["identical"] else "different"
+            print(f"{TermColor.RED}    * {conflict['source']} ({contents} contents){TermColor.CLEAR}")
+
+        if delete_conflicts is None:
+            user_input = input("These are already in the library (by name or by contents), so would you like to "
+                               "delete them anyway? [y/n] ").lower()
+            delete_conflicts = user_input == "y"
+
+        if delete_conflicts:
+            for conflict in delete_identical_conflicts(remaining_conflict_list, mover, history):
+                try:
+                    os.unlink(conflict["source"])
+                except OSError as error:
+                    mover.record_failure(conflict["source"], error)
+            print(f"{TermColor.BLUE}Files and directory have been deleted. :){TermColor.CLEAR}")
         else:
-            # Delete fucking everything:
-            logging.debug(f"merge_into_doujinshi_directory(): Clearing out everything in {str(directory)}")
-            rmtree(str(directory))
+            print(f"{TermColor.BLUE}Alright, I hope you know what you're doing then.{TermColor.CLEAR}")
+
+    # Only what's left of the dummy directory is walked, which is nothing unless there were conflicts.
+    with os.scandir(dummy_directory) as iterator:
+        for entry in iterator:
+            if entry.is_dir(follow_symlinks=False):
+                remove_empty_directories(entry.path)
+
+    if owns_mover:
+        mover.close()
 
     print_line("-", 80)
     print("Complete!")
+    return report
+
+
+def count_directory_entries(directory):
+    """Return the number of entries in directory, or 0 if it can't be listed."""
+    try:
+        with os.scandir(directory) as iterator:
+            return sum(1 for _ in iterator)
+    except OSError:
+        return 0
+
+
+def merge_similar_artist_directories(apply_merges=False, min_similarity=DEFAULT_MIN_SIMILARITY,
+                                     mover: ParallelMover = None, index: DoujinshiIndex = None,
+                                     history: SortHistory = None, delete_identical=False):
+    """Find artist directories in {doujinshi_directory} that look like the same artist, and merge them if asked to.
+
+    Each group is merged into the member with the most entries (preferring names in this script's "Artist Name"
+    format on a tie). Since groups are built by following links (A looks like B, B looks like C), only the members
+    that are themselves at least min_similarity alike to that directory are merged into it; the rest are grouped
+    again among themselves. Files whose name already exists in that directory are left where they are, unless they're
+    identical and delete_identical is True. Returns a list of {"into": directory, "merge": [directory, ...]}
+    suggestions.
+    """
+    artist_index = ArtistNameIndex.from_library(doujinshi_directory)
+    suggestion_list = []
+    for merge_group in artist_index.find_merge_groups(min_similarity):
+        remaining_directory_list = merge_group
+        while len(remaining_directory_list) > 1:
+            into = max(remaining_directory_list, key=lambda directory: (
+                count_directory_entries(directory),
+                Path(directory).name == capitalize_each_string_word(Path(directory).name.lower())))
+            # Above 1, only names with the same normalized key (a similarity of exactly 1.0) are merged.
+            merge_list = [directory for directory in remaining_directory_list if directory != into and
+                          calculate_name_similarity(Path(directory).name, Path(into).name) >= min(min_similarity, 1.0)]
+            remaining_directory_list = [directory for directory in remaining_directory_list
+                                        if directory != into and directory not in merge_list]
+            if merge_list:
+                suggestion_list.append({"into": into, "merge": merge_list})
+
+    if not apply_merges:
+        return suggestion_list
+
+    owns_mover = mover is None
+    mover = ParallelMover() if owns_mover else mover
+    conflict_list = []
+
+    def merge_group(suggestion):
+        # Members of a group share their destination, so they're merged one after another: two merges into the same
+        # directory could both see a name as free and rename over each other.
+        for directory in suggestion["merge"]:
+            merge_directory_tree(Path(directory), Path(suggestion["into"]), mover, conflict_list, index, history)
+
+    # Different groups never share a directory, so the groups themselves can be merged at the same time.
+    for suggestion in suggestion_list:
+        mover.submit(merge_group, suggestion)
+    mover.wait()
+
+    if delete_identical:
+        conflict_list = delete_identical_conflicts(conflict_list, mover, history)
+    for conflict in conflict_list:
+        contents = "An identical" if conflict["identical"] else "A different"
+        mover.record_failure(conflict["source"], f"{contents} file named {conflict['destination']} exists")
+    if owns_mover:
+        mover.close()
+
+    mover.print_summary("Merging similar artists")
+    return suggestion_list
+
+
+def sort_into_doujinshi_directory(name_list, mover: ParallelMover, index: DoujinshiIndex = None,
+                                  history: SortHistory = None, source_directory=None,
+                                  artist_index: ArtistNameIndex = None, delete_identical=False):
+    """Sort the doujins in name_list from source_directory straight into {doujinshi_directory}, without any prompts.
+
+    Files whose contents are already in the library (if an index is passed) or that collide with an identical file
+    are left where they are and reported, or deleted if delete_identical is True. Files that collide with a
+    different file of the same name are left where they are. Artist directories created along the way are added to
+    artist_index.
+    """
+    source_directory = current_directory if source_directory is None else Path(source_directory)
+    name_set = set(name_list)
+
+    if index is not None:
+        index.update(doujinshi_directory)
+        for name in name_list:
+            source = source_directory / name
+            try:
+                duplicate = index.find_duplicate(source)
+            except OSError as error:
+                # Most likely deleted or renamed since it was picked up.
+                logging.debug(f"sort_into_doujinshi_directory(): Skipping {name}: {error}")
+                name_set.discard(name)
+                continue
+            if duplicate is None:
+                continue
+
+            name_set.discard(name)
+            if not delete_identical:
+                mover.record_duplicate(f"{str(source)} (same as {duplicate})", deleted=False)
+                continue
+
+            try:
+                artist_name = resolve_artist_name(source) if history is not None else None
+                os.unlink(source)
+                mover.record_duplicate(f"{str(source)} (same as {duplicate})")
+                if history is not None:
+                    history.record([(name, artist_name, duplicate)])
+            except OSError as error:
+                mover.record_failure(source, error)
+
+    plan = plan_sort(source_directory, doujinshi_directory, history, name_set, artist_index)
+    apply_plan(plan, mover, history, "a", delete_identical)
+
+    if artist_index is not None:
+        for directory in plan["directories"]:
+            # Only {doujinshi_directory}/{bucket}/{Artist}, not the buckets themselves.
+            if Path(directory).parent.parent == doujinshi_directory:
+                artist_index.add(directory)
+
+    if index is not None:
+        for move_entry in plan["moves"]:
+            if os.path.lexists(move_entry["destination"]):
+                index.add(move_entry["destination"])
+
+    return plan
+
+
+def watch_download_directory(process_batch_callback, watch_directory=None, settle_time=DEFAULT_SETTLE_TIME,
+                             max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_batch_delay=DEFAULT_MAX_BATCH_DELAY,
+                             poll_interval=DEFAULT_POLL_INTERVAL, stop_event: Event = None):
+    """Watch watch_directory for new doujins and pass their names to process_batch_callback in batches.
+
+    A file is handed over once its size and mtime have stayed the same for settle_time seconds, so downloads
+    that are still being written are left alone. process_batch_callback(name_list) is called once max_batch_size
+    files are ready or the oldest ready file has waited max_batch_delay seconds, whichever comes first. Files
+    that are still in the directory after their batch (e.g. because of a name conflict) aren't handed over again
+    until they're replaced. The loop runs until stop_event is set, at which point the files that are ready are
+    flushed before returning.
+    """
+    watch_directory = current_directory if watch_directory is None else Path(watch_directory)
+    stop_event = Event() if stop_event is None else stop_event
+
+    # {name: ((size, mtime_ns), time the file was last seen changing)} for files that might still be downloading.
+    pending_file_dict = {}
+    # Ready files in the order they settled. Only the keys are used, a dict keeps the order without duplicates.
+    ready_file_dict = {}
+    handled_name_set = set()
+    first_ready_time = None
+
+    def flush_ready_files():
+        name_list = list(ready_file_dict)
+        ready_file_dict.clear()
+        handled_name_set.update(name_list)
+        logging.debug(f"watch_download_directory(): Flushing {len(name_list)} file(s).")
+        process_batch_callback(name_list)
+
+    logging.info(f"watch_download_directory(): Watching {str(watch_directory)} for {accepted_formats}.")
+    while not stop_event.is_set():
+        current_time = monotonic()
+        try:
+            # Only names are read here; the candidates are stat()ed below.
+            with os.scandir(watch_directory) as iterator:
+                name_set = {entry.name for entry in iterator
+                            if Path(entry.name).suffix in accepted_formats and entry.is_file()}
+        except OSError as error:
+            logging.warning(f"watch_download_directory(): Could not list {str(watch_directory)}: {error}")
+            stop_event.wait(poll_interval)
+            continue
+
+        # Forget files that were moved away, so a new file with the same name is picked up again.
+        handled_name_set &= name_set
+        for name in list(pending_file_dict):
+            if name not in name_set:
+                del pending_file_dict[name]
+
+        for name in name_set - handled_name_set - ready_file_dict.keys():
+            try:
+                stat_result = os.stat(watch_directory / name)
+            except OSError:
+                pending_file_dict.pop(name, None)
+                continue
+
+            signature = (stat_result.st_size, stat_result.st_mtime_ns)
+            previous_signature, changed_time = pending_file_dict.get(name, (None, current_time))
+            if signature != previous_signature:
+                pending_file_dict.update({name: (signature, current_time)})
+            elif stat_result.st_size > 0 and current_time - changed_time >= settle_time:
+                del pending_file_dict[name]
+                ready_file_dict.update({name: None})
+                if first_ready_time is None:
+                    first_ready_time = current_time
+
+        if ready_file_dict and (len(ready_file_dict) >= max_batch_size
+                                or monotonic() - first_ready_time >= max_batch_delay):
+            flush_ready_files()
+            first_ready_time = None
+
+        # Sleep until the next poll, the batch deadline or a shutdown request, whichever comes first.
+        wait_time = poll_interval
+        if first_ready_time is not None:
+            wait_time = min(wait_time, max(0.0, first_ready_time + max_batch_delay - monotonic()))
+        stop_event.wait(wait_time)
+
+    if ready_file_dict:
+        flush_ready_files()
+    logging.info("watch_download_directory(): Stopped watching.")
 
 
 # Run the program.
@@ -329,6 +919,133 @@ if __name__ == "__main__":
     # in accepted_formats list.
     # If so, then run the sort.
     logging.basicConfig(level=logging.INFO)
-    dummy_directory.mkdir(exist_ok=True)
-    organize_doujins_by_artist()
-    move_to_dummy_directory()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", help="Number of files/directories moved at the same time.",
+                        default=DEFAULT_MAX_WORKERS, type=int)
+    parser.add_argument("--copy-workers", help="Number of copies to another device that may run at the same time.",
+                        default=DEFAULT_MAX_COPY_WORKERS, type=int)
+    parser.add_argument("--dry-run", help="Print the plan as JSON instead of moving anything.", action="store_true")
+    parser.add_argument("--index-path", help="Path to the content index of the doujinshi directory, used to find "
+                        "duplicates with a different name.", default=str(DEFAULT_INDEX_PATH), type=str)
+    parser.add_argument("--no-index", help="Only treat files with the same name as duplicates.", action="store_true")
+    parser.add_argument("--delete-identical", help="When merging (or --watch sorting) into the doujinshi directory, "
+                        "delete files that are byte-for-byte copies of one already there without asking.",
+                        action="store_true")
+    parser.add_argument("--history-path", help="Path to the record of the doujins sorted so far.",
+                        default=str(DEFAULT_HISTORY_PATH), type=str)
+    parser.add_argument("--no-history", help="Parse every filename and don't record where it went.",
+                        action="store_true")
+    parser.add_argument("--where", help="Print the folder a file was sorted into, then exit.", default=None,
+                        type=str)
+    parser.add_argument("--watch", help="Keep running and sort new doujins straight into the doujinshi directory as "
+                        "soon as they finish downloading, without any prompts.", action="store_true")
+    parser.add_argument("--settle-time", help="Number of seconds a file must stay unchanged before --watch sorts it.",
+                        default=DEFAULT_SETTLE_TIME, type=float)
+    parser.add_argument("--max-batch-size", help="Number of finished downloads that triggers a batch in --watch mode.",
+                        default=DEFAULT_MAX_BATCH_SIZE, type=int)
+    parser.add_argument("--max-batch-delay", help="Number of seconds a finished download may wait for its batch in "
+                        "--watch mode.", default=DEFAULT_MAX_BATCH_DELAY, type=float)
+    parser.add_argument("--poll-interval", help="Number of seconds between checks of the download directory.",
+                        default=DEFAULT_POLL_INTERVAL, type=float)
+    parser.add_argument("--merge-artists", help="Look for artist directories in the doujinshi directory that are "
+                        "the same artist spelled differently, and either print them or merge them, then exit.",
+                        choices=["suggest", "apply"], default=None)
+    parser.add_argument("--min-similarity", help="Trigram similarity (0 to 1) two artist names need for "
+                        "--merge-artists. Values above 1 only match names that differ in case, spacing or "
+                        "punctuation.", default=DEFAULT_MIN_SIMILARITY, type=float)
+
+    arguments = parser.parse_args()
+    if arguments.dry_run and arguments.watch:
+        parser.error("--dry-run can't be used with --watch, which sorts downloads as soon as they finish.")
+    if arguments.dry_run and arguments.merge_artists == "apply":
+        parser.error("--dry-run can't be used with --merge-artists apply; use --merge-artists suggest to preview.")
+
+    if arguments.where:
+        if arguments.no_history:
+            print("--where needs the sort history, so it can't be used with --no-history.")
+            exit(1)
+        found_list = []
+        if os.path.exists(arguments.history_path):
+            with SortHistory(arguments.history_path, read_only=True) as sort_history:
+                found_list = sort_history.find(arguments.where)
+        if not found_list:
+            print(f"{arguments.where} hasn't been sorted yet.")
+            exit(1)
+        print_records(found_list)
+        exit(0)
+
+    # A dry run doesn't create or write anything, so the history is only read, and only if there already is one.
+    if arguments.no_history or (arguments.dry_run and not os.path.exists(arguments.history_path)):
+        sort_history = None
+    else:
+        sort_history = SortHistory(arguments.history_path, arguments.dry_run)
+
+    if arguments.merge_artists:
+        # Only merges use the content index, so suggestions don't create or update it.
+        library_index = None
+        if arguments.merge_artists == "apply" and not arguments.no_index:
+            library_index = DoujinshiIndex(arguments.index_path, accepted_formats)
+        with ParallelMover(arguments.workers, arguments.copy_workers) as mover:
+            merge_suggestion_list = merge_similar_artist_directories(arguments.merge_artists == "apply",
+                                                                     arguments.min_similarity, mover, library_index,
+                                                                     sort_history, arguments.delete_identical)
+        for merge_suggestion in merge_suggestion_list:
+            merge_name_list = [Path(directory).name for directory in merge_suggestion["merge"]]
+            print(f"{Path(merge_suggestion['into']).name} <- {' | '.join(merge_name_list)}")
+        print(f"Found {len(merge_suggestion_list)} group(s) of similar artist directories.")
+        if library_index is not None:
+            library_index.close()
+        if sort_history is not None:
+            sort_history.close()
+        exit(0)
+
+    library_artist_index = ArtistNameIndex.from_library(doujinshi_directory)
+
+    if arguments.watch:
+        library_index = None if arguments.no_index else DoujinshiIndex(arguments.index_path, accepted_formats)
+        doujinshi_directory.mkdir(parents=True, exist_ok=True)
+
+        def process_download_batch(name_list):
+            with ParallelMover(arguments.workers, arguments.copy_workers) as batch_mover:
+                sort_into_doujinshi_directory(name_list, batch_mover, library_index, sort_history, current_directory,
+                                              library_artist_index, arguments.delete_identical)
+
+        stop_event = Event()
+
+        def request_shutdown(signal_number, frame):
+            logging.info(f"main(): Received signal {signal_number}, shutting down after the current batch.")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_shutdown)
+        signal.signal(signal.SIGINT, request_shutdown)
+
+        watch_download_directory(process_download_batch, current_directory, arguments.settle_time,
+                                 arguments.max_batch_size, arguments.max_batch_delay, arguments.poll_interval,
+                                 stop_event)
+        if library_index is not None:
+            library_index.close()
+        if sort_history is not None:
+            sort_history.close()
+        exit(0)
+
+    # Everything is worked out from a single scan before anything is moved.
+    sort_plan = plan_sort(history=sort_history, artist_index=library_artist_index)
+    if arguments.dry_run:
+        print(json.dumps(sort_plan, indent=4, ensure_ascii=False))
+        if sort_history is not None:
+            sort_history.close()
+        exit(0)
+
+    print_line("-", 80)
+    print(f"Sorting doujins into {str(dummy_directory)}...\n")
+    with ParallelMover(arguments.workers, arguments.copy_workers) as mover:
+        apply_plan(sort_plan, mover, sort_history)
+
+    library_index = None if arguments.no_index else DoujinshiIndex(arguments.index_path, accepted_formats)
+    prompt_merge_into_doujinshi_directory(library_index, sort_history, arguments.delete_identical)
+    if library_index is not None:
+        logging.info(f"Library index statistics: {library_index.statistics()}")
+        library_index.close()
+    if sort_history is not None:
+        sort_history.close()
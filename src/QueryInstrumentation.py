@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# QueryInstrumentation.py
+# Query timing for DatabaseTest.py and IPGeolocator.py.
+#
+# A QueryInstrumentation object is handed to a ConnectionPool, which wraps every
+# cursor it gives out in an InstrumentedCursor. Each execute()/executemany() is
+# timed and counted per statement (multi-row VALUES lists and IN lists are
+# folded together so a batch of 500 and a batch of 37 count as the same
+# statement), commits are timed separately, and the slowest queries are kept as
+# samples. The numbers can be written out as JSON or in the Prometheus text
+# format when the script exits.
+# -------------------------------------------------------------------------------
+
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+import heapq
+import json
+import logging
+import re
+
+DEFAULT_SLOW_QUERY_THRESHOLD = 0.5
+DEFAULT_SLOW_QUERY_SAMPLE_SIZE = 20
+EXPORT_FORMAT_LIST = ["json", "prometheus"]
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket is +Inf.
+LATENCY_BUCKET_LIST = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# A run of two or more identical "(?, ?)" / "(%s,%s)" tuples, as produced by multi-row INSERTs.
+REPEATED_TUPLE_PATTERN = re.compile(r"(\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\))(?:\s*,\s*\1)+")
+# The placeholders of an IN (...) list.
+PLACEHOLDER_LIST_PATTERN = re.compile(r"(?:%s|\?)(?:\s*,\s*(?:%s|\?))+")
+
+
+@lru_cache(maxsize=256)
+def normalize_statement(statement: str):
+    """Return the statement with its whitespace collapsed and variable-length placeholder lists folded into one."""
+    statement = WHITESPACE_PATTERN.sub(" ", statement).strip()
+    statement = REPEATED_TUPLE_PATTERN.sub(r"\1, ...", statement)
+    return PLACEHOLDER_LIST_PATTERN.sub("?, ...", statement) if " IN (" in statement.upper() else statement
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets, plus the count, sum and maximum."""
+
+    def __init__(self):
+        self.bucket_count_list = [0] * (len(LATENCY_BUCKET_LIST) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, value):
+        """Add a single latency (in seconds) to the histogram."""
+        index = 0
+        while index < len(LATENCY_BUCKET_LIST) and value > LATENCY_BUCKET_LIST[index]:
+            index += 1
+        self.bucket_count_list[index] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def cumulative_bucket_list(self):
+        """Return a list of (upper_bound, count of values <= upper_bound) pairs, ending with +Inf."""
+        result_list = []
+        running_count = 0
+        for upper_bound, bucket_count in zip(LATENCY_BUCKET_LIST + [float("inf")], self.bucket_count_list):
+            running_count += bucket_count
+            result_list.append((upper_bound, running_count))
+        return result_list
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": (self.total / self.count) if self.count else 0.0,
+            "max": self.maximum,
+            "buckets": {("+Inf" if upper_bound == float("inf") else str(upper_bound)): count
+                        for upper_bound, count in self.cumulative_bucket_list()}
+        }
+
+
+class QueryInstrumentation:
+    """Thread-safe collector of per-statement latencies, row counts, commit times and slow query samples."""
+
+    def __init__(self, slow_query_threshold=DEFAULT_SLOW_QUERY_THRESHOLD,
+                 slow_query_sample_size=DEFAULT_SLOW_QUERY_SAMPLE_SIZE):
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_query_sample_size = max(0, slow_query_sample_size)
+
+        self.lock = Lock()
+        self.histogram_dict = {}
+        self.row_count_dict = {}
+        self.error_count_dict = {}
+        self.commit_histogram = LatencyHistogram()
+        # Min-heap of (elapsed_time, sequence, sample) so the fastest of the slow queries is dropped first.
+        self.slow_query_heap = []
+        self.sequence = 0
+
+    def record_query(self, statement: str, elapsed_time, row_count=0, parameter_count=0, failed=False):
+        """Record one execute()/executemany() call."""
+        normalized_statement = normalize_statement(statement)
+
+        with self.lock:
+            histogram = self.histogram_dict.get(normalized_statement)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.histogram_dict.update({normalized_statement: histogram})
+            histogram.observe(elapsed_time)
+
+            if row_count and row_count > 0:
+                self.row_count_dict[normalized_statement] = self.row_count_dict.get(normalized_statement, 0) + row_count
+            if failed:
+                self.error_count_dict[normalized_statement] = self.error_count_dict.get(normalized_statement, 0) + 1
+
+            if elapsed_time >= self.slow_query_threshold and self.slow_query_sample_size:
+                self.sequence += 1
+                sample = {"statement": normalized_statement, "seconds": elapsed_time,
+                          "rows": row_count, "parameters": parameter_count}
+                if len(self.slow_query_heap) < self.slow_query_sample_size:
+                    heapq.heappush(self.slow_query_heap, (elapsed_time, self.sequence, sample))
+                else:
+                    heapq.heappushpop(self.slow_query_heap, (elapsed_time, self.sequence, sample))
+
+        if elapsed_time >= self.slow_query_threshold:
+            logging.debug(f"QueryInstrumentation: Slow query ({elapsed_time:.3f}s): {normalized_statement[:200]}")
+
+    def record_fetched_rows(self, statement: str, row_count):
+        """Add rows read with fetchone()/fetchmany()/fetchall() to the statement's row count."""
+        if not row_count:
+            return
+        normalized_statement = normalize_statement(statement)
+        with self.lock:
+            self.row_count_dict[normalized_statement] = self.row_count_dict.get(normalized_statement, 0) + row_count
+
+    def record_commit(self, elapsed_time):
+        """Record how long a commit took."""
+        with self.lock:
+            self.commit_histogram.observe(elapsed_time)
+
+    def to_dict(self):
+        """Return everything that was recorded as a JSON-serializable dict."""
+        with self.lock:
+            return {
+                "queries": {
+                    statement: dict(histogram.to_dict(), rows=self.row_count_dict.get(statement, 0),
+                                    errors=self.error_count_dict.get(statement, 0))
+                    for statement, histogram in self.histogram_dict.items()
+                },
+                "commits": self.commit_histogram.to_dict(),
+                "slow_queries": [sample for _, _, sample in sorted(self.slow_query_heap, reverse=True)]
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=4)
+
+    def to_prometheus(self):
+        """Return the recorded metrics in the Prometheus text exposition format."""
+        line_list = []
+
+        def add_histogram(name, histogram, label=""):
+            separator = "," if label else ""
+            for upper_bound, count in histogram.cumulative_bucket_list():
+                bound = "+Inf" if upper_bound == float("inf") else repr(upper_bound)
+                line_list.append(f'{name}_bucket{{{label}{separator}le="{bound}"}} {count}')
+            label_block = f"{{{label}}}" if label else ""
+            line_list.append(f"{name}_sum{label_block} {histogram.total}")
+            line_list.append(f"{name}_count{label_block} {histogram.count}")
+
+        with self.lock:
+            line_list.append("# HELP database_query_duration_seconds Time spent in execute()/executemany().")
+            line_list.append("# TYPE database_query_duration_seconds histogram")
+            for statement, histogram in self.histogram_dict.items():
+                add_histogram("database_query_duration_seconds", histogram,
+                              f'statement="{escape_label_value(statement)}"')
+
+            line_list.append("# HELP database_query_rows_total Rows affected or returned per statement.")
+            line_list.append("# TYPE database_query_rows_total counter")
+            for statement, row_count in self.row_count_dict.items():
+                line_list.append(f'database_query_rows_total{{statement="{escape_label_value(statement)}"}} '
+                                 f'{row_count}')
+
+            line_list.append("# HELP database_query_errors_total Statements that raised an error.")
+            line_list.append("# TYPE database_query_errors_total counter")
+            for statement, error_count in self.error_count_dict.items():
+                line_list.append(f'database_query_errors_total{{statement="{escape_label_value(statement)}"}} '
+                                 f'{error_count}')
+
+            line_list.append("# HELP database_commit_duration_seconds Time spent in commit().")
+            line_list.append("# TYPE database_commit_duration_seconds histogram")
+            add_histogram("database_commit_duration_seconds", self.commit_histogram)
+
+        return "\n".join(line_list) + "\n"
+
+    def export(self, output_path, export_format="json"):
+        """Write the metrics to output_path in the given format ("json" or "prometheus")."""
+        content = self.to_prometheus() if export_format == "prometheus" else self.to_json()
+        try:
+            with open(output_path, "w") as output_file:
+                output_file.write(content)
+            logging.info(f"QueryInstrumentation: Wrote query metrics to {output_path}")
+        except OSError as error:
+            logging.warning(f"QueryInstrumentation: Could not write query metrics to {output_path}: {error}")
+
+
+def escape_label_value(value: str):
+    """Escape a string so it can be used as a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def count_parameters(parameter_list):
+    """Return the number of parameter sets passed to execute() (1) or executemany() (len)."""
+    try:
+        return len(parameter_list)
+    except TypeError:
+        return 0
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that times execute() and executemany(). Everything else is forwarded to the real cursor."""
+
+    def __init__(self, cursor, instrumentation: QueryInstrumentation):
+        self.cursor = cursor
+        self.instrumentation = instrumentation
+        self.last_statement = None
+
+    def __getattr__(self, attribute):
+        return getattr(self.cursor, attribute)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def timed_call(self, method, statement, parameters, parameter_count):
+        """Call method(statement, parameters) and record how long it took."""
+        self.last_statement = statement
+        start_time = perf_counter()
+        try:
+            result = method(statement, parameters) if parameters is not None else method(statement)
+        except Exception:
+            self.instrumentation.record_query(statement, perf_counter() - start_time, 0, parameter_count, True)
+            raise
+
+        elapsed_time = perf_counter() - start_time
+        # SELECTs report a rowcount of -1 until their rows are fetched, so those are counted in the fetch methods.
+        row_count = getattr(self.cursor, "rowcount", 0) or 0
+        self.instrumentation.record_query(statement, elapsed_time, max(0, row_count), parameter_count)
+        return result
+
+    def execute(self, statement, parameters=None):
+        return self.timed_call(self.cursor.execute, statement, parameters, 1)
+
+    def executemany(self, statement, parameter_list):
+        return self.timed_call(self.cursor.executemany, statement, parameter_list, count_parameters(parameter_list))
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None and self.last_statement is not None:
+            self.instrumentation.record_fetched_rows(self.last_statement, 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        row_list = self.cursor.fetchmany(*args, **kwargs)
+        if self.last_statement is not None:
+            self.instrumentation.record_fetched_rows(self.last_statement, len(row_list))
+        return row_list
+
+    def fetchall(self):
+        row_list = self.cursor.fetchall()
+        if self.last_statement is not None:
+            self.instrumentation.record_fetched_rows(self.last_statement, len(row_list))
+        return row_list
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# SortHistory.py
+# Persistent record of every doujin Move_Doujinshi.py has sorted.
+#
+# Each filename is stored with the artist it was resolved to, the path it was
+# moved to and when that happened. Move_Doujinshi.py looks the artist up here
+# before parsing a filename, so only new or renamed files are parsed again,
+# and keeps the destination up to date as directories are merged into the
+# library. That also answers "where did this file go?" without walking the
+# library.
+#
+# Usage: ./SortHistory.py "some_file.zip"
+# -------------------------------------------------------------------------------
+
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from time import time
+import argparse
+import logging
+import os
+import sqlite3
+
+DEFAULT_HISTORY_PATH = Path.home() / ".cache" / "move_doujinshi" / "sort_history.sqlite3"
+DEFAULT_RESULT_LIMIT = 20
+
+# SQLite only accepts so many parameters per statement, so lookups are done in chunks of this size.
+LOOKUP_CHUNK_SIZE = 500
+
+
+class SortHistory:
+    """SQLite backed filename -> (artist, destination, processed_at) store. It's safe to use from several threads.
+
+    With read_only, an existing history is opened without creating or changing anything (sqlite3.OperationalError
+    is raised if there's none), and record() and relocate() can't be used.
+    """
+
+    def __init__(self, database_path=DEFAULT_HISTORY_PATH, read_only=False):
+        self.database_path = Path(database_path)
+        self.lock = Lock()
+
+        if read_only:
+            logging.debug(f"SortHistory: Opening history at {str(self.database_path)} read-only")
+            self.connection = sqlite3.connect(f"{self.database_path.resolve().as_uri()}?mode=ro", uri=True,
+                                              check_same_thread=False)
+            return
+
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        logging.debug(f"SortHistory: Opening history at {str(self.database_path)}")
+        self.connection = sqlite3.connect(str(self.database_path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS sorted_file(
+        filename TEXT PRIMARY KEY,
+        artist TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        processed_at REAL NOT NULL)
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS index_sorted_destination ON sorted_file(destination)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM sorted_file").fetchone()[0]
+
+    def close(self):
+        """Close the underlying SQLite connection."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def lookup_artists(self, filename_list):
+        """Return a {filename: artist} dict for every filename in filename_list that has been sorted before."""
+        filename_list = list(filename_list)
+        artist_dict = {}
+
+        with self.lock:
+            for start in range(0, len(filename_list), LOOKUP_CHUNK_SIZE):
+                chunk = filename_list[start:start + LOOKUP_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                artist_dict.update(self.connection.execute(
+                    f"SELECT filename, artist FROM sorted_file WHERE filename IN ({placeholders})", chunk))
+
+        return artist_dict
+
+    def record(self, entry_list):
+        """Store a list of (filename, artist, destination) tuples, replacing older records of the same filenames."""
+        processed_at = time()
+        with self.lock:
+            self.connection.executemany("""
+            INSERT INTO sorted_file (filename, artist, destination, processed_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(filename) DO UPDATE SET artist = excluded.artist, destination = excluded.destination,
+            processed_at = excluded.processed_at
+            """, [(filename, artist, str(destination), processed_at) for filename, artist, destination in entry_list])
+            self.connection.commit()
+
+    def relocate(self, old_path, new_path):
+        """Point every record whose destination is old_path, or lies under it, at new_path instead.
+
+        Returns the number of records that were updated.
+        """
+        old_path, new_path = str(old_path).rstrip(os.sep), str(new_path).rstrip(os.sep)
+        # Everything under old_path sorts between "old_path/" and "old_path0" ("0" comes right after "/"), so the
+        # destination index can be used. LIKE would also treat _ and % in the name as wildcards.
+        lower_bound, upper_bound = old_path + os.sep, old_path + chr(ord(os.sep) + 1)
+        with self.lock:
+            cursor = self.connection.execute("""
+            UPDATE sorted_file SET destination = ? || substr(destination, ?)
+            WHERE destination = ? OR (destination >= ? AND destination < ?)
+            """, (new_path, len(old_path) + 1, old_path, lower_bound, upper_bound))
+            self.connection.commit()
+        return cursor.rowcount
+
+    def find(self, filename, limit=DEFAULT_RESULT_LIMIT):
+        """Return the records for filename as dicts. If there's no exact match, filenames containing it are used."""
+        statement = "SELECT filename, artist, destination, processed_at FROM sorted_file"
+        with self.lock:
+            row_list = self.connection.execute(f"{statement} WHERE filename = ?", (filename,)).fetchall()
+            if not row_list:
+                row_list = self.connection.execute(f"{statement} WHERE instr(lower(filename), lower(?)) > 0 "
+                                                   f"ORDER BY processed_at DESC LIMIT ?", (filename, limit)).fetchall()
+
+        return [{"filename": row[0], "artist": row[1], "destination": row[2], "processed_at": row[3]}
+                for row in row_list]
+
+
+def print_records(record_list):
+    """Print the records returned by SortHistory.find()."""
+    for record in record_list:
+        processed_at = datetime.fromtimestamp(record["processed_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{record['filename']}\n    Artist: {record['artist']}\n"
+              f"    Folder: {os.path.dirname(record['destination'])}\n    Sorted: {processed_at}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="Filename (or part of one) to look up.", type=str)
+    parser.add_argument("--history-path", help="Path to the history database.", default=str(DEFAULT_HISTORY_PATH),
+                        type=str)
+    parser.add_argument("--limit", help="Maximum number of partial matches to print.", default=DEFAULT_RESULT_LIMIT,
+                        type=int)
+
+    arguments = parser.parse_args()
+
+    found_list = []
+    if os.path.exists(arguments.history_path):
+        with SortHistory(arguments.history_path, read_only=True) as history:
+            found_list = history.find(arguments.filename, arguments.limit)
+
+    if not found_list:
+        print(f"{arguments.filename} hasn't been sorted yet.")
+        exit(1)
+    print_records(found_list)
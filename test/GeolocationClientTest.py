@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -------------------------------------------------------------------------------
+# GeolocationClientTest.py
+# Checks that GeolocationClient's circuit breaker recovers from a failed
+# half-open trial, whatever kind of requests error the trial ran into.
+# -------------------------------------------------------------------------------
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import requests
+
+from GeolocationClient import GeolocationClient, CircuitOpenError
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    encoding = None
+    text = 'callback({"IPv4": "36.255.159.130"})'
+
+    def raise_for_status(self):
+        pass
+
+
+def make_half_open_client():
+    """Return a client whose circuit is open and due for its half-open trial."""
+    client = GeolocationClient("http://localhost", max_retries=0, rate_limit=0, failure_threshold=1,
+                               reset_timeout=0)
+    client.circuit_breaker.record_failure()
+    assert client.circuit_breaker.is_open
+    return client
+
+
+def test_trial_failing_with_chunked_encoding_error_is_released():
+    with make_half_open_client() as client:
+        def send_broken_request(ip_address):
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+        client.send_request = send_broken_request
+        try:
+            client.fetch_raw_json("36.255.159.130")
+            raise AssertionError("ChunkedEncodingError was swallowed")
+        except CircuitOpenError:
+            raise AssertionError("The trial request was rejected")
+        except requests.exceptions.ChunkedEncodingError:
+            pass
+
+        assert not client.circuit_breaker.trial_in_progress
+
+        # The next trial is let through, and closes the circuit once it succeeds.
+        client.send_request = lambda ip_address: FakeResponse()
+        assert client.fetch_raw_json("36.255.159.130") == '{"IPv4": "36.255.159.130"}'
+        assert not client.circuit_breaker.is_open
+
+
+if __name__ == "__main__":
+    test_trial_failing_with_chunked_encoding_error_is_released()
+    print("OK")
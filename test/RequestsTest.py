@@ -5,7 +5,13 @@
 # RequestsTest.py
 #
 # -------------------------------------------------------------------------------
-from src import IPGeolocator
+import sys
+from pathlib import Path
+
+# IPGeolocator imports its helper modules (GeolocationCache, ...) as siblings, so src/ has to be on the path.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import IPGeolocator
 
 if __name__ == "__main__":
-    print(IPGeolocator.find_ip_geography_info("36.255.159.130"))
+    print(IPGeolocator.lookup_ip_address("36.255.159.130"))